@@ -0,0 +1,337 @@
+# bench/benchmark.py
+"""Offline throughput / latency benchmark for FileServer.
+
+Generates fixture trees, starts FileServer in a child process on
+localhost and drives it with a keep-alive load generator at several
+concurrency levels. Results are printed and saved as JSON so runs can be
+compared:
+
+    python bench/benchmark.py run --engine threaded asyncio -c 1 8 32
+    python bench/benchmark.py compare bench/results/a.json bench/results/b.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config
+from modules import transfer
+
+SCENARIOS = ['large', 'small', 'listing', 'range']
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+READ_CHUNK = 1024 * 1024
+RANGE_SIZE = 64 * 1024
+
+
+def make_fixtures(root, large_mb, small_count, small_size):
+    """Create (or reuse) a tree with one large file and many small ones"""
+    params = {'large_mb': large_mb, 'small_count': small_count, 'small_size': small_size}
+    marker = os.path.join(root, 'fixture.json')
+    try:
+        with open(marker) as f:
+            if json.load(f) == params:
+                return params
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(os.path.join(root, 'large'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'small'), exist_ok=True)
+    print(f"Generating fixtures in {root} ...")
+    with open(os.path.join(root, 'large', 'large.bin'), 'wb') as f:
+        for _ in range(large_mb):
+            f.write(os.urandom(1024 * 1024))
+    line = b'the quick brown fox jumps over the lazy dog\n'
+    body = (line * (small_size // len(line) + 1))[:small_size]
+    for i in range(small_count):
+        with open(os.path.join(root, 'small', f'file{i:05d}.txt'), 'wb') as f:
+            f.write(body)
+    with open(marker, 'w') as f:
+        json.dump(params, f)
+    return params
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_cpu_seconds(pid):
+    """User + system CPU time of a process, or None off Linux"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class ServerProcess:
+    """FileServer running in a child process, stopped by closing its stdin"""
+
+    def __init__(self, root, engine, processes=1):
+        self.port = free_port()
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', root, str(self.port), engine,
+             str(processes)],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                break
+            except OSError:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"{engine} server failed to start")
+                time.sleep(0.05)
+
+    def cpu_seconds(self):
+        """CPU time of the server and, in pre-fork mode, its worker processes"""
+        total = server_cpu_seconds(self.proc.pid)
+        if total is None:
+            return None
+        try:
+            with open(f'/proc/{self.proc.pid}/task/{self.proc.pid}/children') as f:
+                children = f.read().split()
+        except OSError:
+            children = []
+        for pid in children:
+            total += server_cpu_seconds(pid) or 0
+        return total
+
+    def stop(self):
+        self.proc.stdin.close()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def serve(root, port, engine, processes):
+    from modules.server import FileServer
+    server = FileServer(root, int(port), engine, open_browser=False, processes=int(processes))
+    server.start()
+    sys.stdin.read()  # Parent closes stdin to stop us
+    server.stop()
+
+
+def request_for(scenario, params, rng):
+    if scenario == 'large':
+        return '/large/large.bin', {}
+    if scenario == 'small':
+        return f'/small/file{rng.randrange(params["small_count"]):05d}.txt', {}
+    if scenario == 'listing':
+        return '/small/', {}
+    size = params['large_mb'] * 1024 * 1024
+    start = rng.randrange(max(size - RANGE_SIZE, 1))
+    return '/large/large.bin', {'Range': f'bytes={start}-{start + RANGE_SIZE - 1}'}
+
+
+def worker(port, scenario, params, deadline, seed, out):
+    rng = random.Random(seed)
+    buf = bytearray(READ_CHUNK)
+    latencies, nbytes, errors = [], 0, 0
+    conn = None
+    while time.monotonic() < deadline:
+        path, headers = request_for(scenario, params, rng)
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            started = time.perf_counter()
+            conn.request('GET', path, headers=headers)
+            resp = conn.getresponse()
+            while True:
+                n = resp.readinto(buf)
+                if not n:
+                    break
+                nbytes += n
+            latencies.append(time.perf_counter() - started)
+            if resp.status >= 400:
+                errors += 1
+            if resp.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    out.append((latencies, nbytes, errors))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_load(server, scenario, params, concurrency, duration):
+    out = []
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=worker, args=(server.port, scenario, params, deadline, i, out))
+               for i in range(concurrency)]
+    cpu_before = server.cpu_seconds()
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    cpu_after = server.cpu_seconds()
+
+    latencies = [lat for lats, _, _ in out for lat in lats]
+    nbytes = sum(n for _, n, _ in out)
+    errors = sum(e for _, _, e in out)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    gb = nbytes / 1e9
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests': len(latencies),
+        'errors': errors,
+        'bytes': nbytes,
+        'mb_per_s': round(nbytes / elapsed / 1e6, 2),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies) if latencies else None),
+        },
+        'server_cpu_seconds': round(cpu, 3) if cpu is not None else None,
+        'cpu_seconds_per_gb': round(cpu / gb, 3) if cpu is not None and gb else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args, params):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'duration': args.duration,
+        'fixtures': params,
+        'settings': {
+            'BUFFER_SIZE': config.BUFFER_SIZE,
+            'SENDFILE_CHUNK': transfer.SENDFILE_CHUNK,
+            'COPY_CHUNK': transfer.COPY_CHUNK,
+            'WORKER_THREADS': config.WORKER_THREADS,
+            'WORKER_PROCESSES': args.processes,
+            'KEEPALIVE_MAX_REQUESTS': config.KEEPALIVE_MAX_REQUESTS,
+        },
+    }
+
+
+def print_result(engine, r):
+    lat = r['latency_ms']
+    cpu = r['cpu_seconds_per_gb']
+    print(f"{engine:9} {r['scenario']:8} c={r['concurrency']:<4} "
+          f"{r['mb_per_s']:9.1f} MB/s {r['requests_per_s']:9.1f} req/s "
+          f"p50={lat['p50']}ms p99={lat['p99']}ms "
+          f"cpu/GB={cpu if cpu is not None else '-'}s errors={r['errors']}")
+
+
+def cmd_run(args):
+    params = make_fixtures(args.fixtures, args.large_mb, args.small_count, args.small_size)
+    results = []
+    for engine in args.engine:
+        server = ServerProcess(args.fixtures, engine, args.processes)
+        try:
+            for scenario in args.scenario:
+                for concurrency in args.concurrency:
+                    r = run_load(server, scenario, params, concurrency, args.duration)
+                    r['engine'] = engine
+                    print_result(engine, r)
+                    results.append(r)
+        finally:
+            server.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'meta': metadata(args, params), 'results': results}, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+def cmd_compare(args):
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        return {(r['engine'], r['scenario'], r['concurrency']): r for r in data['results']}
+
+    base, new = load(args.base), load(args.new)
+
+    def change(a, b):
+        if a is None or b is None or not a:
+            return '     -'
+        return f'{(b - a) / a * 100:+6.1f}%'
+
+    print(f"{'engine':9} {'scenario':8} {'conc':>4} {'MB/s':>10} {'':>7} {'p99 ms':>10} {'':>7}")
+    for key in sorted(base.keys() & new.keys()):
+        a, b = base[key], new[key]
+        print(f"{key[0]:9} {key[1]:8} {key[2]:4} {b['mb_per_s']:10.1f} {change(a['mb_per_s'], b['mb_per_s'])} "
+              f"{b['latency_ms']['p99'] or 0:10.2f} {change(a['latency_ms']['p99'], b['latency_ms']['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="Run the benchmark and save JSON results")
+    run.add_argument('--engine', nargs='+', default=['threaded'], choices=['threaded', 'asyncio'])
+    run.add_argument('--scenario', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    run.add_argument('-c', '--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    run.add_argument('-p', '--processes', type=int, default=1,
+                     help="Pre-fork worker processes (0 = one per CPU core)")
+    run.add_argument('-d', '--duration', type=float, default=10.0, help="Seconds per measurement")
+    run.add_argument('--fixtures', default=os.path.join(RESULTS_DIR, 'fixtures'))
+    run.add_argument('--large-mb', type=int, default=256)
+    run.add_argument('--small-count', type=int, default=2000)
+    run.add_argument('--small-size', type=int, default=4096)
+    run.add_argument('-o', '--output', help="JSON file (default: bench/results/<timestamp>.json)")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser('compare', help="Compare two saved runs")
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.set_defaults(func=cmd_compare)
+
+    serve_cmd = sub.add_parser('serve', help=argparse.SUPPRESS)
+    serve_cmd.add_argument('root')
+    serve_cmd.add_argument('port')
+    serve_cmd.add_argument('engine')
+    serve_cmd.add_argument('processes', nargs='?', default='1')
+    serve_cmd.set_defaults(func=lambda a: serve(a.root, a.port, a.engine, a.processes))
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,103 @@
 # config.py
 
+import os
+
 PORT = 8000
 BUFFER_SIZE = 8192
-MAX_SERVERS = 5
-DEFAULT_MOUNT_PREFIX = '/tmp/usb_share_'
\ No newline at end of file
+DEFAULT_MOUNT_PREFIX = '/tmp/usb_share_'
+
+# Serving engine: 'threaded' (fixed worker pool) or 'asyncio'
+SERVER_ENGINE = 'threaded'
+
+# Seconds browsers may reuse a file before revalidating it with its ETag
+FILE_CACHE_MAX_AGE = 3600
+
+# Number of directory listings kept in memory (0 disables the cache)
+LISTING_CACHE_SIZE = 256
+
+# Entries shown per listing page (override with ?limit=)
+LISTING_PAGE_SIZE = 2000
+
+# Directory for on-disk caches (compressed variants, indexes, thumbnails)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'usb_share')
+
+# Compress text-like responses for clients sending Accept-Encoding
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CACHE_SIZE = 512 * 1024 * 1024  # bytes of compressed variants kept on disk
+
+# Accept PUT uploads onto shared drives (off by default: shares are read-only)
+UPLOADS_ENABLED = False
+# Seconds before an upload nobody resumes is deleted (0 keeps them forever)
+UPLOAD_PARTIAL_MAX_AGE = 24 * 3600
+
+# HTTP/1.1 keep-alive: idle seconds before a connection is closed, and
+# requests served on one connection before the server asks to reconnect
+KEEPALIVE_TIMEOUT = 15
+KEEPALIVE_MAX_REQUESTS = 100
+
+# Threaded engine admission control: connections only take a worker while
+# a request is being served (idle ones wait in a selector), requests beyond
+# the pool wait in a queue, and a full queue or a client IP with
+# MAX_CONNECTIONS_PER_IP requests in progress gets 503 + Retry-After
+WORKER_THREADS = 32
+WORKER_QUEUE_SIZE = 64
+MAX_CONNECTIONS_PER_IP = 8
+RETRY_AFTER = 2  # seconds
+
+# HTTPS: TLS with TLS_CERT_FILE/TLS_KEY_FILE (PEM), or with a self-signed
+# certificate generated in CACHE_DIR/tls when they are None
+TLS_ENABLED = False
+TLS_CERT_FILE = None
+TLS_KEY_FILE = None
+# TLS 1.3 session tickets sent per handshake so clients can resume (0 disables)
+TLS_SESSION_TICKETS = 2
+
+# Pre-fork mode: worker processes that all accept on PORT (SO_REUSEPORT)
+# so serving is not limited to one core by the GIL; a supervisor restarts
+# workers that die. 1 = single process, 0 = one per CPU core. Bandwidth
+# caps hold for all workers together; BLOCK_CACHE_SIZE is split between
+# them, and MAX_CONNECTIONS_PER_IP applies to each worker on its own.
+WORKER_PROCESSES = 1
+
+# Bandwidth caps in bytes/s (0 = unlimited), adjustable at runtime through
+# modules.throttle.shaper: all shares, each share, and each client IP
+BANDWIDTH_LIMIT = 0
+SHARE_BANDWIDTH_LIMIT = 0
+CLIENT_BANDWIDTH_LIMIT = 0
+
+# URL path of the Prometheus metrics endpoint (None to disable); it
+# shadows a file of the same name at the share root
+METRICS_PATH = '/metrics'
+
+# Memory for the shared block cache: while several clients download the
+# same file, all of them (the first one included) read it through the
+# cache, so the USB device reads each block once from then on (0 disables)
+BLOCK_CACHE_SIZE = 128 * 1024 * 1024
+
+# Files at least this big are dropped from the page cache as they stream
+# out, so one huge download does not evict hot files (0 disables)
+FADVISE_DROP_BEHIND_SIZE = 256 * 1024 * 1024
+
+# Background metadata index (SQLite in CACHE_DIR) behind ?q= search;
+# shares are rescanned for changed directories every interval (seconds)
+SEARCH_INDEX_ENABLED = True
+INDEX_RESCAN_INTERVAL = 300
+SEARCH_RESULTS_LIMIT = 200
+
+# Background SHA-256 of every shared file (SQLite in CACHE_DIR), sent as
+# Repr-Digest/Digest headers and listed by ?manifest. Hashing reads at most
+# DIGEST_RATE_LIMIT bytes/s (0 = unlimited) so downloads keep the device;
+# shares are re-walked for new and changed files every interval (seconds)
+DIGESTS_ENABLED = True
+DIGEST_RATE_LIMIT = 16 * 1024 * 1024
+DIGEST_RESCAN_INTERVAL = 3600
+
+# Previews behind ?thumbnail and the grid listing view (?view=grid): longest
+# edge in pixels, JPEG quality, generator threads and disk cache in
+# CACHE_DIR/thumbnails. Images need Pillow or ffmpeg, videos need ffmpeg.
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_CACHE_SIZE = 256 * 1024 * 1024
+THUMBNAIL_TIMEOUT = 20  # Seconds a request waits for its preview to be made
@@ -1,27 +1,32 @@
 # main.py
 
 from modules.usb_manager import USBManager
-from modules.server import FileServer
+from modules.server import MultiShareServer
 import os
+import sys
 import time
 import threading
-from config import PORT, MAX_SERVERS, DEFAULT_MOUNT_PREFIX  # Changed BASE_PORT to PORT
+from config import PORT, DEFAULT_MOUNT_PREFIX  # Changed BASE_PORT to PORT
 
 class USBFileSharing:
     def __init__(self):
-        self.servers = []
+        # Every drive is served by one server on PORT under /share/<label>/
+        self.server = None
         self.active_mounts = []
 
-    def start_server(self, mount_point, port):
-        server = FileServer(mount_point, port)
-        server.start()
-        return server
+    def share_drive(self, mount_point, label):
+        if self.server is None:
+            self.server = MultiShareServer(PORT)
+            self.server.start()
+            if self.server.httpd is None:
+                self.server = None
+                return None
+        return self.server.add_share(mount_point, label)
 
     def cleanup(self):
         print("\nCleaning up...")
-        # Stop all servers
-        for server in self.servers:
-            server.stop()
+        if self.server:
+            self.server.stop()
         
         # Unmount all drives
         for mount_point in self.active_mounts:
@@ -31,7 +36,7 @@ class USBFileSharing:
     def run(self):
         print("USB File Sharing Server")
         print("======================")
-        print(f"You can share up to {MAX_SERVERS} drives simultaneously")
+        print(f"All drives are shared on port {PORT}")
         
         # Check for NTFS support
         if not USBManager.check_ntfs_support():
@@ -43,7 +48,8 @@ class USBFileSharing:
         try:
             while True:
                 # Get available drives
-                drives = USBManager.get_usb_drives()
+                partitions = USBManager.get_usb_partitions()
+                drives = [(dev.name, dev.describe()) for dev in partitions]
                 if not drives:
                     print("\nNo USB drives detected!")
                     print("Make sure your USB drive is properly connected and has valid partitions.")
@@ -54,11 +60,6 @@ class USBFileSharing:
                 for i, (_, drive_info) in enumerate(drives, 1):
                     print(f"{i}. {drive_info}")
 
-                if len(self.servers) >= MAX_SERVERS:
-                    print(f"\nMaximum number of servers ({MAX_SERVERS}) reached!")
-                    print("Stop the program to reset or use existing servers.")
-                    break
-
                 # Get user choice
                 try:
                     choice = input("\nSelect USB drive number (or 'q' to quit): ")
@@ -83,23 +84,20 @@ class USBFileSharing:
                     print(f"Using mount point: {mount_point}")
                     self.active_mounts.append(mount_point)
 
-                    # Start the server with incremented port
-                    port = PORT + len(self.servers)  # Changed from BASE_PORT to PORT
-                    server = self.start_server(mount_point, port)
-                    self.servers.append(server)
+                    # Add the drive to the shared server under its label
+                    label = self.share_drive(mount_point, partitions[choice].label or device_name)
+                    if label is None:
+                        print("Failed to start the server!")
+                        break
 
-                    print(f"\nCurrently sharing {len(self.servers)} drive(s)")
+                    print(f"\nCurrently sharing {len(self.server.shares)} drive(s)")
                     print("Press Enter to share another drive or 'q' to quit")
 
                 except ValueError:
                     print("Invalid input! Please enter a number.")
 
-                if len(self.servers) >= MAX_SERVERS:
-                    print(f"\nMaximum number of servers ({MAX_SERVERS}) reached!")
-                    break
-
             # Wait for user to quit
-            print("\nServers are running. Press Ctrl+C to stop all servers.")
+            print("\nServer is running. Press Ctrl+C to stop sharing.")
             while True:
                 time.sleep(1)
 
@@ -109,5 +107,10 @@ class USBFileSharing:
             self.cleanup()
 
 if __name__ == "__main__":
-    sharing = USBFileSharing()
-    sharing.run()
\ No newline at end of file
+    if '--daemon' in sys.argv[1:]:
+        # Headless: share every drive while it is plugged in
+        from modules.daemon import HotplugDaemon
+        HotplugDaemon().run_forever()
+    else:
+        sharing = USBFileSharing()
+        sharing.run()
\ No newline at end of file
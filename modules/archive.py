@@ -0,0 +1,173 @@
+# modules/archive.py
+
+import os
+import stat
+import time
+import tarfile
+import zipfile
+import urllib.parse
+from modules.upload import is_partial_upload
+from modules.transfer import readahead_for
+
+READ_CHUNK = 1024 * 1024
+ARCHIVE_TYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+
+def walk_tree(root, base_path):
+    """Yield (relative name, full path, stat) for everything below root.
+
+    Symlinks are only followed when they resolve inside base_path, and
+    symlinked directories are never descended into, so the walk cannot
+    leave the share or loop.
+    """
+    real_base = os.path.realpath(base_path)
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel_dir)) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if is_partial_upload(entry.name):
+                continue
+            rel = os.path.join(rel_dir, entry.name)
+            try:
+                if entry.is_symlink():
+                    real = os.path.realpath(entry.path)
+                    if real != real_base and not real.startswith(real_base + os.sep):
+                        continue
+                    st = os.stat(entry.path)
+                    if stat.S_ISDIR(st.st_mode):
+                        continue
+                else:
+                    st = entry.stat()
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                yield rel, entry.path, st
+                stack.append(rel)
+            elif stat.S_ISREG(st.st_mode):
+                yield rel, entry.path, st
+
+
+class _ChunkBuffer:
+    """Write-only sink that collects output until the generator drains it"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.parts:
+            data = b''.join(self.parts)
+            self.parts = []
+            yield data
+
+
+def _zip_date_time(mtime):
+    # ZIP timestamps cannot predate 1980
+    return time.localtime(max(mtime, 315532800))[:6]
+
+
+def iter_zip(root, base_path):
+    """Stream a store-mode ZIP of a directory tree in constant memory.
+
+    Entries use data descriptors (the output is never seeked) and switch to
+    ZIP64 records for files over 4 GB or archives past 65535 entries.
+    """
+    buf = _ChunkBuffer()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for rel, full, st in walk_tree(root, base_path):
+            arcname = rel.replace(os.sep, '/')
+            if stat.S_ISDIR(st.st_mode):
+                zinfo = zipfile.ZipInfo(arcname + '/', _zip_date_time(st.st_mtime))
+                zinfo.external_attr = (0o40755 << 16) | 0x10
+                zf.writestr(zinfo, b'')
+                yield from buf.drain()
+                continue
+            try:
+                f = open(full, 'rb')
+            except OSError:
+                continue
+            with f:
+                readahead = readahead_for(f, 0, st.st_size, st.st_size)
+                zinfo = zipfile.ZipInfo(arcname, _zip_date_time(st.st_mtime))
+                zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                zinfo.compress_type = zipfile.ZIP_STORED
+                with zf.open(zinfo, 'w', force_zip64=st.st_size >= zipfile.ZIP64_LIMIT) as dest:
+                    while True:
+                        data = f.read(READ_CHUNK)
+                        if not data:
+                            break
+                        dest.write(data)
+                        if readahead:
+                            readahead.after(f.tell() - len(data), len(data))
+                        yield from buf.drain()
+            yield from buf.drain()
+    # Central directory
+    yield from buf.drain()
+
+
+def iter_tar(root, base_path):
+    """Stream a POSIX (pax) tar of a directory tree in constant memory"""
+    for rel, full, st in walk_tree(root, base_path):
+        info = tarfile.TarInfo(rel.replace(os.sep, '/'))
+        info.mtime = int(st.st_mtime)
+        info.mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+            yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            continue
+        try:
+            f = open(full, 'rb')
+        except OSError:
+            continue
+        with f:
+            readahead = readahead_for(f, 0, st.st_size, st.st_size)
+            info.size = st.st_size
+            yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            # The header promised st_size bytes: pad or truncate to match
+            remaining = st.st_size
+            while remaining > 0:
+                data = f.read(min(READ_CHUNK, remaining))
+                if not data:
+                    data = bytes(min(READ_CHUNK, remaining))
+                elif readahead:
+                    readahead.after(st.st_size - remaining, len(data))
+                remaining -= len(data)
+                yield data
+            padding = -st.st_size % tarfile.BLOCKSIZE
+            if padding:
+                yield bytes(padding)
+    yield bytes(tarfile.BLOCKSIZE * 2)
+
+
+def archive_chunks(kind, root, base_path):
+    if kind == 'zip':
+        return iter_zip(root, base_path)
+    return iter_tar(root, base_path)
+
+
+def parse_archive_query(query):
+    """Archive kind requested with ?download=zip|tar, or None"""
+    kind = urllib.parse.parse_qs(query).get('download', [None])[0]
+    return kind if kind in ARCHIVE_TYPES else None
+
+
+def content_disposition(root, base_path, kind):
+    name = os.path.basename(root.rstrip(os.sep)) if root != base_path else 'share'
+    filename = f'{name or "share"}.{kind}'
+    ascii_name = filename.encode('ascii', 'replace').decode('ascii').replace('"', '_')
+    return (f'attachment; filename="{ascii_name}"; '
+            f"filename*=UTF-8''{urllib.parse.quote(filename, safe='')}")
@@ -0,0 +1,715 @@
+# modules/async_server.py
+
+import asyncio
+import threading
+import socket
+import sqlite3
+import sys
+import time
+import os
+import io
+import stat
+import html
+import mimetypes
+import http.client
+import email.utils
+import urllib.parse
+from http import HTTPStatus
+from modules.utils import translate_url_path
+from modules.transfer import readahead_for, SEQUENTIAL_MIN
+from modules.throttle import shaper
+from modules.blockcache import block_cache
+from modules.metrics import registry as metrics, record_transfer, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from modules.listing import render_listing, parse_listing_query, LISTING_CONTENT_TYPES
+from modules.validators import (make_etag, make_listing_etag, encoded_etag, last_modified,
+                                is_not_modified, FILE_CACHE_CONTROL, LISTING_CACHE_CONTROL)
+from modules.compression import (is_compressible, select_variant, listing_encoding,
+                                 compressed_file_chunks, LISTING_VARY)
+from modules.search import parse_search_query, search_share, render_search
+from modules.shares import render_share_index, share_url_path
+from modules.archive import parse_archive_query, archive_chunks, content_disposition, ARCHIVE_TYPES
+from modules.digests import digest_headers, parse_manifest_query, manifest_chunks, MANIFEST_TYPES
+from modules.thumbnails import (parse_thumbnail_query, thumbnail_kind, thumbnail_etag, thumbnailer,
+                                CONTENT_TYPE as THUMBNAIL_CONTENT_TYPE)
+from modules.upload import Upload, UploadError, parse_content_range, UPLOAD_CHUNK
+from modules.ranges import (parse_ranges, if_range_matches, content_range,
+                            unsatisfiable_range, multipart_byteranges)
+from config import (UPLOADS_ENABLED, KEEPALIVE_TIMEOUT, KEEPALIVE_MAX_REQUESTS, METRICS_PATH, RETRY_AFTER,
+                    THUMBNAIL_TIMEOUT)
+
+MAX_HEADER_SIZE = 65536
+
+
+class AsyncFileServer:
+    """Single-threaded asyncio server exposing the same routes as USBFileHandler.
+
+    Mirrors the socketserver API used by FileServer (serve_forever, shutdown,
+    server_close) so the two engines are interchangeable. With an
+    ssl_context, TLS runs in asyncio's SSL transport; file bodies then go
+    through the block cache or loop.sendfile's buffered fallback.
+    """
+    server_version = "USBFileShare/1.0"
+    request_queue_size = 1024
+
+    def __init__(self, server_address, directory, port=None, shares=None, reuse_port=False,
+                 ssl_context=None):
+        # With a ShareTable the directory is picked per request from the URL
+        self.base_path = os.path.abspath(directory) if directory else ''
+        self.shares = shares
+        self.port = port
+        self.ssl_context = ssl_context
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4194304)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            self.socket.bind(server_address)
+            self.socket.listen(self.request_queue_size)
+        except OSError:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.loop = asyncio.new_event_loop()
+        self._stopped = asyncio.Event()
+        self._done = threading.Event()
+        self._connections = set()
+
+    def serve_forever(self):
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+            self._done.set()
+
+    async def _serve(self):
+        server = await asyncio.start_server(
+            self.handle_connection, sock=self.socket, limit=MAX_HEADER_SIZE, ssl=self.ssl_context,
+            ssl_handshake_timeout=KEEPALIVE_TIMEOUT if self.ssl_context else None)
+        async with server:
+            await self._stopped.wait()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def shutdown(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._stopped.set)
+        self._done.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        metrics.inc('usb_share_active_connections')
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            # Headers and small bodies are separate writes; don't let Nagle
+            # wait for the client's delayed ACK between them
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        requests_handled = 0
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                request = AsyncRequest.parse(head, writer.get_extra_info('peername'))
+                if request is not None:
+                    request.reader = reader
+                    request.tls = self.ssl_context is not None
+                    requests_handled += 1
+                    if requests_handled >= KEEPALIVE_MAX_REQUESTS:
+                        request.keep_alive = False
+                    request.remaining = KEEPALIVE_MAX_REQUESTS - requests_handled
+                if request is None:
+                    await self.send_error(writer, None, 400, "Bad request")
+                    break
+                try:
+                    keep_alive = await self.handle_request(request, writer)
+                except (ConnectionError, OSError):
+                    break
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass  # Server shutting down
+        finally:
+            self._connections.discard(task)
+            metrics.dec('usb_share_active_connections')
+            writer.close()
+
+    async def handle_request(self, request, writer):
+        request.base_path = self.base_path
+        if request.method == 'PUT':
+            request.route = 'upload'
+            return await self.handle_put(request, writer)
+        if request.has_body:
+            request.keep_alive = False  # Only PUT reads bodies; this one is left unread
+        if request.method not in ('GET', 'HEAD'):
+            request.keep_alive = False  # Any request body is left unread
+            await self.send_error(writer, request, 501, f"Unsupported method ({request.method})")
+            return False
+
+        if METRICS_PATH and urllib.parse.urlsplit(request.path).path == METRICS_PATH:
+            request.route = 'metrics'
+            body = metrics.render()
+            await self.send_response(writer, request, 200, [
+                ('Content-Type', METRICS_CONTENT_TYPE),
+                ('Content-Length', str(len(body))),
+                ('Cache-Control', 'no-store'),
+            ], body)
+            return request.keep_alive
+
+        if self.shares is not None and not await self.select_share(writer, request):
+            return request.keep_alive
+        loop = asyncio.get_running_loop()
+        path = self.translate_path(request)
+        try:
+            st = await loop.run_in_executor(None, os.stat, path)
+        except OSError:
+            await self.send_error(writer, request, 404, "File not found")
+            return request.keep_alive
+
+        if stat.S_ISDIR(st.st_mode):
+            query = urllib.parse.urlsplit(request.path).query
+            search = parse_search_query(query)
+            if search:
+                request.route = 'search'
+                return await self.send_search(writer, request, path, *search)
+            kind = parse_archive_query(query)
+            if kind:
+                request.route = 'archive'
+                return await self.send_chunks(writer, request, 200, [
+                    ('Content-Type', ARCHIVE_TYPES[kind]),
+                    ('Content-Disposition', content_disposition(path, request.base_path, kind)),
+                    ('Cache-Control', 'no-store'),
+                ], archive_chunks(kind, path, request.base_path))
+            manifest = parse_manifest_query(query)
+            if manifest:
+                request.route = 'manifest'
+                return await self.send_chunks(writer, request, 200, [
+                    ('Content-Type', MANIFEST_TYPES[manifest]),
+                    ('Cache-Control', 'no-store'),
+                ], manifest_chunks(path, request.base_path, manifest))
+            request.route = 'listing'
+            started = time.perf_counter()
+            try:
+                return await self.send_listing(writer, request, path, st)
+            finally:
+                metrics.observe('usb_share_listing_duration_seconds', time.perf_counter() - started)
+        if not stat.S_ISREG(st.st_mode):
+            await self.send_error(writer, request, 404, "File not found")
+            return request.keep_alive
+
+        thumbnail = parse_thumbnail_query(urllib.parse.urlsplit(request.path).query)
+        if thumbnail:
+            request.route = 'thumbnail'
+            return await self.send_thumbnail(writer, request, path, st, thumbnail)
+
+        request.route = 'file'
+        return await self.serve_file(writer, request, path, st)
+
+    async def select_share(self, writer, request):
+        """Serve the share the URL names; False once the request has been answered"""
+        match = self.shares.resolve(request.path)
+        if match is None:
+            if request.method == 'PUT':
+                request.keep_alive = False  # The body is left unread
+                await self.send_error(writer, request, 404, "Uploads must name a share")
+                return False
+            request.route = 'index'
+            fmt = parse_listing_query(urllib.parse.urlsplit(request.path).query,
+                                      request.headers.get('Accept')).format
+            body = render_share_index(self.shares, self.port, fmt)
+            await self.send_response(writer, request, 200, [
+                ('Content-Type', LISTING_CONTENT_TYPES[fmt]),
+                ('Content-Length', str(len(body))),
+                ('Cache-Control', 'no-store'),
+                ('Vary', 'Accept'),
+            ], body)
+            return False
+        label, directory, prefix = match
+        if directory is None:
+            if request.method == 'PUT':
+                request.keep_alive = False
+            await self.send_error(writer, request, 404, "No such share")
+            return False
+        url = urllib.parse.urlsplit(request.path)
+        if url.path == prefix and request.method != 'PUT':
+            # Relative links in the listing only work below a trailing slash
+            await self.send_response(writer, request, 301, [
+                ('Location', prefix + '/' + (f'?{url.query}' if url.query else '')),
+                ('Content-Length', '0'),
+            ])
+            return False
+        request.base_path = directory
+        request.url_prefix = prefix
+        return True
+
+    def translate_path(self, request):
+        return translate_url_path(request.base_path, share_url_path(request.path, request.url_prefix))
+
+    async def send_search(self, writer, request, path, query, offset):
+        loop = asyncio.get_running_loop()
+        fmt = parse_listing_query(urllib.parse.urlsplit(request.path).query,
+                                  request.headers.get('Accept')).format
+        try:
+            results, more, complete = await loop.run_in_executor(
+                None, search_share, request.base_path, path, query, offset)
+        except sqlite3.Error as e:
+            await self.send_error(writer, request, 503, f"Search index unavailable: {e}")
+            return request.keep_alive
+        body = render_search(results, more, complete, query, offset, request.base_path, path, self.port, fmt)
+        await self.send_response(writer, request, 200, [
+            ('Content-Type', LISTING_CONTENT_TYPES[fmt]),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-store'),
+            ('Vary', 'Accept'),
+        ], body)
+        return request.keep_alive
+
+    async def send_thumbnail(self, writer, request, path, st, size):
+        etag = thumbnail_etag(st, size)
+        validators = self.validator_headers(etag, st, FILE_CACHE_CONTROL)
+        if is_not_modified(request.headers, etag, st.st_mtime):
+            await self.send_response(writer, request, 304, validators)
+            return request.keep_alive
+        if not thumbnail_kind(path):
+            await self.send_error(writer, request, 404, "No preview available for this file")
+            return request.keep_alive
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, thumbnailer.cached, path, st, size)
+        if data is None:
+            # Shielded: a timed-out request must not cancel a job others wait on
+            future = asyncio.wrap_future(thumbnailer.generate(path, st, size))
+            try:
+                data = await asyncio.wait_for(asyncio.shield(future), THUMBNAIL_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self.send_response(writer, request, 503, [
+                    ('Retry-After', str(RETRY_AFTER)),
+                    ('Content-Length', '0'),
+                ])
+                return request.keep_alive
+        if data is None:
+            await self.send_error(writer, request, 404, "No preview available for this file")
+            return request.keep_alive
+        await self.send_response(writer, request, 200, [
+            ('Content-Type', THUMBNAIL_CONTENT_TYPE),
+            ('Content-Length', str(len(data))),
+        ] + validators, data)
+        return request.keep_alive
+
+    async def send_listing(self, writer, request, path, st):
+        loop = asyncio.get_running_loop()
+        view = parse_listing_query(urllib.parse.urlsplit(request.path).query,
+                                   request.headers.get('Accept'))
+        encoding = listing_encoding(request.headers.get('Accept-Encoding'))
+        etag = encoded_etag(make_listing_etag(st, view.format), encoding)
+        validators = self.validator_headers(etag, st, LISTING_CACHE_CONTROL, LISTING_VARY)
+        if is_not_modified(request.headers, etag, st.st_mtime):
+            await self.send_response(writer, request, 304, validators)
+            return request.keep_alive
+        try:
+            body = await loop.run_in_executor(None, render_listing, path, request.base_path,
+                                              self.port, st, view, encoding)
+        except OSError:
+            await self.send_error(writer, request, 404, "No permission to list directory")
+            return request.keep_alive
+        headers = [('Content-Type', LISTING_CONTENT_TYPES[view.format])] + validators
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        if isinstance(body, bytes):
+            await self.send_response(writer, request, 200,
+                                     headers + [('Content-Length', str(len(body)))], body)
+            return request.keep_alive
+        return await self.send_chunks(writer, request, 200, headers, body)
+
+    async def handle_put(self, request, writer):
+        """Stream an upload to disk; Content-Range makes it resumable"""
+        loop = asyncio.get_running_loop()
+        if not UPLOADS_ENABLED:
+            # The unread body would corrupt the next request on this connection
+            request.keep_alive = False
+            await self.send_error(writer, request, 405, "Uploads are disabled on this share")
+            return False
+        try:
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            request.keep_alive = False
+            await self.send_error(writer, request, 411, "Content-Length required")
+            return False
+        if self.shares is not None and not await self.select_share(writer, request):
+            return request.keep_alive
+
+        path = self.translate_path(request)
+        upload = None
+        try:
+            start, total = parse_content_range(request.headers.get('Content-Range'), length)
+            upload = Upload(path, start, total)
+            await loop.run_in_executor(None, upload.open)
+            if start is not None:
+                if request.expects_continue and length > 0:
+                    # The client holds the body back until it is asked for it
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                    await writer.drain()
+                remaining = length
+                while remaining > 0:
+                    try:
+                        data = await asyncio.wait_for(
+                            request.reader.read(min(UPLOAD_CHUNK, remaining)), KEEPALIVE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        data = b''
+                    if not data:
+                        # Keep what arrived so the client can resume
+                        await loop.run_in_executor(None, upload.finish)
+                        return False
+                    await loop.run_in_executor(None, upload.write, data)
+                    remaining -= len(data)
+            complete = await loop.run_in_executor(None, upload.finish)
+            offset = upload.offset
+        except UploadError as e:
+            request.keep_alive = False
+            if e.offset is None:
+                await self.send_error(writer, request, e.code, e.message)
+            else:
+                await self.send_response(writer, request, e.code,
+                                         upload_offset_headers(e.offset) + [('Content-Length', '0')])
+            return False
+        except OSError as e:
+            request.keep_alive = False
+            await self.send_error(writer, request, 500, f"Error storing upload: {e}")
+            return False
+        finally:
+            if upload is not None:
+                upload.close()
+
+        if not complete:
+            await self.send_response(writer, request, 202,
+                                     upload_offset_headers(offset) + [('Content-Length', '0')])
+            return request.keep_alive
+        st = await loop.run_in_executor(None, os.stat, path)
+        await self.send_response(writer, request, 201 if upload.created else 200, [
+            ('ETag', make_etag(st)),
+            ('Content-Length', '0'),
+        ])
+        return request.keep_alive
+
+    def validator_headers(self, etag, st, cache_control, vary=None):
+        headers = [('ETag', etag), ('Last-Modified', last_modified(st)), ('Cache-Control', cache_control)]
+        if vary:
+            headers.append(('Vary', vary))
+        return headers
+
+    async def serve_file(self, writer, request, path, st):
+        loop = asyncio.get_running_loop()
+        file_size = st.st_size
+        content_type = guess_type(path)
+        etag = make_etag(st)
+        vary = 'Accept-Encoding' if is_compressible(path, content_type, file_size) else None
+        range_header = request.headers.get('Range')
+
+        # Byte ranges always address the identity representation
+        encoding = variant = None
+        if not range_header:
+            encoding, variant = await loop.run_in_executor(
+                None, select_variant, path, st, content_type, request.headers.get('Accept-Encoding'))
+
+        validators = self.validator_headers(encoded_etag(etag, encoding), st, FILE_CACHE_CONTROL, vary)
+        if is_not_modified(request.headers, encoded_etag(etag, encoding), st.st_mtime):
+            await self.send_response(writer, request, 304, validators)
+            return request.keep_alive
+        if encoding:
+            return await self.serve_encoded(writer, request, path, st, validators, encoding, variant)
+        validators += await loop.run_in_executor(None, digest_headers, path, st)
+
+        ranges = None
+        if range_header and if_range_matches(request.headers.get('If-Range'), st.st_mtime, etag):
+            ranges = parse_ranges(range_header, file_size)
+            if ranges == []:
+                await self.send_response(writer, request, 416, [
+                    ('Content-Range', unsatisfiable_range(file_size)),
+                    ('Content-Length', '0'),
+                ])
+                return request.keep_alive
+            if ranges:
+                request.route = 'range'
+
+        try:
+            f = await loop.run_in_executor(None, open, path, 'rb')
+        except OSError as e:
+            await self.send_error(writer, request, 500, f"Error serving file: {e}")
+            return request.keep_alive
+
+        with f:
+            if not ranges:
+                await self.send_response(writer, request, 200, [
+                    ('Content-Type', content_type),
+                    ('Content-Length', str(file_size)),
+                ] + validators)
+                if request.method != 'HEAD' and file_size:
+                    await self.sendfile(writer, request, f, 0, file_size)
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                await self.send_response(writer, request, 206, [
+                    ('Content-Type', content_type),
+                    ('Content-Length', str(end - start + 1)),
+                    ('Content-Range', content_range(start, end, file_size)),
+                ] + validators)
+                if request.method != 'HEAD':
+                    await self.sendfile(writer, request, f, start, end - start + 1)
+            else:
+                boundary, parts, trailer, total = multipart_byteranges(ranges, content_type, file_size)
+                await self.send_response(writer, request, 206, [
+                    ('Content-Type', f'multipart/byteranges; boundary={boundary}'),
+                    ('Content-Length', str(total)),
+                ] + validators)
+                if request.method != 'HEAD':
+                    for header, start, length in parts:
+                        writer.write(header)
+                        await writer.drain()
+                        await self.sendfile(writer, request, f, start, length)
+                    writer.write(trailer)
+                    await writer.drain()
+        return request.keep_alive
+
+    async def serve_encoded(self, writer, request, path, st, validators, encoding, variant):
+        loop = asyncio.get_running_loop()
+        headers = [('Content-Type', guess_type(path)), ('Content-Encoding', encoding)] + validators
+        if variant:
+            try:
+                f = await loop.run_in_executor(None, open, variant, 'rb')
+            except OSError:
+                variant = None  # Evicted or removed since it was selected
+        if variant:
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                await self.send_response(writer, request, 200,
+                                         headers + [('Content-Length', str(size))])
+                if request.method != 'HEAD' and size:
+                    await self.sendfile(writer, request, f, 0, size)
+            return request.keep_alive
+
+        try:
+            f = await loop.run_in_executor(None, open, path, 'rb')
+        except OSError as e:
+            await self.send_error(writer, request, 500, f"Error serving file: {e}")
+            return request.keep_alive
+        with f:
+            return await self.send_chunks(writer, request, 200, headers,
+                                          compressed_file_chunks(f, path, st, encoding))
+
+    async def sendfile(self, writer, request, f, offset, count):
+        """loop.sendfile that drops keep-alive if the file came up short"""
+        loop = asyncio.get_running_loop()
+        throttle = self.throttle(request)
+        started = time.perf_counter()
+        st = os.fstat(f.fileno())
+        readahead = readahead_for(f, offset, count, st.st_size)
+        with block_cache.reading(st) as reading:
+            # Short random ranges would read whole blocks for a few KB; TLS
+            # has to copy anyway, so it may as well share the copies
+            if not block_cache.enabled or count < SEQUENTIAL_MIN:
+                sent = await self.sendfile_paced(writer, f, offset, count, throttle, readahead)
+            else:
+                sent = 0
+                for start, length in block_cache.segments(offset, count):
+                    if request.tls or reading.use_cache(start):
+                        done = await self.send_cached(writer, f, st, start, length, throttle)
+                    else:
+                        done = await self.sendfile_paced(writer, f, start, length, throttle, readahead)
+                    sent += done
+                    if done < length:
+                        break
+        record_transfer(request.base_path, sent, started)
+        if sent < count:
+            request.keep_alive = False
+        return sent
+
+    async def sendfile_paced(self, writer, f, offset, count, throttle, readahead):
+        """loop.sendfile split into throttle quanta and read-ahead windows"""
+        loop = asyncio.get_running_loop()
+        if not throttle.active and (readahead is None or not readahead.sequential):
+            return await loop.sendfile(writer.transport, f, offset, count)
+        sent = 0
+        while sent < count:
+            n = count - sent
+            if readahead is not None:
+                n = readahead.before(offset + sent, n)
+            if throttle.active:
+                n = min(throttle.quantum, n)
+                await asyncio.sleep(throttle.reserve(n))
+            done = await loop.sendfile(writer.transport, f, offset + sent, n)
+            if readahead is not None:
+                readahead.after(offset + sent, done)
+            sent += done
+            if done < n:
+                break
+        return sent
+
+    async def send_cached(self, writer, f, st, offset, count, throttle):
+        """Send a range of a file other clients are reading from the shared block cache"""
+        loop = asyncio.get_running_loop()
+        views = block_cache.iter_range(f, st, offset, count)
+        sent = 0
+        while True:
+            # A miss blocks on the device (or on another reader)
+            view = await loop.run_in_executor(None, next, views, None)
+            if view is None:
+                break
+            for piece in throttle.slices(view):
+                delay = throttle.reserve(len(piece))
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(piece)
+                await writer.drain()
+            sent += len(view)
+        return sent
+
+    async def send_chunks(self, writer, request, code, headers, chunks):
+        """Stream an iterator of byte chunks, returns whether to keep the connection"""
+        loop = asyncio.get_running_loop()
+        chunked = request.version == 'HTTP/1.1'
+        if chunked:
+            headers = headers + [('Transfer-Encoding', 'chunked')]
+        else:
+            request.keep_alive = False
+        await self.send_response(writer, request, code, headers)
+        if request.method == 'HEAD':
+            return request.keep_alive
+        # Producing a chunk may read files or compress; keep it off the loop
+        chunks = iter(chunks)
+        throttle = self.throttle(request)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                if not chunk:
+                    continue
+                for piece in throttle.slices(chunk):
+                    delay = throttle.reserve(len(piece))
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    metrics.inc('usb_share_bytes_sent_total', (request.base_path,), len(piece))
+                    if chunked:
+                        writer.write(b'%x\r\n' % len(piece))
+                        writer.write(piece)
+                        writer.write(b'\r\n')
+                    else:
+                        writer.write(piece)
+                    await writer.drain()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        return request.keep_alive
+
+    def throttle(self, request):
+        client = request.client_address[0] if request.client_address else '-'
+        return shaper.throttle(request.base_path, client)
+
+    async def send_response(self, writer, request, code, headers, body=b''):
+        keep_alive = request.keep_alive if request else False
+        lines = [f'HTTP/1.1 {code} {HTTPStatus(code).phrase}',
+                 f'Server: {self.server_version}',
+                 f'Date: {email.utils.formatdate(usegmt=True)}',
+                 'Accept-Ranges: bytes',
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if keep_alive:
+            lines.append(f'Keep-Alive: timeout={KEEPALIVE_TIMEOUT}, max={request.remaining}')
+        lines.extend(f'{k}: {v}' for k, v in headers)
+        if request is not None:
+            metrics.observe('usb_share_time_to_first_byte_seconds', time.perf_counter() - request.started)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'strict'))
+        if body and (request is None or request.method != 'HEAD'):
+            writer.write(body)
+            metrics.inc('usb_share_bytes_sent_total',
+                        (request.base_path if request else self.base_path,), len(body))
+        await writer.drain()
+        if request is not None:
+            self.log_request(request, code)
+
+    async def send_error(self, writer, request, code, message):
+        body = (f'<!DOCTYPE HTML>\n<html><head><title>Error response</title></head>'
+                f'<body><h1>Error response</h1><p>Error code: {code}</p>'
+                f'<p>Message: {html.escape(message)}.</p></body></html>\n').encode('utf-8', 'replace')
+        await self.send_response(writer, request, code, [
+            ('Content-Type', 'text/html;charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ], body)
+
+    def log_request(self, request, code):
+        metrics.inc('usb_share_requests_total', (request.route, str(code)))
+        sys.stderr.write('%s - - [%s] "%s" %s -\n' % (
+            request.client_address[0] if request.client_address else '-',
+            time.strftime('%d/%b/%Y %H:%M:%S'), request.requestline, code))
+
+
+class AsyncRequest:
+    """Parsed request line and headers for the asyncio engine"""
+
+    def __init__(self, method, path, version, headers, client_address, requestline):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.client_address = client_address
+        self.requestline = requestline
+        self.reader = None
+        self.tls = False
+        self.remaining = 0
+        self.route = 'other'
+        self.started = time.perf_counter()
+        self.base_path = ''
+        self.url_prefix = ''
+
+        conntype = headers.get('Connection', '').lower()
+        if version == 'HTTP/1.1':
+            self.keep_alive = conntype != 'close'
+        else:
+            self.keep_alive = conntype == 'keep-alive'
+
+    @property
+    def has_body(self):
+        return (bool(self.headers.get('Transfer-Encoding'))
+                or self.headers.get('Content-Length', '0').strip() not in ('', '0'))
+
+    @property
+    def expects_continue(self):
+        return (self.version == 'HTTP/1.1'
+                and self.headers.get('Expect', '').strip().lower() == '100-continue')
+
+    @classmethod
+    def parse(cls, head, client_address):
+        try:
+            requestline, _, rest = head.partition(b'\r\n')
+            requestline = requestline.decode('iso-8859-1')
+            method, path, version = requestline.split()
+            if not version.startswith('HTTP/1.'):
+                return None
+            headers = http.client.parse_headers(io.BytesIO(rest))
+        except (ValueError, http.client.HTTPException):
+            return None
+        return cls(method, path, version, headers, client_address, requestline)
+
+
+def guess_type(path):
+    """Guess the Content-Type of a file like SimpleHTTPRequestHandler does"""
+    guess, _ = mimetypes.guess_type(path)
+    return guess or 'application/octet-stream'
+
+
+def upload_offset_headers(offset):
+    headers = [('Upload-Offset', str(offset))]
+    if offset:
+        headers.append(('Range', f'bytes=0-{offset - 1}'))
+    return headers
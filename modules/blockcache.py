@@ -0,0 +1,158 @@
+# modules/blockcache.py
+
+import os
+import threading
+import contextlib
+import collections
+from modules.metrics import registry as metrics
+from config import BLOCK_CACHE_SIZE
+
+BLOCK_SIZE = 1024 * 1024  # Aligned 1MB blocks: one sequential read each on the device
+SEGMENT_BLOCKS = 8  # A transfer checks for other readers of its file this often
+
+
+class _Pending:
+    """A block some thread is reading; others wait for it instead of reading again"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.data = None
+
+
+class Reading:
+    """A transfer registered with reading(); shared is live, so it turns True
+    as soon as another transfer of the same file starts"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    @property
+    def shared(self):
+        return self.cache._readers.get(self.key, 0) > 1
+
+    def use_cache(self, offset):
+        """Whether to read on from offset through the cache: others read this
+        file, or an earlier reader already left the block in memory"""
+        return self.shared or (self.key, offset // self.cache.block_size) in self.cache._blocks
+
+
+class BlockCache:
+    """Memory-capped LRU of aligned file blocks shared by all handlers.
+
+    Blocks are keyed by device, inode, size and mtime, so a modified file
+    never serves stale data. Concurrent misses on the same block are
+    collapsed into a single read.
+    """
+
+    def __init__(self, max_bytes, block_size=BLOCK_SIZE):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.size = 0
+        self._blocks = collections.OrderedDict()
+        self._pending = {}
+        self._readers = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes >= self.block_size
+
+    @staticmethod
+    def file_key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    @contextlib.contextmanager
+    def reading(self, st):
+        """Register a transfer of a file; yields a Reading telling whether others read it too"""
+        key = self.file_key(st)
+        with self._lock:
+            self._readers[key] += 1
+        try:
+            yield Reading(self, key)
+        finally:
+            with self._lock:
+                self._readers[key] -= 1
+                if not self._readers[key]:
+                    del self._readers[key]
+
+    def in_use(self, st):
+        """Whether a transfer of this file is running in this process"""
+        return self.file_key(st) in self._readers
+
+    def blocks(self, offset, count):
+        """Split a byte range into (block index, offset in block, length)"""
+        end = offset + count
+        while offset < end:
+            index, start = divmod(offset, self.block_size)
+            length = min(self.block_size - start, end - offset)
+            yield index, start, length
+            offset += length
+
+    def segments(self, offset, count):
+        """Split a byte range into block-aligned (offset, length) pieces of SEGMENT_BLOCKS blocks.
+
+        Transfers decide per segment between sendfile() and the cache, so
+        the first reader of a file joins the cache once a second one shows
+        up, and every block is read from the device only once.
+        """
+        size = self.block_size * SEGMENT_BLOCKS
+        end = offset + count
+        while offset < end:
+            length = min(size - offset % size, end - offset)
+            yield offset, length
+            offset += length
+
+    def get(self, f, key, index):
+        """Return block index of the open file f, reading it at most once"""
+        block = (key, index)
+        with self._lock:
+            data = self._blocks.get(block)
+            if data is not None:
+                self._blocks.move_to_end(block)
+                metrics.inc('usb_share_block_cache_hits_total')
+                return data
+            pending = self._pending.get(block)
+            owner = pending is None
+            if owner:
+                pending = self._pending[block] = _Pending()
+                metrics.inc('usb_share_block_cache_misses_total')
+
+        if not owner:
+            pending.event.wait()
+            if pending.data is not None:
+                return pending.data
+            # The owner's read failed; try (and fail) on our own
+            return os.pread(f.fileno(), self.block_size, index * self.block_size)
+
+        try:
+            data = os.pread(f.fileno(), self.block_size, index * self.block_size)
+        except BaseException:
+            with self._lock:
+                del self._pending[block]
+            pending.event.set()
+            raise
+        with self._lock:
+            del self._pending[block]
+            self._blocks[block] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                self.size -= len(evicted)
+            metrics.set('usb_share_block_cache_bytes', self.size)
+        pending.data = data
+        pending.event.set()
+        return data
+
+    def iter_range(self, f, st, offset, count):
+        """Yield memoryviews covering count bytes of f from offset; stops short at EOF"""
+        key = self.file_key(st)
+        for index, start, length in self.blocks(offset, count):
+            view = memoryview(self.get(f, key, index))[start:start + length]
+            if view:
+                yield view
+            if len(view) < length:
+                return
+
+
+block_cache = BlockCache(BLOCK_CACHE_SIZE)
@@ -0,0 +1,328 @@
+# modules/compression.py
+
+import os
+import zlib
+import hashlib
+import tempfile
+import threading
+from modules.transfer import advise
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, CACHE_DIR, COMPRESSION_CACHE_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Preference order when the client accepts several codings equally
+ENCODINGS = ['br', 'zstd', 'gzip']
+SIDECAR_SUFFIXES = {'br': '.br', 'zstd': '.zst', 'gzip': '.gz'}
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml',
+    'application/x-ndjson', 'application/x-sh', 'application/x-tex',
+    'application/rtf', 'application/sql', 'image/svg+xml', 'image/bmp',
+    'application/x-tar',
+}
+# Never compress these even if their MIME type looks compressible
+INCOMPRESSIBLE_SUFFIXES = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.br', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv',
+    '.avi', '.mov', '.webm', '.iso', '.docx', '.xlsx', '.pptx', '.apk',
+}
+READ_CHUNK = 1024 * 1024
+
+# Listings negotiate both format and coding
+LISTING_VARY = 'Accept, Accept-Encoding'
+
+
+def available_encodings():
+    """Codings this process can produce on the fly"""
+    encodings = ['gzip']
+    if zstandard is not None:
+        encodings.insert(0, 'zstd')
+    if brotli is not None:
+        encodings.insert(0, 'br')
+    return encodings
+
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    if 'x-gzip' in accepted and 'gzip' not in accepted:
+        accepted['gzip'] = accepted['x-gzip']
+    return accepted
+
+
+def choose_encoding(header, candidates):
+    """Pick the best coding from candidates the client accepts, or None"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for coding in ENCODINGS:
+        if coding not in candidates:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def listing_encoding(accept_encoding):
+    """Coding to use for a generated listing page, or None"""
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    return choose_encoding(accept_encoding, available_encodings())
+
+
+def is_compressible(path, content_type, size):
+    if not COMPRESSION_ENABLED or size < COMPRESSION_MIN_SIZE:
+        return False
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_SUFFIXES:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+class Compressor:
+    """Uniform compress()/flush() wrapper over zlib, brotli and zstandard"""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.compressobj(level or 6, zlib.DEFLATED, 31)
+            self.compress = self._obj.compress
+            self.flush = self._obj.flush
+        elif encoding == 'br':
+            self._obj = brotli.Compressor(quality=level or 5)
+            self.compress = self._obj.process
+            self.flush = self._obj.finish
+        elif encoding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=level or 3).compressobj()
+            self.compress = self._obj.compress
+            self.flush = self._obj.flush
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress_bytes(data, encoding):
+    c = Compressor(encoding)
+    return c.compress(data) + c.flush()
+
+
+def compress_chunks(chunks, encoding):
+    """Compress an iterator of byte chunks, yielding compressed chunks"""
+    c = Compressor(encoding)
+    try:
+        for chunk in chunks:
+            out = c.compress(chunk)
+            if out:
+                yield out
+        yield c.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+class CompressionCache:
+    """Bounded on-disk cache of compressed file variants.
+
+    Entries are keyed by path, inode, size and mtime, so a modified file is
+    simply a cache miss; stale entries age out through LRU eviction.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def entry_path(self, path, st, encoding):
+        key = f'{path}\0{st.st_ino}\0{st.st_size}\0{st.st_mtime_ns}'.encode('utf-8', 'surrogateescape')
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + SIDECAR_SUFFIXES[encoding])
+
+    def lookup(self, path, st, encoding):
+        if self.max_bytes <= 0:
+            return None
+        entry = self.entry_path(path, st, encoding)
+        try:
+            os.utime(entry)  # Mark as recently used for eviction
+        except OSError:
+            return None
+        return entry
+
+    def writer(self, path, st, encoding):
+        if self.max_bytes <= 0 or st.st_size > self.max_bytes:
+            return None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        except OSError:
+            return None
+        return CacheWriter(self, os.fdopen(fd, 'wb'), tmp, self.entry_path(path, st, encoding))
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += nbytes
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self):
+        total = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        total += entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return total
+
+    def _evict(self):
+        try:
+            with os.scandir(self.cache_dir) as it:
+                entries = []
+                for entry in it:
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                    except OSError:
+                        pass
+        except OSError:
+            return
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.unlink(path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+class CacheWriter:
+    """Temp file that becomes a cache entry only if the whole body was written"""
+
+    def __init__(self, cache, f, tmp_path, final_path):
+        self.cache = cache
+        self.f = f
+        self.tmp_path = tmp_path
+        self.final_path = final_path
+        self.written = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.written += len(data)
+
+    def commit(self):
+        self.f.close()
+        try:
+            os.replace(self.tmp_path, self.final_path)
+        except OSError:
+            self.abort()
+            return
+        self.cache._added(self.written)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+
+compression_cache = CompressionCache(os.path.join(CACHE_DIR, 'compressed'), COMPRESSION_CACHE_SIZE)
+
+
+def select_variant(path, st, content_type, accept_encoding):
+    """Decide how to encode a file for a client.
+
+    Returns (encoding, variant_path): variant_path is a precompressed sidecar
+    or cache entry to send as-is, or None to compress on the fly. Returns
+    (None, None) to send the file unencoded.
+    """
+    if not accept_encoding or not is_compressible(path, content_type, st.st_size):
+        return None, None
+
+    # Fresh precompressed siblings (foo.css.gz etc.) win over everything
+    sidecars = {}
+    for encoding, suffix in SIDECAR_SUFFIXES.items():
+        try:
+            sidecar_st = os.stat(path + suffix)
+        except OSError:
+            continue
+        if sidecar_st.st_mtime_ns >= st.st_mtime_ns:
+            sidecars[encoding] = path + suffix
+    if sidecars:
+        encoding = choose_encoding(accept_encoding, sidecars)
+        if encoding:
+            return encoding, sidecars[encoding]
+
+    encoding = choose_encoding(accept_encoding, available_encodings())
+    if encoding is None:
+        return None, None
+    return encoding, compression_cache.lookup(path, st, encoding)
+
+
+def compressed_file_chunks(f, path, st, encoding):
+    """Compress an open file on the fly, filling the cache as a side effect"""
+    writer = compression_cache.writer(path, st, encoding)
+    c = Compressor(encoding)
+    completed = False
+
+    def tee(out):
+        nonlocal writer
+        if writer and out:
+            try:
+                writer.write(out)
+            except OSError:
+                # Cache disk trouble must not break the download itself
+                writer.abort()
+                writer = None
+        return out
+
+    advise(f, 0, 0, getattr(os, 'POSIX_FADV_SEQUENTIAL', 0))
+    try:
+        while True:
+            data = f.read(READ_CHUNK)
+            if not data:
+                break
+            out = tee(c.compress(data))
+            if out:
+                yield out
+        out = tee(c.flush())
+        completed = True
+        yield out
+    finally:
+        if writer:
+            if completed:
+                writer.commit()
+            else:
+                writer.abort()
@@ -0,0 +1,182 @@
+# modules/daemon.py
+
+import os
+import json
+import time
+import threading
+from modules.usb_manager import USBManager, block_events
+from modules.server import MultiShareServer
+from modules.shares import share_label
+from config import PORT, DEFAULT_MOUNT_PREFIX, CACHE_DIR
+
+ASSIGNMENTS_PATH = os.path.join(CACHE_DIR, 'drives.json')
+SETTLE_DELAY = 1.5  # Seconds for udev to finish probing a new device
+RESCAN_INTERVAL = 30  # Safety-net reconcile when no events arrive
+
+
+def drive_key(dev):
+    """Identity of a drive that survives re-plugging: UUID, else label, else device name"""
+    if dev.uuid:
+        return f'uuid:{dev.uuid}'
+    if dev.label:
+        return f'label:{dev.label}'
+    return f'dev:{dev.name}'
+
+
+class Assignments:
+    """Share label and mount path per drive key, persisted so they stay stable across runs"""
+
+    def __init__(self, path=ASSIGNMENTS_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.drives = json.load(f)
+        except (OSError, ValueError):
+            self.drives = {}
+
+    def get(self, dev):
+        key = drive_key(dev)
+        entry = self.drives.get(key)
+        if entry is None or 'label' not in entry:
+            labels = {e.get('label') for e in self.drives.values()}
+            label = base = share_label(dev.label or dev.uuid or dev.name)
+            n = 1
+            while label in labels:
+                n += 1
+                label = f'{base}_{n}'
+            entry = self.drives[key] = {'label': label, 'mount_point': DEFAULT_MOUNT_PREFIX + label}
+            self._save()
+        return entry
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.drives, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not save drive assignments: {e}")
+
+
+class Share:
+    def __init__(self, dev, label, mount_point):
+        self.dev = dev
+        self.key = drive_key(dev)
+        self.label = label
+        self.mount_point = mount_point
+
+
+class HotplugDaemon:
+    """Headless mode: share every USB drive while it is plugged in.
+
+    All drives are served by one MultiShareServer under /share/<label>/.
+    Block-device events trigger a reconcile (after SETTLE_DELAY, so udev
+    has probed the filesystem) that mounts and adds new drives and removes
+    and unmounts the ones that went away. The drive source, events and
+    mount/unmount functions are injectable, so the daemon can run
+    without hardware.
+    """
+
+    def __init__(self, events=block_events, discover=None, mount=None, unmount=None,
+                 assignments=None, server=None, settle_delay=SETTLE_DELAY):
+        self.events = events
+        self.discover = discover or (lambda: USBManager.get_usb_partitions(refresh=True))
+        self.mount = mount or USBManager.mount_drive
+        self.unmount = unmount or USBManager.unmount_drive
+        self.assignments = assignments or Assignments()
+        self.server = server or MultiShareServer(PORT, open_browser=False)
+        self.settle_delay = settle_delay
+        self.shares = {}  # device name -> Share
+        self.unknown = set()  # devices already reported as having no known filesystem
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start serving; returns False if the port could not be opened"""
+        self.server.start()
+        if self.server.httpd is None:
+            return False
+        self.events.subscribe(self._on_event)
+        self.reconcile()
+        self._thread = threading.Thread(target=self._run, name='hotplug', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self.events.unsubscribe(self._on_event)
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            for name in list(self.shares):
+                self._remove(name)
+        self.server.stop()
+
+    def run_forever(self):
+        if not self.start():
+            return
+        print("Hot-plug daemon running. Press Ctrl+C to stop.")
+        try:
+            while not self._stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+        finally:
+            self.stop()
+
+    def _on_event(self, event):
+        if event.get('ACTION') in ('add', 'remove', 'change'):
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            woken = self._wake.wait(RESCAN_INTERVAL)
+            if self._stopped.is_set():
+                break
+            if woken:
+                # Let a burst of events (disk, then each partition) settle
+                time.sleep(self.settle_delay)
+                self._wake.clear()
+            self.reconcile()
+
+    def reconcile(self):
+        """Serve drives that appeared and tear down the ones that vanished"""
+        try:
+            devices = self.discover()
+        except Exception as e:
+            print(f"Error detecting drives: {e}")
+            return
+        present = {dev.name: dev for dev in devices if dev.fstype}
+        for dev in devices:
+            if not dev.fstype and dev.name not in self.unknown:
+                print(f"Not sharing {dev.name}: its filesystem type is unknown "
+                      "(unformatted, or not probed by lsblk or udev)")
+        self.unknown = {dev.name for dev in devices if not dev.fstype}
+        with self._lock:
+            for name, share in list(self.shares.items()):
+                dev = present.get(name)
+                if dev is None or drive_key(dev) != share.key:
+                    self._remove(name)
+            for name, dev in present.items():
+                if name not in self.shares:
+                    self._add(dev)
+
+    def _add(self, dev):
+        entry = self.assignments.get(dev)
+        mount_point = self.mount(dev.name, entry['mount_point'])
+        if not mount_point:
+            print(f"Failed to mount {dev.name}")
+            return
+        label = self.server.add_share(mount_point, entry['label'])
+        self.shares[dev.name] = Share(dev, label, mount_point)
+
+    def _remove(self, name):
+        share = self.shares.pop(name)
+        self.server.remove_share(share.label)
+        self.unmount(share.mount_point)
+        print(f"Stopped sharing {share.dev.label or name}")
+
@@ -0,0 +1,308 @@
+# modules/digests.py
+
+import os
+import json
+import stat
+import time
+import base64
+import hashlib
+import sqlite3
+import threading
+import collections
+import urllib.parse
+from modules.archive import walk_tree
+from modules.throttle import TokenBucket
+from modules.transfer import advise, resident
+from modules.blockcache import block_cache
+from modules.metrics import registry as metrics
+from config import CACHE_DIR, DIGESTS_ENABLED, DIGEST_RATE_LIMIT, DIGEST_RESCAN_INTERVAL
+
+DIGEST_PATH = os.path.join(CACHE_DIR, 'digests.sqlite3')
+READ_CHUNK = 1024 * 1024
+RESIDENT_WINDOW = 64 * 1024 * 1024  # Bytes checked for page-cache residency at once
+MAX_REQUESTED = 10000  # Files waiting to be hashed ahead of the walk
+MANIFEST_BATCH = 256
+
+MANIFEST_TYPES = {
+    'sha256': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+}
+
+SCHEMA_VERSION = 1  # 1: keyed by device as well as inode
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS file_digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 BLOB NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns)
+) WITHOUT ROWID;
+'''
+
+
+class DigestIndex:
+    """SHA-256 of every file on the shares, computed once in the background.
+
+    Digests are keyed by device, inode, size and mtime rather than by
+    path, so a renamed or hard-linked file is never hashed twice, while
+    any change to a file is a miss. The device keeps two sticks whose
+    filesystems reuse the same inode numbers apart; a drive plugged in
+    again under another device number is hashed afresh. One thread walks
+    the watched shares every DIGEST_RESCAN_INTERVAL seconds, reading at
+    most DIGEST_RATE_LIMIT bytes/s and dropping from the page cache what
+    only it brought in. Files clients ask for are hashed ahead of the walk. Like the
+    search index, pre-fork workers set hashing to False and only look
+    digests up.
+    """
+
+    def __init__(self, db_path, rate=DIGEST_RATE_LIMIT):
+        self.db_path = db_path
+        self.hashing = True
+        self.bucket = TokenBucket(rate)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._shares = {}  # share -> monotonic time its next walk is due
+        self._requested = collections.OrderedDict()  # paths to hash first
+        self._thread = None
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._migrate(conn)
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn):
+        # Once per database file, not per connection: the table is persistent
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                conn.execute('DROP TABLE IF EXISTS digests')  # Keyed without the device
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def watch(self, share):
+        """Keep a share's digests current in the background"""
+        if not self.hashing:
+            return
+        with self._lock:
+            self._shares.setdefault(os.path.abspath(share), 0)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='hasher', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unwatch(self, share):
+        with self._lock:
+            self._shares.pop(os.path.abspath(share), None)
+
+    def request(self, path):
+        """Hash a file soon, because a client wants its digest"""
+        if not self.hashing:
+            return
+        with self._lock:
+            if len(self._requested) < MAX_REQUESTED:
+                self._requested[path] = None
+        self._wake.set()
+
+    def lookup(self, st):
+        """The file's SHA-256 as bytes, or None if it has not been hashed yet"""
+        try:
+            row = self._connect().execute(
+                'SELECT sha256 FROM file_digests WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?',
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self._hash_requested()
+            share = self._due_share()
+            if share is not None:
+                self._walk(share)
+                continue
+            with self._lock:
+                due = min(self._shares.values(), default=None)
+            self._wake.wait(None if due is None else max(due - time.monotonic(), 0))
+
+    def _due_share(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [(t, share) for share, t in self._shares.items() if t <= now]
+        return min(due)[1] if due else None
+
+    def _walk(self, share):
+        for _, full, st in walk_tree(share, share):
+            self._hash_requested()
+            with self._lock:
+                if share not in self._shares:
+                    return
+            if stat.S_ISREG(st.st_mode) and self.lookup(st) is None:
+                self.hash_file(full, st)
+        with self._lock:
+            if share in self._shares:
+                self._shares[share] = time.monotonic() + DIGEST_RESCAN_INTERVAL
+
+    def _hash_requested(self):
+        while True:
+            with self._lock:
+                if not self._requested:
+                    return
+                path, _ = self._requested.popitem(last=False)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and self.lookup(st) is None:
+                self.hash_file(path, st)
+
+    def hash_file(self, path, st):
+        """Hash and store a file; returns the digest, or None if it changed or failed"""
+        sha = hashlib.sha256()
+        buf = bytearray(READ_CHUNK)
+        view = memoryview(buf)
+        done = 0
+        # Hashing must not push the files clients use out of the page cache:
+        # only pages it read in itself are dropped, and none while the file
+        # is being downloaded
+        drop = not block_cache.in_use(st)
+        cached = False
+        window_end = 0
+        try:
+            with open(path, 'rb') as f:
+                advise(f, 0, 0, getattr(os, 'POSIX_FADV_SEQUENTIAL', 0))
+                while True:
+                    delay = self.bucket.reserve(READ_CHUNK)
+                    if delay > 0:
+                        time.sleep(delay)
+                    if drop and done >= window_end:
+                        window_end = done + RESIDENT_WINDOW
+                        cached = resident(f, done, min(RESIDENT_WINDOW, st.st_size - done))
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    sha.update(view[:n])
+                    if drop and not cached:
+                        advise(f, done, n, getattr(os, 'POSIX_FADV_DONTNEED', 0))
+                    done += n
+                    metrics.inc('usb_share_digest_bytes_total', (), n)
+                after = os.fstat(f.fileno())
+        except OSError:
+            return None
+        if done != st.st_size or (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            return None  # Modified while being read; the next walk retries
+        digest = sha.digest()
+        try:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO file_digests VALUES (?, ?, ?, ?, ?)',
+                         (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Could not store the digest of {path}: {e}")
+            return None
+        metrics.inc('usb_share_digest_files_total')
+        return digest
+
+
+digest_index = DigestIndex(DIGEST_PATH)
+
+
+def digest_headers(path, st):
+    """Repr-Digest (RFC 9530) and legacy Digest (RFC 3230) fields for a file.
+
+    Empty until the file has been hashed; asking moves it to the front of
+    the queue.
+    """
+    if not DIGESTS_ENABLED:
+        return []
+    digest = digest_index.lookup(st)
+    if digest is None:
+        digest_index.request(path)
+        return []
+    b64 = base64.b64encode(digest).decode('ascii')
+    return [('Repr-Digest', f'sha-256=:{b64}:'), ('Digest', f'SHA-256={b64}')]
+
+
+def parse_manifest_query(query):
+    """Manifest format requested with ?manifest or ?manifest=json, or None"""
+    values = urllib.parse.parse_qs(query, keep_blank_values=True).get('manifest')
+    if values is None or not DIGESTS_ENABLED:
+        return None
+    return 'json' if values[0] == 'json' else 'sha256'
+
+
+def _escape_name(name):
+    # GNU sha256sum escapes names holding a backslash or newline this way
+    if '\\' in name or '\n' in name:
+        return True, name.replace('\\', '\\\\').replace('\n', '\\n')
+    return False, name
+
+
+def sha256sum_line(hexdigest, name):
+    escaped, name = _escape_name(name)
+    prefix = '\\' if escaped else ''
+    return f'{prefix}{hexdigest}  {name}\n'
+
+
+def manifest_chunks(root, base_path, format='sha256'):
+    """Yield the digests of every file below root, relative to it, in encoded chunks.
+
+    The sha256 format can be checked with `sha256sum -c` from a copy of
+    the directory. Files not hashed yet are queued and listed at the end,
+    as comment lines (which sha256sum reports as improperly formatted) or
+    with a null digest in JSON.
+    """
+    pending = []
+    batch = []
+    count = 0
+    if format == 'json':
+        yield b'{"algorithm":"sha-256","files":['
+    for rel, full, st in walk_tree(root, base_path):
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        name = rel.replace(os.sep, '/')
+        digest = digest_index.lookup(st)
+        if digest is None:
+            digest_index.request(full)
+            pending.append((name, st.st_size))
+            continue
+        if format == 'json':
+            batch.append(json.dumps({'path': name, 'size': st.st_size, 'sha256': digest.hex()},
+                                    ensure_ascii=False, separators=(',', ':')))
+        else:
+            batch.append(sha256sum_line(digest.hex(), name))
+        count += 1
+        if len(batch) >= MANIFEST_BATCH:
+            yield _manifest_batch(batch, format, count - len(batch))
+            batch = []
+    if batch:
+        yield _manifest_batch(batch, format, count - len(batch))
+
+    if format == 'json':
+        tail = [json.dumps({'path': name, 'size': size, 'sha256': None},
+                           ensure_ascii=False, separators=(',', ':')) for name, size in pending]
+        yield _manifest_batch(tail, format, count) if tail else b''
+        yield ('],"pending":%d,"complete":%s}\n' % (
+            len(pending), 'false' if pending else 'true')).encode('utf-8')
+    elif pending:
+        lines = [f'# not hashed yet: {_escape_name(name)[1]}\n' for name, _ in pending]
+        yield ''.join(lines).encode('utf-8', 'surrogateescape')
+
+
+def _manifest_batch(items, format, written):
+    if format == 'json':
+        return ((',' if written else '') + ','.join(items)).encode('utf-8', 'surrogateescape')
+    return ''.join(items).encode('utf-8', 'surrogateescape')
@@ -0,0 +1,541 @@
+# modules/listing.py
+
+import os
+import time
+import threading
+import json
+import html
+import collections
+import urllib.parse
+from modules.utils import format_size, format_date
+from modules.validators import format_etag, format_listing_etag
+from modules.compression import compress_bytes, compress_chunks
+from modules.upload import is_partial_upload
+from modules.thumbnails import thumbnail_kind
+from config import LISTING_CACHE_SIZE, LISTING_PAGE_SIZE, SEARCH_INDEX_ENABLED, DIGESTS_ENABLED
+
+LISTING_CSS = '''
+<style>
+    body { 
+        font-family: Ubuntu, Arial, sans-serif; 
+        margin: 20px; 
+        background-color: #f5f5f5; 
+    }
+
+    h2 { 
+        color: #333; 
+        margin-bottom: 20px;
+    }
+
+    .container { 
+        max-width: 1000px; 
+        margin: 0 auto; 
+        padding: 20px;
+        background-color: white;
+        border-radius: 8px;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }
+
+    .file-list { 
+        list-style-type: none; 
+        padding: 0; 
+    }
+
+    .file-item { 
+        display: flex;
+        align-items: center;
+        padding: 12px 15px;
+        margin: 8px 0;
+        background-color: #f8f9fa;
+        border-radius: 6px;
+        transition: background-color 0.2s;
+    }
+
+    .file-item:hover {
+        background-color: #e9ecef;
+    }
+
+    .file-link { 
+        color: #0066cc; 
+        text-decoration: none; 
+        flex-grow: 1;
+        font-size: 15px;
+    }
+
+    .file-info { 
+        color: #666; 
+        font-size: 14px; 
+        margin-left: 15px;
+        white-space: nowrap;
+    }
+
+    .folder-icon::before {
+        content: "📁";
+        margin-right: 8px;
+        font-size: 16px;
+    }
+
+    .file-icon::before {
+        content: "📄";
+        margin-right: 8px;
+        font-size: 16px;
+    }
+
+    .zip-icon::before {
+        content: "🗜️";
+        margin-right: 8px;
+        font-size: 16px;
+    }
+
+    .path-info {
+        color: #666;
+        font-size: 14px;
+        margin-bottom: 15px;
+        padding: 8px;
+        background-color: #f8f9fa;
+        border-radius: 4px;
+    }
+
+    .file-grid {
+        display: grid;
+        grid-template-columns: repeat(auto-fill, minmax(150px, 1fr));
+        gap: 12px;
+        list-style-type: none;
+        padding: 0;
+    }
+
+    .grid-item {
+        padding: 8px;
+        background-color: #f8f9fa;
+        border-radius: 6px;
+        text-align: center;
+        overflow: hidden;
+    }
+
+    .grid-item:hover {
+        background-color: #e9ecef;
+    }
+
+    .grid-item a {
+        color: #0066cc;
+        text-decoration: none;
+        font-size: 14px;
+        word-break: break-word;
+    }
+
+    .grid-item img, .grid-item .grid-icon {
+        display: block;
+        width: 100%;
+        height: 130px;
+        margin-bottom: 6px;
+    }
+
+    .grid-item img {
+        object-fit: cover;
+        border-radius: 4px;
+        background-color: #e9ecef;
+    }
+
+    .grid-icon::before {
+        font-size: 64px;
+        line-height: 130px;
+        margin-right: 0;
+    }
+
+    .sort-links, .pagination, .download-links, .view-links {
+        color: #666;
+        font-size: 14px;
+        margin: 10px 0;
+    }
+
+    .sort-links a, .pagination a, .download-links a, .view-links a {
+        color: #0066cc;
+        text-decoration: none;
+        margin-right: 10px;
+    }
+
+    .search-form {
+        margin: 10px 0;
+    }
+
+    .search-form input {
+        padding: 6px;
+        width: 60%;
+        border: 1px solid #ccc;
+        border-radius: 4px;
+    }
+
+    .search-form button {
+        padding: 6px 12px;
+        margin-left: 5px;
+    }
+
+    .server-info {
+        margin-top: 20px;
+        padding: 10px;
+        background-color: #e9ecef;
+        border-radius: 4px;
+        font-size: 13px;
+        color: #666;
+    }
+</style>
+'''
+
+
+Entry = collections.namedtuple('Entry', 'name is_dir size mtime_ns ino')
+
+ListingView = collections.namedtuple('ListingView', 'sort reverse offset limit format layout')
+
+SORT_KEYS = {
+    'name': lambda e: e.name.lower(),
+    'size': lambda e: (not e.is_dir, e.size if e.size is not None else -1, e.name.lower()),
+    'mtime': lambda e: (e.mtime_ns if e.mtime_ns is not None else -1, e.name.lower()),
+}
+
+LISTING_CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'json': 'application/json',
+}
+
+# Pages with more rows than this are streamed instead of rendered in one piece
+STREAM_THRESHOLD = 500
+STREAM_BATCH = 256
+MAX_RENDERED_VIEWS = 8  # Rendered pages kept per listing
+
+# Directories modified this recently are not cached: coarse filesystem
+# timestamps (FAT has 2 second resolution) could hide a second change.
+RACY_WINDOW = 2.0
+
+
+def scan_directory(path):
+    """Read a directory in a single os.scandir pass, sorted by name"""
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if is_partial_upload(entry.name):
+                continue
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+                entries.append(Entry(entry.name, is_dir, st.st_size, st.st_mtime_ns, st.st_ino))
+            except OSError:
+                entries.append(Entry(entry.name, False, None, None, None))
+    entries.sort(key=lambda e: e.name.lower())
+    return entries
+
+
+class DirectoryListing:
+    """Scanned entries of one directory plus the pages rendered from them"""
+
+    def __init__(self, path, mtime_ns, entries):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.rendered = {}
+        self._indexes = {'name': entries}
+        self._lock = threading.Lock()
+
+    def sorted_entries(self, sort):
+        """Entries ordered by sort key, computed once per listing"""
+        index = self._indexes.get(sort)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(sort)
+                if index is None:
+                    index = sorted(self.entries, key=SORT_KEYS[sort])
+                    self._indexes[sort] = index
+        return index
+
+    def page(self, view):
+        """Slice of entries for a view, without copying the whole index"""
+        index = self.sorted_entries(view.sort)
+        total = len(index)
+        if view.reverse:
+            stop = max(total - view.offset, 0)
+            start = max(stop - view.limit, 0)
+            return index[start:stop][::-1]
+        return index[view.offset:view.offset + view.limit]
+
+
+class ListingCache:
+    """LRU cache of directory scans, invalidated when the directory mtime changes"""
+
+    def __init__(self, max_entries=LISTING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._listings = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, st=None):
+        if st is None:
+            st = os.stat(path)
+        with self._lock:
+            listing = self._listings.get(path)
+            if listing is not None and listing.mtime_ns == st.st_mtime_ns:
+                self._listings.move_to_end(path)
+                return listing
+
+        listing = DirectoryListing(path, st.st_mtime_ns, scan_directory(path))
+        if time.time() - st.st_mtime >= RACY_WINDOW and self.max_entries > 0:
+            with self._lock:
+                self._listings[path] = listing
+                self._listings.move_to_end(path)
+                while len(self._listings) > self.max_entries:
+                    self._listings.popitem(last=False)
+        return listing
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(path, None)
+
+
+listing_cache = ListingCache()
+
+
+def parse_listing_query(query, accept=None):
+    """Read ?sort=&order=&offset=&limit=&format=&view= into a ListingView.
+
+    Without an explicit ?format=, an Accept header asking for JSON but not
+    HTML selects the JSON view.
+    """
+    params = urllib.parse.parse_qs(query)
+
+    def first(name, default):
+        values = params.get(name)
+        return values[0] if values else default
+
+    sort = first('sort', 'name')
+    if sort not in SORT_KEYS:
+        sort = 'name'
+    reverse = first('order', 'asc') == 'desc'
+    try:
+        offset = max(int(first('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+    try:
+        limit = max(int(first('limit', LISTING_PAGE_SIZE)), 1)
+    except ValueError:
+        limit = LISTING_PAGE_SIZE
+    format = first('format', None)
+    if format not in ('html', 'json'):
+        accept = accept or ''
+        format = 'json' if 'application/json' in accept and 'text/html' not in accept else 'html'
+    layout = 'grid' if first('view', 'list') == 'grid' else 'list'
+    return ListingView(sort, reverse, offset, limit, format, layout)
+
+
+def _view_query(view, **changes):
+    view = view._replace(**changes)
+    params = {
+        'sort': view.sort,
+        'order': 'desc' if view.reverse else 'asc',
+        'offset': view.offset,
+        'limit': view.limit,
+    }
+    if view.format != 'html':
+        params['format'] = view.format
+    if view.layout != 'list':
+        params['view'] = view.layout
+    return '?' + urllib.parse.urlencode(params)
+
+
+def render_listing(path, base_path, port, st=None, view=None, encoding=None):
+    """Render a directory listing page as HTML or JSON, according to view.format.
+
+    Returns encoded bytes for ordinary pages (cached on the listing, also in
+    compressed form when an encoding is given), or an iterator of chunks
+    when the page is large enough to stream.
+    """
+    if view is None:
+        view = parse_listing_query('')
+    render = iter_listing_json if view.format == 'json' else iter_listing_html
+    listing = listing_cache.get(path, st)
+    rows = listing.page(view)
+    if len(rows) > STREAM_THRESHOLD:
+        chunks = render(listing, rows, base_path, port, view)
+        return compress_chunks(chunks, encoding) if encoding else chunks
+
+    key = (base_path, port, view)
+    body = listing.rendered.get(key)
+    if body is None:
+        body = b''.join(render(listing, rows, base_path, port, view))
+        if len(listing.rendered) >= MAX_RENDERED_VIEWS:
+            listing.rendered.clear()
+        listing.rendered[key] = body
+    if not encoding:
+        return body
+
+    compressed = listing.rendered.get(key + (encoding,))
+    if compressed is None:
+        compressed = compress_bytes(body, encoding)
+        listing.rendered[key + (encoding,)] = compressed
+    return compressed
+
+
+def search_form(query=''):
+    return ('<form class="search-form" method="get" action="">'
+            f'<input type="search" name="q" placeholder="Search this drive" value="{html.escape(query)}">'
+            '<button type="submit">Search</button></form>')
+
+
+def iter_listing_html(listing, rows, base_path, port, view):
+    """Yield the listing page in encoded chunks of STREAM_BATCH rows"""
+    path = listing.path
+    total = len(listing.entries)
+
+    r = []
+    r.append('<!DOCTYPE HTML>')
+    r.append('<html>\n<head>')
+    r.append('<meta charset="utf-8">')
+    r.append('<title>USB File Sharing</title>')
+    r.append(LISTING_CSS)
+    r.append('</head>')
+    r.append('<body>')
+    r.append('<div class="container">')
+
+    rel_path = os.path.relpath(path, base_path)
+    if rel_path == '.':
+        display_path = 'USB Drive Root'
+    else:
+        display_path = rel_path
+    r.append(f'<h2>Files in {html.escape(display_path)}</h2>')
+
+    r.append('<div class="path-info">')
+    r.append(f'Current location: {html.escape(display_path)}')
+    r.append('</div>')
+
+    if SEARCH_INDEX_ENABLED:
+        r.append(search_form())
+
+    r.append('<div class="sort-links">Sort by: ')
+    for sort, label in (('name', 'Name'), ('size', 'Size'), ('mtime', 'Modified')):
+        reverse = not view.reverse if sort == view.sort else False
+        r.append(f'<a href="{_view_query(view, sort=sort, reverse=reverse, offset=0)}">{label}</a>')
+    r.append('</div>')
+
+    r.append('<div class="view-links">View: ')
+    r.append(f'<a href="{_view_query(view, layout="list")}">List</a>')
+    r.append(f'<a href="{_view_query(view, layout="grid")}">Grid</a>')
+    r.append('</div>')
+
+    r.append('<div class="download-links">Download folder: ')
+    r.append('<a href="?download=zip">ZIP</a>')
+    r.append('<a href="?download=tar">TAR</a>')
+    if DIGESTS_ENABLED:
+        r.append('<a href="?manifest">SHA256SUMS</a>')
+    r.append('</div>')
+
+    grid = view.layout == 'grid'
+    r.append('<ul class="file-grid">' if grid else '<ul class="file-list">')
+
+    if path != base_path:
+        if grid:
+            r.append('<li class="grid-item">')
+            r.append(f'<a href="..{_view_query(view, offset=0)}"><span class="grid-icon folder-icon"></span>Parent Directory</a>')
+        else:
+            r.append('<li class="file-item">')
+            r.append(f'<a href=".." class="file-link folder-icon">Parent Directory</a>')
+        r.append('</li>')
+
+    for i, entry in enumerate(rows):
+        if i % STREAM_BATCH == 0 and r:
+            yield ('\n'.join(r) + '\n').encode('utf-8', 'replace')
+            r = []
+
+        name = entry.name
+        displayname = linkname = name
+
+        if entry.size is not None:
+            size = format_size(entry.size)
+            mtime = format_date(entry.mtime_ns / 1e9)
+        else:
+            size = "Unknown size"
+            mtime = "Unknown date"
+
+        is_zip = name.lower().endswith('.zip')
+
+        if entry.is_dir:
+            displayname = name + "/"
+            linkname = name + "/"
+            size = "Directory"
+            icon_class = "folder-icon"
+        elif is_zip:
+            icon_class = "zip-icon"
+        else:
+            icon_class = "file-icon"
+
+        if grid:
+            # Previews load as they scroll into view, each made on first request
+            href = urllib.parse.quote(linkname)
+            if entry.is_dir:
+                href += _view_query(view, offset=0)
+            r.append(f'<li class="grid-item" title="{html.escape(name)} • {size} • {mtime}">')
+            if not entry.is_dir and thumbnail_kind(name):
+                preview = f'<img src="{urllib.parse.quote(name)}?thumbnail" loading="lazy" alt="">'
+            else:
+                preview = f'<span class="grid-icon {icon_class}"></span>'
+            r.append(f'<a href="{href}">{preview}{html.escape(displayname)}</a>')
+            r.append('</li>')
+            continue
+
+        r.append('<li class="file-item">')
+        r.append(f'<a href="{urllib.parse.quote(linkname)}" class="file-link {icon_class}">{html.escape(displayname)}</a>')
+        r.append(f'<span class="file-info">{size} • {mtime}</span>')
+        r.append('</li>')
+
+    r.append('</ul>')
+
+    if view.offset > 0 or view.offset + len(rows) < total:
+        r.append('<div class="pagination">')
+        if view.offset > 0:
+            r.append(f'<a href="{_view_query(view, offset=max(view.offset - view.limit, 0))}">Previous</a>')
+        r.append(f'Showing {view.offset + 1}-{view.offset + len(rows)} of {total}')
+        if view.offset + len(rows) < total:
+            r.append(f'<a href="{_view_query(view, offset=view.offset + view.limit)}">Next</a>')
+        r.append('</div>')
+
+    r.append('<div class="server-info">')
+    r.append(f'Server Port: {port} • ')
+    r.append(f'Files served from: {html.escape(base_path)}')
+    r.append('</div>')
+
+    r.append('</div>')
+    r.append('</body>\n</html>\n')
+
+    yield '\n'.join(r).encode('utf-8', 'replace')
+
+
+def entry_json(entry):
+    """Compact JSON-ready dict for one listing entry"""
+    if entry.size is None:
+        return {'name': entry.name, 'type': 'dir' if entry.is_dir else 'file',
+                'size': None, 'mtime': None, 'etag': None}
+    if entry.is_dir:
+        return {'name': entry.name, 'type': 'dir', 'size': None,
+                'mtime': entry.mtime_ns / 1e9,
+                'etag': format_listing_etag(entry.ino, entry.mtime_ns)}
+    return {'name': entry.name, 'type': 'file', 'size': entry.size,
+            'mtime': entry.mtime_ns / 1e9,
+            'etag': format_etag(entry.ino, entry.size, entry.mtime_ns)}
+
+
+def iter_listing_json(listing, rows, base_path, port, view):
+    """Yield the listing page as a JSON document in encoded chunks"""
+    total = len(listing.entries)
+    rel_path = os.path.relpath(listing.path, base_path)
+    url_path = '/' if rel_path == '.' else '/' + urllib.parse.quote(rel_path.replace(os.sep, '/')) + '/'
+    end = view.offset + len(rows)
+    next_page = _view_query(view, offset=end) if end < total else None
+    prev_page = _view_query(view, offset=max(view.offset - view.limit, 0)) if view.offset > 0 else None
+
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    yield ('{"path":%s,"total":%d,"offset":%d,"limit":%d,"sort":%s,"order":%s,"next":%s,"prev":%s,"entries":[' % (
+        dumps(url_path), total, view.offset, view.limit, dumps(view.sort),
+        dumps('desc' if view.reverse else 'asc'), dumps(next_page), dumps(prev_page))).encode('utf-8')
+
+    for i in range(0, len(rows), STREAM_BATCH):
+        batch = ','.join(dumps(entry_json(e)) for e in rows[i:i + STREAM_BATCH])
+        yield ((',' if i else '') + batch).encode('utf-8', 'replace')
+    yield b']}\n'
@@ -0,0 +1,253 @@
+# modules/metrics.py
+
+import os
+import json
+import time
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'usb_share_requests_total': (
+        'counter', 'HTTP responses by route and status code', None),
+    'usb_share_bytes_sent_total': (
+        'counter', 'Response body bytes sent per share', None),
+    'usb_share_active_connections': (
+        'gauge', 'Client connections currently open', None),
+    'usb_share_transfer_throughput_bytes_per_second': (
+        'histogram', 'Throughput of file bodies of 1MB or more',
+        [2 ** n * 1024 * 1024 for n in range(-2, 11)]),
+    'usb_share_time_to_first_byte_seconds': (
+        'histogram', 'Time from reading the request to sending response headers',
+        [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]),
+    'usb_share_block_cache_hits_total': (
+        'counter', 'Block cache reads served from memory', None),
+    'usb_share_block_cache_misses_total': (
+        'counter', 'Block cache reads that went to the device', None),
+    'usb_share_block_cache_bytes': (
+        'gauge', 'Memory held by the block cache', None),
+    'usb_share_listing_duration_seconds': (
+        'histogram', 'Time to build and send a directory listing',
+        [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]),
+    'usb_share_worker_processes': (
+        'gauge', 'Pre-fork worker processes running', None),
+    'usb_share_worker_restarts_total': (
+        'counter', 'Pre-fork worker processes restarted after dying', None),
+    'usb_share_digest_bytes_total': (
+        'counter', 'File bytes read by the background SHA-256 pass', None),
+    'usb_share_digest_files_total': (
+        'counter', 'Files hashed by the background SHA-256 pass', None),
+}
+
+# Label names for each metric, in the order callers pass the values
+METRICS_LABELS = {
+    'usb_share_requests_total': ('route', 'code'),
+    'usb_share_bytes_sent_total': ('share',),
+    'usb_share_transfer_throughput_bytes_per_second': ('share',),
+}
+THROUGHPUT_MIN_BYTES = 1024 * 1024
+EXPORT_INTERVAL = 1  # Seconds between snapshots in pre-fork mode
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class Registry:
+    """Metric store that never takes a lock on the hot path.
+
+    Each thread updates its own shard; a scrape sums every shard. Reads
+    race with writers, which at worst leaves a value one update behind.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._export_dir = None
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def dec(self, name, labels=(), value=1):
+        self.inc(name, labels, -value)
+
+    def set(self, name, value, labels=()):
+        """Set a gauge that only changes under its owner's lock"""
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        hist = histograms.get(key)
+        if hist is None:
+            # One slot per bucket, then +Inf, then the running sum
+            hist = histograms[key] = [0] * (len(METRICS[name][2]) + 2)
+        hist[bisect.bisect_left(METRICS[name][2], value)] += 1
+        hist[-1] += value
+
+    def export(self, directory, interval=EXPORT_INTERVAL):
+        """Share totals with the other processes of a pre-fork server.
+
+        Every interval this process writes its totals to directory as
+        <pid>.json; collect() adds the other processes' files to its own
+        live numbers. Counters of processes that died are kept, their
+        gauges are not. None stops exporting.
+        """
+        with self._lock:
+            start = self._export_dir is None and directory is not None
+            self._export_dir = directory
+        if start:
+            threading.Thread(target=self._export_loop, args=(interval,),
+                             name='metrics-export', daemon=True).start()
+
+    def _export_loop(self, interval):
+        while True:
+            directory = self._export_dir
+            if directory is None:
+                return
+            path = os.path.join(directory, f'{os.getpid()}.json')
+            counters, histograms = self._collect_local()
+            data = {'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                    'histograms': [[name, list(labels), hist] for (name, labels), hist in histograms.items()]}
+            try:
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(data, f, separators=(',', ':'))
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass  # Supervisor removed the directory on shutdown
+            time.sleep(interval)
+
+    def collect(self):
+        """Totals of this process (and its pre-fork siblings) as ({key: value}, {key: histogram})"""
+        counters, histograms = self._collect_local()
+        directory = self._export_dir
+        if directory:
+            self._merge_exports(directory, counters, histograms)
+        return counters, histograms
+
+    def _merge_exports(self, directory, counters, histograms):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            pid, ext = os.path.splitext(name)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _pid_alive(int(pid))
+            for metric, labels, value in data['counters']:
+                if metric not in METRICS or (METRICS[metric][0] == 'gauge' and not alive):
+                    continue
+                key = (metric, tuple(labels))
+                counters[key] = counters.get(key, 0) + value
+            for metric, labels, hist in data['histograms']:
+                if metric not in METRICS:
+                    continue
+                key = (metric, tuple(labels))
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = hist
+                else:
+                    for i, value in enumerate(hist):
+                        total[i] += value
+
+    def _collect_local(self):
+        with self._lock:
+            shards = list(self._shards)
+            counters = dict(self._gauges)
+        histograms = {}
+        for shard in shards:
+            for key, value in shard.counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, hist in shard.histograms.copy().items():
+                hist = list(hist)
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = hist
+                else:
+                    for i, value in enumerate(hist):
+                        total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind != 'histogram':
+                series = sorted((k, v) for k, v in counters.items() if k[0] == name)
+                if not series and not METRICS_LABELS.get(name):
+                    series = [((name, ()), 0)]
+                for (_, labels), value in series:
+                    lines.append(f'{name}{_format_labels(name, labels)} {value}')
+                continue
+            for (_, labels), hist in sorted((k, v) for k, v in histograms.items() if k[0] == name):
+                cumulative = 0
+                for bound, count in zip(buckets + ['+Inf'], hist):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else f'{bound:g}'
+                    lines.append(f'{name}_bucket{_format_labels(name, labels, le=le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(name, labels)} {hist[-1]}')
+                lines.append(f'{name}_count{_format_labels(name, labels)} {cumulative}')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(name, labels, **extra):
+    pairs = list(zip(METRICS_LABELS.get(name, ()), labels)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+registry = Registry()
+
+
+def record_transfer(share, nbytes, started):
+    """Account a file body sent since the perf_counter() reading started"""
+    registry.inc('usb_share_bytes_sent_total', (share,), nbytes)
+    if nbytes >= THROUGHPUT_MIN_BYTES:
+        elapsed = time.perf_counter() - started
+        if elapsed > 0:
+            registry.observe('usb_share_transfer_throughput_bytes_per_second',
+                             nbytes / elapsed, (share,))
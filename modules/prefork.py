@@ -0,0 +1,268 @@
+# modules/prefork.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import select
+import signal
+import tempfile
+import threading
+import subprocess
+from modules.metrics import registry as metrics
+from config import WORKER_PROCESSES, BLOCK_CACHE_SIZE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_TIMEOUT = 10  # Seconds a worker may take to start listening
+RESTART_BACKOFF_MAX = 30  # Longest wait between restarts of a crashing worker
+STOP_TIMEOUT = 5
+# Commands the supervisor may send to a running worker
+COMMANDS = {'add_share', 'remove_share', 'set_bandwidth_limit'}
+
+
+def process_count(processes=WORKER_PROCESSES):
+    """Worker processes to run; 0 means one per CPU core"""
+    return processes if processes > 0 else os.cpu_count() or 1
+
+
+class Worker:
+    """A worker process, fed JSON commands one per line on its stdin"""
+
+    def __init__(self, spec, delay=0):
+        self.delay = delay  # Backoff before this slot was (re)started
+        self.restart_at = None
+        status_r, status_w = os.pipe()
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, '-m', 'modules.prefork', str(status_w)],
+                cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                pass_fds=(status_w,), text=True)
+        except OSError:
+            os.close(status_r)
+            raise
+        finally:
+            os.close(status_w)
+        self.started = time.monotonic()
+        self._status = status_r
+        self.send(spec)
+
+    def wait_ready(self, timeout=START_TIMEOUT):
+        """None once the worker is listening, else why it failed"""
+        data = b''
+        deadline = time.monotonic() + timeout
+        try:
+            while not data.endswith(b'\n'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self._status], [], [], remaining)[0]:
+                    self.kill()
+                    return "timed out starting"
+                chunk = os.read(self._status, 4096)
+                if not chunk:
+                    return "exited while starting"
+                data += chunk
+        finally:
+            os.close(self._status)
+        status = data.decode('utf-8', 'replace').strip()
+        return None if status == 'ready' else status
+
+    def send(self, message):
+        try:
+            self.proc.stdin.write(json.dumps(message) + '\n')
+            self.proc.stdin.flush()
+        except (OSError, ValueError):
+            pass  # Dead worker; the supervisor restarts it
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        """Ask the worker to finish: it stops serving when its stdin closes"""
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class PreforkSupervisor:
+    """Serves a FileServer from several worker processes sharing its port.
+
+    Each worker is a fresh interpreter that binds the port with
+    SO_REUSEPORT, so the kernel spreads connections over the processes and
+    listing, header parsing and copies run on every core. Workers start
+    from the server's settings and shares; later share and bandwidth
+    changes are broadcast to them. A worker that dies is restarted, with
+    a growing delay if it keeps crashing. Metrics are merged across
+    workers through snapshot files (see Registry.export), and bandwidth
+    caps hold for all workers together through one SharedBuckets file.
+
+    Mirrors the socketserver API used by FileServer (serve_forever,
+    shutdown, server_close) so it stands in for either engine.
+    """
+
+    def __init__(self, server, processes):
+        self.server = server
+        self.processes = processes
+        self.metrics_dir = tempfile.mkdtemp(prefix='usb_share_metrics_')
+        self.buckets_path = os.path.join(self.metrics_dir, 'buckets')
+        self.commands = []  # Bandwidth changes, replayed to restarted workers
+        self.workers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self._serving = False
+        metrics.export(self.metrics_dir)
+        try:
+            for _ in range(processes):
+                self.workers.append(Worker(self.spec()))
+            for worker in self.workers:
+                error = worker.wait_ready()
+                if error:
+                    raise OSError(f"worker process failed: {error}")
+        except BaseException:
+            self.server_close()
+            raise
+        metrics.set('usb_share_worker_processes', len(self.workers))
+
+    def spec(self):
+        """Everything a new worker needs to serve like the others"""
+        shares = self.server.shares
+        return {
+            'port': self.server.port,
+            'engine': self.server.engine,
+            'tls': self.server.tls,
+            'directory': self.server.directory,
+            'shares': shares.items() if shares is not None else None,
+            'processes': self.processes,
+            'metrics_dir': self.metrics_dir,
+            'buckets': self.buckets_path,
+            'commands': self.commands,
+        }
+
+    def broadcast(self, command, *args):
+        message = [command, *args]
+        with self._lock:
+            if command == 'set_bandwidth_limit':
+                self.commands.append(message)
+            for worker in self.workers:
+                worker.send(message)
+
+    def serve_forever(self):
+        self._serving = True
+        try:
+            while not self._stopped.wait(0.5):
+                with self._lock:
+                    for i, worker in enumerate(self.workers):
+                        if not worker.alive():
+                            self.workers[i] = self._restart(worker)
+        finally:
+            self._done.set()
+
+    def _restart(self, worker):
+        now = time.monotonic()
+        if worker.restart_at is None:
+            # A worker that ran for a while is restarted at once
+            lived = now - worker.started
+            worker.delay = 0 if lived >= RESTART_BACKOFF_MAX else min(max(worker.delay * 2, 1),
+                                                                      RESTART_BACKOFF_MAX)
+            worker.restart_at = now + worker.delay
+            print(f"Worker {worker.proc.pid} exited with status {worker.proc.returncode}, "
+                  f"restarting in {worker.delay}s")
+        if now < worker.restart_at:
+            return worker
+        try:
+            new = Worker(self.spec(), worker.delay)
+        except OSError as e:
+            print(f"Could not start worker: {e}")
+            worker.restart_at = None
+            return worker
+        error = new.wait_ready()
+        if error:
+            print(f"Restarted worker failed: {error}")
+        metrics.inc('usb_share_worker_restarts_total')
+        return new
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._serving:
+            self._done.wait()
+
+    def server_close(self):
+        with self._lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in workers:
+            try:
+                worker.proc.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        metrics.set('usb_share_worker_processes', 0)
+        metrics.export(None)
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+
+def apply_command(server, message):
+    command, *args = message
+    if command not in COMMANDS:
+        return
+    getattr(server, command)(*args)
+
+
+def worker_main(status_fd):
+    """Entry point of a worker process: serve until stdin closes"""
+    # Ctrl+C reaches the whole process group; the supervisor decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    status = os.fdopen(status_fd, 'w')
+    spec = json.loads(sys.stdin.readline())
+
+    from modules.server import FileServer, MultiShareServer
+    from modules.search import metadata_index
+    from modules.digests import digest_index
+    from modules.throttle import shaper
+    from modules.blockcache import block_cache
+
+    processes = spec['processes']
+    metadata_index.indexing = False  # The supervisor indexes and hashes for everyone
+    digest_index.hashing = False
+    # Bandwidth caps are enforced jointly through shared buckets; cache
+    # memory is per process, so its budget is split between the workers
+    shaper.share_buckets(spec['buckets'])
+    block_cache.max_bytes = BLOCK_CACHE_SIZE // processes
+    metrics.export(spec['metrics_dir'])
+
+    if spec['shares'] is None:
+        server = FileServer(spec['directory'], spec['port'], spec['engine'],
+                            open_browser=False, processes=1, reuse_port=True, tls=spec['tls'])
+    else:
+        server = MultiShareServer(spec['port'], spec['engine'], open_browser=False,
+                                  processes=1, reuse_port=True, tls=spec['tls'])
+        for label, directory in spec['shares']:
+            server.shares.add(directory, label)
+    server.start()
+    if server.httpd is None:
+        status.write(f"{server.error}\n")
+        status.close()
+        return 1
+    for message in spec['commands']:
+        apply_command(server, message)
+    status.write('ready\n')
+    status.close()
+
+    for line in sys.stdin:
+        try:
+            apply_command(server, json.loads(line))
+        except Exception as e:
+            print(f"Worker {os.getpid()}: bad command {line.strip()!r}: {e}", file=sys.stderr)
+    server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(worker_main(int(sys.argv[1])))
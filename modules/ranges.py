@@ -0,0 +1,116 @@
+# modules/ranges.py
+
+import uuid
+import email.utils
+
+MAX_RANGES = 64  # More ranges than this is treated as abuse and ignored
+
+
+def parse_ranges(range_header, file_size):
+    """Parse a Range header (RFC 7233) against a representation of file_size bytes.
+
+    Returns a sorted list of coalesced (start, end) inclusive byte ranges,
+    an empty list when no range is satisfiable (respond 416), or None when
+    the header is malformed or uses another unit (ignore it and send 200).
+    """
+    try:
+        unit, _, spec = range_header.partition('=')
+    except AttributeError:
+        return None
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    seen = False
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        seen = True
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if first == '':
+            # Suffix range: the last N bytes
+            if last == '':
+                return None
+            suffix = int(last)
+            if suffix == 0 or file_size == 0:
+                continue
+            ranges.append((max(file_size - suffix, 0), file_size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= file_size:
+            continue  # Unsatisfiable, but others may still be fine
+        end = min(int(last), file_size - 1) if last else file_size - 1
+        ranges.append((start, end))
+
+    if not seen or len(ranges) > MAX_RANGES:
+        return None
+    return coalesce_ranges(ranges)
+
+
+def coalesce_ranges(ranges):
+    """Merge overlapping and adjacent ranges, returned in ascending order"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(if_range, last_modified, etag=None):
+    """Check an If-Range header against the current validators.
+
+    A missing header always matches. An entity tag must match the strong
+    ETag exactly; an HTTP-date must equal the file's Last-Modified second.
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag is not None and not if_range.startswith('W/') and if_range == etag
+    try:
+        date = email.utils.parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    if date is None:
+        return False
+    return int(date.timestamp()) == int(last_modified)
+
+
+def content_range(start, end, file_size):
+    return f'bytes {start}-{end}/{file_size}'
+
+
+def unsatisfiable_range(file_size):
+    return f'bytes */{file_size}'
+
+
+def multipart_byteranges(ranges, content_type, file_size):
+    """Lay out a multipart/byteranges body without reading any file data.
+
+    Returns (boundary, parts, trailer, content_length) where parts is a list
+    of (part_header_bytes, start, length); the caller writes each header and
+    then streams the byte range straight from the file.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    total = 0
+    for start, end in ranges:
+        header = (f'\r\n--{boundary}\r\n'
+                  f'Content-Type: {content_type}\r\n'
+                  f'Content-Range: {content_range(start, end, file_size)}\r\n'
+                  f'\r\n').encode('latin-1')
+        length = end - start + 1
+        parts.append((header, start, length))
+        total += len(header) + length
+    trailer = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    total += len(trailer)
+    return boundary, parts, trailer, total
@@ -0,0 +1,279 @@
+# modules/search.py
+
+import os
+import json
+import html
+import stat
+import sqlite3
+import threading
+import urllib.parse
+from modules.utils import format_size, format_date
+from modules.upload import is_partial_upload
+from modules.listing import LISTING_CSS, search_form
+from config import CACHE_DIR, SEARCH_INDEX_ENABLED, INDEX_RESCAN_INTERVAL, SEARCH_RESULTS_LIMIT
+
+INDEX_PATH = os.path.join(CACHE_DIR, 'index.sqlite3')
+COMMIT_EVERY = 200  # Directories per write transaction during a walk
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    share TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (share, parent, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_name ON files (share, name_lower);
+CREATE TABLE IF NOT EXISTS dirs (
+    share TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (share, path)
+) WITHOUT ROWID;
+'''
+
+
+class MetadataIndex:
+    """SQLite index of names, sizes and mtimes for every file on the shares.
+
+    Each share is walked once in a background thread, then rescanned every
+    INDEX_RESCAN_INTERVAL seconds. A rescan only stats directories and
+    re-reads those whose mtime changed, so an idle drive costs one stat
+    per directory. Paths are stored relative to the share, '/'-separated.
+    Pre-fork workers set indexing to False and only query: the supervisor
+    process keeps the index current for all of them.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.indexing = True
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._watched = {}  # share -> stop Event
+        self._ready = set()  # shares whose first walk has finished
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def watch(self, share):
+        """Start indexing a share in the background (no-op if already running)"""
+        share = os.path.abspath(share)
+        if not self.indexing:
+            return
+        with self._lock:
+            if share in self._watched:
+                return
+            stop = self._watched[share] = threading.Event()
+        threading.Thread(target=self._run, args=(share, stop),
+                         name=f'indexer-{share}', daemon=True).start()
+
+    def unwatch(self, share):
+        with self._lock:
+            stop = self._watched.pop(os.path.abspath(share), None)
+            self._ready.discard(os.path.abspath(share))
+        if stop is not None:
+            stop.set()
+
+    def is_ready(self, share):
+        share = os.path.abspath(share)
+        if not self.indexing:
+            # Another process indexes; a stored root directory means it got going
+            row = self._connect().execute('SELECT 1 FROM dirs WHERE share = ? AND path = ?',
+                                          (share, '')).fetchone()
+            return row is not None
+        return share in self._ready
+
+    def _run(self, share, stop):
+        while not stop.is_set():
+            try:
+                self.rescan(share, stop)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Indexing {share} failed: {e}")
+            else:
+                if not stop.is_set():
+                    with self._lock:
+                        self._ready.add(share)
+            stop.wait(INDEX_RESCAN_INTERVAL)
+
+    def rescan(self, share, stop=None):
+        """Bring the index of a share up to date, re-reading changed directories"""
+        conn = self._connect()
+        known = dict(conn.execute('SELECT path, mtime_ns FROM dirs WHERE share = ?', (share,)))
+        seen = set()
+        stack = ['']
+        pending = 0
+        while stack:
+            if stop is not None and stop.is_set():
+                break
+            rel = stack.pop()
+            full = os.path.join(share, rel) if rel else share
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            seen.add(rel)
+            if known.get(rel) == st.st_mtime_ns:
+                stack.extend(self._child_dirs(conn, share, rel))
+                continue
+            stack.extend(self._index_dir(conn, share, rel, full, st))
+            pending += 1
+            if pending >= COMMIT_EVERY:
+                conn.commit()
+                pending = 0
+        else:
+            # Full walk completed: forget directories that are gone
+            for rel in set(known) - seen:
+                conn.execute('DELETE FROM dirs WHERE share = ? AND path = ?', (share, rel))
+                conn.execute('DELETE FROM files WHERE share = ? AND parent = ?', (share, rel))
+        conn.commit()
+
+    def _child_dirs(self, conn, share, rel):
+        rows = conn.execute('SELECT name FROM files WHERE share = ? AND parent = ? AND is_dir = 1',
+                            (share, rel))
+        return [f'{rel}/{name}' if rel else name for name, in rows]
+
+    def _index_dir(self, conn, share, rel, full, st):
+        rows, subdirs = [], []
+        try:
+            with os.scandir(full) as it:
+                for entry in it:
+                    if is_partial_upload(entry.name):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        entry_st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if not is_dir and not stat.S_ISREG(entry_st.st_mode):
+                        continue
+                    rows.append((share, rel, entry.name, entry.name.lower(), int(is_dir),
+                                 None if is_dir else entry_st.st_size, entry_st.st_mtime_ns))
+                    if is_dir:
+                        subdirs.append(f'{rel}/{entry.name}' if rel else entry.name)
+        except OSError:
+            return []
+        conn.execute('DELETE FROM files WHERE share = ? AND parent = ?', (share, rel))
+        conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (share, rel, st.st_mtime_ns))
+        return subdirs
+
+    def search(self, share, query, within='', limit=SEARCH_RESULTS_LIMIT, offset=0):
+        """Entries whose name contains query, prefix matches first.
+
+        Returns (results, more) where results is a list of
+        (path, is_dir, size, mtime_ns) and more says whether another page
+        exists. within limits the search to a subdirectory.
+        """
+        share = os.path.abspath(share)
+        needle = query.lower()
+        sql = ['SELECT parent, name, is_dir, size, mtime_ns FROM files',
+               'WHERE share = ? AND instr(name_lower, ?) > 0']
+        params = [share, needle]
+        if within:
+            # parent is within or below it; '0' sorts right after '/'
+            sql.append('AND (parent = ? OR (parent >= ? AND parent < ?))')
+            params += [within, within + '/', within + '0']
+        sql.append('ORDER BY instr(name_lower, ?) != 1, name_lower, parent LIMIT ? OFFSET ?')
+        params += [needle, limit + 1, offset]
+        rows = self._connect().execute(' '.join(sql), params).fetchall()
+        results = [(f'{parent}/{name}' if parent else name, bool(is_dir), size, mtime_ns)
+                   for parent, name, is_dir, size, mtime_ns in rows[:limit]]
+        return results, len(rows) > limit
+
+
+metadata_index = MetadataIndex(INDEX_PATH)
+
+
+def parse_search_query(query):
+    """The ?q= search term and result offset, or None when not searching"""
+    params = urllib.parse.parse_qs(query)
+    q = params.get('q', [''])[0].strip()
+    if not q or not SEARCH_INDEX_ENABLED:
+        return None
+    try:
+        offset = max(int(params.get('offset', ['0'])[0]), 0)
+    except ValueError:
+        offset = 0
+    return q, offset
+
+
+def search_share(base_path, path, query, offset=0):
+    """Run a search below the directory path; starts indexing the share if needed"""
+    metadata_index.watch(base_path)
+    within = os.path.relpath(path, base_path)
+    within = '' if within == '.' else within.replace(os.sep, '/')
+    results, more = metadata_index.search(base_path, query, within, offset=offset)
+    return results, more, metadata_index.is_ready(base_path)
+
+
+def render_search(results, more, complete, query, offset, base_path, path, port, format='html'):
+    """Search results page as encoded HTML or JSON"""
+    within = os.path.relpath(path, base_path)
+    prefix = '' if within == '.' else within.replace(os.sep, '/') + '/'
+    next_page = (f'?{urllib.parse.urlencode({"q": query, "offset": offset + len(results)})}'
+                 if more else None)
+    if format == 'json':
+        return json.dumps({
+            'query': query,
+            'offset': offset,
+            'complete': complete,
+            'next': next_page,
+            'results': [{'path': '/' + p, 'type': 'dir' if is_dir else 'file',
+                         'size': size, 'mtime': mtime_ns / 1e9 if mtime_ns else None}
+                        for p, is_dir, size, mtime_ns in results],
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8', 'replace')
+
+    r = ['<!DOCTYPE HTML>', '<html>\n<head>', '<meta charset="utf-8">',
+         '<title>USB File Sharing</title>', LISTING_CSS, '</head>', '<body>',
+         '<div class="container">',
+         f'<h2>Search results for “{html.escape(query)}”</h2>',
+         search_form(query),
+         '<div class="path-info">']
+    r.append(f'Searching in: {html.escape(prefix or "USB Drive Root")} • '
+             f'<a href=".">Back to folder</a>')
+    if not complete:
+        r.append(' • Indexing in progress, results may be incomplete')
+    r.append('</div>')
+    r.append('<ul class="file-list">')
+    for rel, is_dir, size, mtime_ns in results:
+        # Links are relative to the directory the search was run in
+        shown = rel[len(prefix):] if rel.startswith(prefix) else rel
+        href = urllib.parse.quote(shown + ('/' if is_dir else ''))
+        info = 'Directory' if is_dir else format_size(size)
+        if mtime_ns:
+            info += f' • {format_date(mtime_ns / 1e9)}'
+        icon = 'folder-icon' if is_dir else 'zip-icon' if rel.lower().endswith('.zip') else 'file-icon'
+        r.append('<li class="file-item">')
+        r.append(f'<a href="{href}" class="file-link {icon}">{html.escape(shown)}</a>')
+        r.append(f'<span class="file-info">{info}</span>')
+        r.append('</li>')
+    if not results:
+        r.append('<li class="file-item">No matches</li>')
+    r.append('</ul>')
+    if offset or more:
+        r.append('<div class="pagination">')
+        if offset:
+            prev = urllib.parse.urlencode({'q': query, 'offset': max(offset - SEARCH_RESULTS_LIMIT, 0)})
+            r.append(f'<a href="?{prev}">Previous</a>')
+        r.append(f'Showing {offset + 1}-{offset + len(results)}')
+        if next_page:
+            r.append(f'<a href="{next_page}">Next</a>')
+        r.append('</div>')
+    r.append('<div class="server-info">')
+    r.append(f'Server Port: {port} • Files served from: {html.escape(base_path)}')
+    r.append('</div>')
+    r.append('</div>')
+    r.append('</body>\n</html>\n')
+    return '\n'.join(r).encode('utf-8', 'replace')
+
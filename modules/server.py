@@ -1,361 +1,1047 @@
 import socketserver
 import webbrowser
+import selectors
 import threading
+import queue
+import collections
+import concurrent.futures
 import http.server
 import os
-import urllib.parse
+import stat
 import socket
-import mmap
-from modules.utils import get_local_ip, format_size, format_date
-from config import PORT
+import ssl
+import sys
+import sqlite3
+import time
+import html
+import urllib.parse
+from modules.utils import get_local_ip, translate_url_path
+from modules.transfer import send_file, send_views, is_tls, readahead_for, SEQUENTIAL_MIN
+from modules.tls import server_context
+from modules.blockcache import block_cache
+from modules.throttle import shaper
+from modules.metrics import registry as metrics, record_transfer, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from modules.listing import render_listing, parse_listing_query, LISTING_CONTENT_TYPES
+from modules.ranges import (parse_ranges, if_range_matches, content_range,
+                            unsatisfiable_range, multipart_byteranges)
+from modules.validators import (make_etag, make_listing_etag, encoded_etag, last_modified,
+                                is_not_modified, FILE_CACHE_CONTROL, LISTING_CACHE_CONTROL)
+from modules.compression import (is_compressible, select_variant, listing_encoding,
+                                 compressed_file_chunks, LISTING_VARY)
+from modules.search import parse_search_query, search_share, render_search, metadata_index
+from modules.shares import ShareTable, render_share_index, share_url_path, SHARE_PREFIX
+from modules.archive import parse_archive_query, archive_chunks, content_disposition, ARCHIVE_TYPES
+from modules.digests import (digest_index, digest_headers, parse_manifest_query, manifest_chunks,
+                             MANIFEST_TYPES)
+from modules.thumbnails import (parse_thumbnail_query, thumbnail_kind, thumbnail_etag, thumbnailer,
+                                CONTENT_TYPE as THUMBNAIL_CONTENT_TYPE)
+from modules.upload import Upload, UploadError, parse_content_range, UPLOAD_CHUNK
+from modules.async_server import AsyncFileServer
+from modules.prefork import PreforkSupervisor, process_count
+from config import (PORT, SERVER_ENGINE, UPLOADS_ENABLED, KEEPALIVE_TIMEOUT, KEEPALIVE_MAX_REQUESTS,
+                    WORKER_THREADS, WORKER_QUEUE_SIZE, MAX_CONNECTIONS_PER_IP, RETRY_AFTER, WORKER_PROCESSES,
+                    METRICS_PATH, SEARCH_INDEX_ENABLED, DIGESTS_ENABLED, TLS_ENABLED,
+                    THUMBNAIL_TIMEOUT)
+
+REJECT_RESPONSE = (f'HTTP/1.1 503 Service Unavailable\r\n'
+                   f'Retry-After: {RETRY_AFTER}\r\n'
+                   f'Content-Length: 0\r\n'
+                   f'Connection: close\r\n\r\n').encode('latin-1')
+MAX_IDLE_CONNECTIONS = 512  # Parked connections beyond this are closed (new ones get 503)
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
     daemon_threads = True
     request_queue_size = 50
+    reuse_port = False  # Pre-fork workers all bind the same port
 
     def server_bind(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4194304)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4194304)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
         super().server_bind()
 
+class PooledTCPServer(ThreadedTCPServer):
+    """TCP server handing connections to a fixed pool of worker threads.
+
+    Connections that have no request waiting, new ones and idle keep-alive
+    ones alike, are parked in a selector watched by one thread instead of
+    holding a worker; each goes back to the queue once it becomes readable,
+    and is closed after KEEPALIVE_TIMEOUT idle seconds. Connections wait in
+    a bounded queue; when it is full, or a client IP already has its share
+    of requests being served, the request is answered with 503 and
+    Retry-After straight away instead of queueing more work. With an
+    ssl_context, the TLS handshake happens in the worker, so a slow client
+    cannot hold up the accept thread.
+    """
+
+    parks_idle = True
+
+    def __init__(self, server_address, RequestHandlerClass, workers=WORKER_THREADS,
+                 queue_size=WORKER_QUEUE_SIZE, per_ip_limit=MAX_CONNECTIONS_PER_IP, reuse_port=False,
+                 ssl_context=None):
+        self.reuse_port = reuse_port
+        self.ssl_context = ssl_context
+        self.workers = workers
+        self.per_ip_limit = per_ip_limit
+        self._queue = queue.Queue(queue_size)
+        self._per_ip = collections.Counter()
+        self._lock = threading.Lock()
+        self._idle = 0
+        self._parking = []  # Connections handed to the watcher, not registered yet
+        self._parked = 0
+        self._closing = False
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        # Running before the bind, so server_close() can stop it if that fails
+        self._watcher = threading.Thread(target=self._watch, name='idle-connections', daemon=True)
+        self._watcher.start()
+        super().__init__(server_address, RequestHandlerClass)
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'worker-{i}', daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self._park(request, client_address, None)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def reject(self, request):
+        metrics.inc('usb_share_requests_total', ('rejected', '503'))
+        # A TLS client could not read a plain-text 503; it just sees the close
+        if self.ssl_context is None:
+            try:
+                request.setblocking(False)
+                request.send(REJECT_RESPONSE)
+            except OSError:
+                pass
+        self.shutdown_request(request)
+
+    def saturated(self):
+        """True when no worker is free, so keep-alive connections should yield"""
+        return self._idle == 0 or not self._queue.empty()
+
+    def _release(self, ip):
+        with self._lock:
+            self._per_ip[ip] -= 1
+            if self._per_ip[ip] <= 0:
+                del self._per_ip[ip]
+
+    def _park(self, request, client_address, handler):
+        """Wait for the connection's next request without holding a worker"""
+        with self._lock:
+            full = self._closing or self._parked >= MAX_IDLE_CONNECTIONS
+            if not full:
+                self._parked += 1
+                self._parking.append(
+                    (request, client_address, handler, time.monotonic() + KEEPALIVE_TIMEOUT))
+        if full:
+            self._close(request, handler, reject=handler is None)
+            return
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass  # The watcher is already awake
+
+    def _close(self, request, handler, reject=False):
+        if handler is not None:
+            handler.parked = False
+            try:
+                handler.finish()
+            except OSError:
+                pass
+        if reject:
+            self.reject(request)
+        else:
+            self.shutdown_request(request)
+
+    def _watch(self):
+        next_expiry = 0
+        while not self._closing:
+            for key, _ in self._selector.select(1):
+                if key.fileobj is self._wake_r:
+                    try:
+                        self._wake_r.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                with self._lock:
+                    self._parked -= 1
+                self._dispatch(*key.data[:3])
+            with self._lock:
+                parking, self._parking = self._parking, []
+            for item in parking:
+                try:
+                    self._selector.register(item[0], selectors.EVENT_READ, item)
+                except (OSError, ValueError):
+                    with self._lock:
+                        self._parked -= 1
+                    self._close(item[0], item[2])
+            now = time.monotonic()
+            if now >= next_expiry:
+                next_expiry = now + 1
+                for key in list(self._selector.get_map().values()):
+                    if key.data is not None and key.data[3] <= now:
+                        self._selector.unregister(key.fileobj)
+                        with self._lock:
+                            self._parked -= 1
+                        self._close(key.fileobj, key.data[2])
+        with self._lock:
+            parking, self._parking = self._parking, []
+        for request, _, handler, _ in parking:
+            self._close(request, handler)
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._close(key.fileobj, key.data[2])
+        self._selector.close()
+
+    def _dispatch(self, request, client_address, handler):
+        """Queue a connection whose next request has arrived"""
+        ip = client_address[0]
+        with self._lock:
+            busy = self._per_ip[ip] >= self.per_ip_limit
+            if not busy:
+                self._per_ip[ip] += 1
+        if busy:
+            self._close(request, handler, reject=True)
+            return
+        try:
+            self._queue.put_nowait((request, client_address, handler))
+        except queue.Full:
+            self._release(client_address[0])
+            self._close(request, handler, reject=True)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            item = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if item is None:
+                return
+            request, client_address, handler = item
+            try:
+                if handler is not None:
+                    handler.resume()
+                else:
+                    if self.ssl_context is not None:
+                        # Handshake happens on the handler's first read
+                        request = self.ssl_context.wrap_socket(request, server_side=True,
+                                                               do_handshake_on_connect=False)
+                    handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self._release(client_address[0])
+            if handler is not None and handler.parked:
+                self._park(request, client_address, handler)
+            else:
+                self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        # Failed handshakes (port scans, untrusted certificates) are routine
+        if isinstance(sys.exc_info()[1], (ssl.SSLError, ConnectionError)):
+            return
+        super().handle_error(request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        with self._lock:
+            self._closing = True
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+        self._watcher.join(5)
+        self._wake_r.close()
+        self._wake_w.close()
+        for _ in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
 class USBFileHandler(http.server.SimpleHTTPRequestHandler):
-    rbufsize = 2097152  # 2MB read buffer
-    wbufsize = 2097152  # 2MB write buffer
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT  # Idle keep-alive connections are dropped after this
+    # Bodies go through sendfile()/readinto(), so the stream buffers only
+    # carry headers and small writes; keep them small per connection.
+    rbufsize = 65536
+    wbufsize = 65536
+    # Headers and a small body go out as separate writes; without this,
+    # Nagle holds the body back until the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    # Errors that leave the request stream in an unknown state
+    FATAL_ERRORS = {400, 408, 411, 413, 414, 431, 501, 505}
     
-    def __init__(self, *args, directory=None, port=None, **kwargs):
-        self.base_path = os.path.abspath(directory) if directory else os.getcwd()
+    def __init__(self, *args, directory=None, port=None, shares=None, **kwargs):
+        self.shares = shares
+        if shares is not None:
+            self.base_path = ''  # Picked per request from the URL
+        else:
+            self.base_path = os.path.abspath(directory) if directory else os.getcwd()
+        self.url_prefix = ''
         self.port = port
+        self.requests_handled = 0
+        self.response_started = False
         super().__init__(*args, **kwargs)
 
+    def setup(self):
+        super().setup()
+        self.parked = False
+        self.throttle = shaper.throttle(self.base_path, self.client_address[0])
+        metrics.inc('usb_share_active_connections')
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        self.handle_pipelined()
+
+    def handle_pipelined(self):
+        """Serve requests that already arrived; park the connection when none has"""
+        while not self.close_connection:
+            if getattr(self.server, 'parks_idle', False) and not self.request_waiting():
+                # The pool watches the socket and calls resume() on the next request
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def resume(self):
+        self.parked = False
+        try:
+            self.handle_one_request()
+            self.handle_pipelined()
+        finally:
+            if not self.parked:
+                self.finish()
+
+    def request_waiting(self):
+        """Whether the next request has (partly) arrived, without blocking"""
+        if is_tls(self.connection) and self.connection.pending():
+            return True
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        except OSError:
+            return True  # Let the next read report it
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def finish(self):
+        if self.parked:
+            return  # Still open; finished when the pool closes or resumes it
+        metrics.dec('usb_share_active_connections')
+        super().finish()
+
+    def handle_one_request(self):
+        self.requests_handled += 1
+        self.response_started = False
+        self.body_consumed = False
+        self.route = 'other'
+        self.started = time.perf_counter()
+        super().handle_one_request()
+
+    def log_request(self, code='-', size='-'):
+        code = getattr(code, 'value', code)
+        metrics.inc('usb_share_requests_total', (self.route, str(code)))
+        super().log_request(code, size)
+
     def end_headers(self):
         self.send_header('Accept-Ranges', 'bytes')
-        self.send_header('Cache-Control', 'public, max-age=31536000')
         self.send_header('X-Sendfile-Type', 'X-Sendfile')
+        if not self.close_connection:
+            saturated = getattr(self.server, 'saturated', None)
+            if self.command != 'PUT' and self.request_body_pending():
+                # Only PUT reads bodies; left unread, one would be parsed as the next request
+                self.send_header('Connection', 'close')
+            elif self.requests_handled >= KEEPALIVE_MAX_REQUESTS or (saturated and saturated()):
+                self.send_header('Connection', 'close')
+            else:
+                if self.request_version == 'HTTP/1.0':
+                    self.send_header('Connection', 'keep-alive')
+                remaining = KEEPALIVE_MAX_REQUESTS - self.requests_handled
+                self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}, max={remaining}')
+        self.response_started = True
+        if hasattr(self, 'started'):
+            metrics.observe('usb_share_time_to_first_byte_seconds', time.perf_counter() - self.started)
         super().end_headers()
 
+    def send_error(self, code, message=None, explain=None):
+        """Send an error reply, keeping the connection usable when it is safe.
+
+        Once a response is under way its framing cannot be repaired, so the
+        connection is closed instead of appending a second response.
+        """
+        if self.response_started:
+            self.log_error("code %d after response started, closing: %s", code, message)
+            self.close_connection = True
+            return
+        # Drop headers queued by a response that failed before end_headers()
+        self._headers_buffer = []
+
+        try:
+            shortmsg, longmsg = self.responses[code]
+        except KeyError:
+            shortmsg, longmsg = '???', '???'
+        if message is None:
+            message = shortmsg
+        if explain is None:
+            explain = longmsg
+        self.log_error("code %d, message %s", code, message)
+        self.send_response(code, message)
+        if code in self.FATAL_ERRORS or self.request_body_pending():
+            self.send_header('Connection', 'close')
+
+        body = None
+        if code >= 200 and code not in (204, 205, 304):
+            content = (self.error_message_format % {
+                'code': code,
+                'message': html.escape(message, quote=False),
+                'explain': html.escape(explain, quote=False)
+            })
+            body = content.encode('UTF-8', 'replace')
+            self.send_header("Content-Type", self.error_content_type)
+        self.send_header('Content-Length', str(len(body) if body else 0))
+        self.end_headers()
+
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+
+    def request_body_pending(self):
+        """Whether the client sent a body this handler has not read"""
+        headers = getattr(self, 'headers', None)
+        if headers is None or self.command == 'PUT' and self.body_consumed:
+            return False
+        return bool(headers.get('Transfer-Encoding')) or headers.get('Content-Length', '0').strip() not in ('', '0')
+
+    def write_body(self, data):
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+            metrics.inc('usb_share_bytes_sent_total', (self.base_path,), len(data))
+
+    def do_HEAD(self):
+        # Same headers as GET; every body writer checks self.command
+        self.do_GET()
+
+    def send_validators(self, etag, st, cache_control, vary=None):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified(st))
+        self.send_header('Cache-Control', cache_control)
+        if vary:
+            self.send_header('Vary', vary)
+
+    def send_digests(self, path, st):
+        """Digest fields of the whole file (also on 206: they describe the representation)"""
+        for name, value in digest_headers(path, st):
+            self.send_header(name, value)
+
+    def send_not_modified(self, etag, st, cache_control, vary=None):
+        self.send_response(304)
+        self.send_validators(etag, st, cache_control, vary)
+        self.end_headers()
+
     def do_GET(self):
+        if METRICS_PATH and urllib.parse.urlsplit(self.path).path == METRICS_PATH:
+            return self.send_metrics()
+        if self.shares is not None and not self.select_share():
+            return
         path = self.translate_path(self.path)
-        
-        if os.path.isfile(path):
-            try:
-                file_size = os.path.getsize(path)
-                
-                range_header = self.headers.get('Range')
-                if range_header:
-                    start, end = self.parse_range_header(range_header, file_size)
-                    if start is not None and end is not None:
-                        return self.serve_range(path, start, end, file_size)
-
-                return self.serve_file(path, file_size)
-                
-            except Exception as e:
-                self.send_error(500, f"Server error: {e}")
-                return
-        
-        if os.path.isdir(path):
-            self.list_directory(path)
-        else:
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        if stat.S_ISDIR(st.st_mode):
+            query = urllib.parse.urlsplit(self.path).query
+            search = parse_search_query(query)
+            if search:
+                self.route = 'search'
+                return self.send_search(path, *search)
+            kind = parse_archive_query(query)
+            if kind:
+                self.route = 'archive'
+                return self.send_archive(path, kind)
+            manifest = parse_manifest_query(query)
+            if manifest:
+                self.route = 'manifest'
+                return self.send_manifest(path, manifest)
+            self.route = 'listing'
+            started = time.perf_counter()
+            self.list_directory(path, st)
+            metrics.observe('usb_share_listing_duration_seconds', time.perf_counter() - started)
+            return
+        if not stat.S_ISREG(st.st_mode):
             self.send_error(404, "File not found")
+            return
 
-    def serve_file(self, path, file_size):
+        thumbnail = parse_thumbnail_query(urllib.parse.urlsplit(self.path).query)
+        if thumbnail:
+            self.route = 'thumbnail'
+            return self.send_thumbnail(path, st, thumbnail)
+
+        self.route = 'file'
+        try:
+            etag = make_etag(st)
+            content_type = self.guess_type(path)
+            vary = 'Accept-Encoding' if is_compressible(path, content_type, st.st_size) else None
+            range_header = self.headers.get('Range')
+
+            # Byte ranges always address the identity representation
+            encoding = variant = None
+            if not range_header:
+                encoding, variant = select_variant(path, st, content_type,
+                                                   self.headers.get('Accept-Encoding'))
+
+            # Answer revalidations before the file is even opened
+            if is_not_modified(self.headers, encoded_etag(etag, encoding), st.st_mtime):
+                return self.send_not_modified(encoded_etag(etag, encoding), st, FILE_CACHE_CONTROL, vary)
+
+            if encoding:
+                return self.serve_encoded(path, st, encoded_etag(etag, encoding), encoding, variant)
+
+            file_size = st.st_size
+            if range_header and if_range_matches(self.headers.get('If-Range'), st.st_mtime, etag):
+                ranges = parse_ranges(range_header, file_size)
+                if ranges == []:
+                    return self.send_range_not_satisfiable(file_size)
+                if ranges:
+                    self.route = 'range'
+                    return self.serve_range(path, ranges, st, etag, vary)
+
+            return self.serve_file(path, st, etag, vary)
+            
+        except Exception as e:
+            self.send_error(500, f"Server error: {e}")
+            return
+
+    def do_PUT(self):
+        """Stream an upload to disk; Content-Range makes it resumable"""
+        self.route = 'upload'
+        if not UPLOADS_ENABLED:
+            self.send_error(405, "Uploads are disabled on this share")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error(411, "Content-Length required")
+            return
+        if self.shares is not None and not self.select_share():
+            return
+
+        path = self.translate_path(self.path)
+        try:
+            start, total = parse_content_range(self.headers.get('Content-Range'), length)
+            with Upload(path, start, total) as upload:
+                if start is not None:
+                    self.receive_body(upload, length)
+                complete = upload.finish()
+                offset = upload.offset
+        except UploadError as e:
+            if e.offset is None:
+                self.send_error(e.code, e.message)
+                return
+            self.send_response(e.code)
+            self.send_upload_offset(e.offset)
+            self.send_header('Content-Length', '0')
+            if self.request_body_pending():
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            return
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+            return
+        except OSError as e:
+            self.send_error(500, f"Error storing upload: {e}")
+            return
+
+        if not complete:
+            self.send_response(202)
+            self.send_upload_offset(offset)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        st = os.stat(path)
+        self.send_response(201 if upload.created else 200)
+        self.send_header('ETag', make_etag(st))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def handle_expect_100(self):
+        # Answered in receive_body, once the upload is known to be accepted
+        return True
+
+    def receive_body(self, upload, length):
+        if (length > 0 and self.request_version == 'HTTP/1.1'
+                and self.headers.get('Expect', '').strip().lower() == '100-continue'):
+            # An interim status line only: the final response's headers come later
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            self.wfile.flush()
+        buf = bytearray(min(UPLOAD_CHUNK, length) or 1)
+        view = memoryview(buf)
+        remaining = length
+        while remaining > 0:
+            n = self.rfile.readinto(view[:min(len(buf), remaining)])
+            if not n:
+                upload.finish()  # Keep what arrived so the client can resume
+                raise ConnectionError("client closed the connection mid-upload")
+            upload.write(view[:n])
+            remaining -= n
+        self.body_consumed = True
+
+    def send_upload_offset(self, offset):
+        self.send_header('Upload-Offset', str(offset))
+        if offset:
+            self.send_header('Range', f'bytes=0-{offset - 1}')
+
+    def serve_file(self, path, st, etag, vary=None):
+        file_size = st.st_size
         try:
             with open(path, 'rb') as f:
                 self.send_response(200)
                 self.send_header('Content-Type', self.guess_type(path))
                 self.send_header('Content-Length', str(file_size))
+                self.send_validators(etag, st, FILE_CACHE_CONTROL, vary)
+                self.send_digests(path, st)
                 self.end_headers()
-                
-                if file_size > 1024 * 1024:  # Files larger than 1MB
-                    self.transfer_large_file(f, file_size)
-                else:
-                    self.transfer_small_file(f)
+                self.transfer_file(f, 0, file_size)
                     
         except Exception as e:
             self.send_error(500, f"Error serving file: {e}")
 
-    def transfer_large_file(self, f, file_size):
+    def serve_encoded(self, path, st, etag, encoding, variant):
+        """Send a content-coded file from a sidecar/cache entry or compress it live"""
+        content_type = self.guess_type(path)
         try:
-            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                chunk_size = 1024 * 1024 * 4  # 4MB chunks
-                for i in range(0, len(mm), chunk_size):
-                    chunk = mm[i:min(i + chunk_size, len(mm))]
-                    self.wfile.write(chunk)
-        except Exception:
-            self.transfer_small_file(f)
-
-    def transfer_small_file(self, f):
-        chunk_size = 262144  # 256KB chunks
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            try:
-                self.wfile.write(chunk)
-            except (ConnectionResetError, BrokenPipeError):
-                break
+            if variant:
+                try:
+                    f = open(variant, 'rb')
+                except OSError:
+                    variant = None  # Evicted or removed since it was selected
+            if variant:
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Encoding', encoding)
+                    self.send_header('Content-Length', str(size))
+                    self.send_validators(etag, st, FILE_CACHE_CONTROL, 'Accept-Encoding')
+                    self.end_headers()
+                    self.transfer_file(f, 0, size)
+                return
+
+            with open(path, 'rb') as f:
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Encoding', encoding)
+                self.send_validators(etag, st, FILE_CACHE_CONTROL, 'Accept-Encoding')
+                self.send_chunks(compressed_file_chunks(f, path, st, encoding))
+
+        except Exception as e:
+            self.send_error(500, f"Error serving file: {e}")
+
+    def transfer_file(self, f, offset, count):
+        """Send count bytes of f from offset, via sendfile() when possible.
 
-    def parse_range_header(self, range_header, file_size):
+        Returns False if the client went away mid-transfer.
+        """
+        if self.command == 'HEAD':
+            return True
+        # Headers sit in the buffered wfile; push them out before the body
+        self.wfile.flush()
+        started = time.perf_counter()
         try:
-            range_value = range_header.split('=')[1]
-            start, end = range_value.split('-')
-            start = int(start) if start else 0
-            end = int(end) if end else file_size - 1
-            return start, end
-        except:
-            return None, None
-
-    def serve_range(self, path, start, end, file_size):
-        length = end - start + 1
+            sent = self.send_file_range(f, offset, count)
+        except (ConnectionResetError, BrokenPipeError, TimeoutError):
+            self.close_connection = True
+            return False
+        record_transfer(self.base_path, sent, started)
+        if sent < count:
+            # File shrank under us: the promised length can't be honoured
+            self.close_connection = True
+            return False
+        return True
+
+    def send_file_range(self, f, offset, count):
+        """Send a byte range, sharing device reads with concurrent downloads.
+
+        A lone reader gets zero-copy sendfile(); once another client starts
+        on the same file, both continue from the shared block cache (as does
+        any file over TLS, which is encrypted in user space and cannot use
+        sendfile).
+        """
+        st = os.fstat(f.fileno())
+        copying = is_tls(self.connection)
+        readahead = readahead_for(f, offset, count, st.st_size)
+        with block_cache.reading(st) as reading:
+            # Short random ranges would read whole blocks for a few KB
+            if not block_cache.enabled or count < SEQUENTIAL_MIN:
+                return send_file(self.connection, f, offset, count, self.throttle, readahead)
+            sent = 0
+            for start, length in block_cache.segments(offset, count):
+                if copying or reading.use_cache(start):
+                    done = send_views(self.connection, block_cache.iter_range(f, st, start, length),
+                                      self.throttle)
+                else:
+                    done = send_file(self.connection, f, start, length, self.throttle, readahead)
+                sent += done
+                if done < length:
+                    break
+            return sent
+
+    def send_range_not_satisfiable(self, file_size):
+        self.send_response(416)
+        self.send_header('Content-Range', unsatisfiable_range(file_size))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def serve_range(self, path, ranges, st, etag, vary=None):
+        file_size = st.st_size
+        content_type = self.guess_type(path)
         
         try:
             with open(path, 'rb') as f:
-                f.seek(start)
+                if len(ranges) == 1:
+                    start, end = ranges[0]
+                    length = end - start + 1
+                    self.send_response(206)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(length))
+                    self.send_header('Content-Range', content_range(start, end, file_size))
+                    self.send_validators(etag, st, FILE_CACHE_CONTROL, vary)
+                    self.send_digests(path, st)
+                    self.end_headers()
+                    self.transfer_file(f, start, length)
+                    return
+
+                # Several ranges: stream each part straight from the file
+                boundary, parts, trailer, total = multipart_byteranges(ranges, content_type, file_size)
                 self.send_response(206)
-                self.send_header('Content-Type', self.guess_type(path))
-                self.send_header('Content-Length', str(length))
-                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+                self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+                self.send_header('Content-Length', str(total))
+                self.send_validators(etag, st, FILE_CACHE_CONTROL, vary)
+                self.send_digests(path, st)
                 self.end_headers()
-                
-                remaining = length
-                chunk_size = min(262144, length)  # 256KB or smaller
-                
-                while remaining > 0:
-                    chunk = f.read(min(chunk_size, remaining))
-                    if not chunk:
-                        break
-                    try:
-                        self.wfile.write(chunk)
-                        remaining -= len(chunk)
-                    except (ConnectionResetError, BrokenPipeError):
-                        break
+                for header, start, length in parts:
+                    self.write_body(header)
+                    if not self.transfer_file(f, start, length):
+                        return
+                self.write_body(trailer)
                         
         except Exception as e:
             self.send_error(500, f"Error serving range: {e}")
 
+    def send_metrics(self):
+        self.route = 'metrics'
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.write_body(body)
+
+    def select_share(self):
+        """Serve the share the URL names; False once the request has been answered"""
+        self.base_path = self.url_prefix = ''
+        match = self.shares.resolve(self.path)
+        if match is None:
+            if self.command == 'PUT':
+                self.send_error(404, "Uploads must name a share")
+            else:
+                self.send_share_index()
+            return False
+        label, directory, prefix = match
+        if directory is None:
+            self.send_error(404, "No such share")
+            return False
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == prefix and self.command != 'PUT':
+            # Relative links in the listing only work below a trailing slash
+            self.send_response(301)
+            self.send_header('Location', prefix + '/' + (f'?{url.query}' if url.query else ''))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        self.base_path = directory
+        self.url_prefix = prefix
+        self.throttle = shaper.throttle(directory, self.client_address[0])
+        return True
+
+    def send_share_index(self):
+        self.route = 'index'
+        fmt = parse_listing_query(urllib.parse.urlsplit(self.path).query, self.headers.get('Accept')).format
+        body = render_share_index(self.shares, self.port, fmt)
+        self.send_response(200)
+        self.send_header("Content-type", LISTING_CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Vary", "Accept")
+        self.end_headers()
+        self.write_body(body)
+
     def translate_path(self, path):
-        path = urllib.parse.unquote(path.split('?', 1)[0].split('#', 1)[0])
-        path = path.strip('/')
-        words = path.split('/')
-        words = filter(None, words)
-        path = self.base_path
-        for word in words:
-            if os.path.dirname(word) or word in (os.curdir, os.pardir):
-                continue
-            path = os.path.join(path, word)
-        return path
-
-    def list_directory(self, path):
+        return translate_url_path(self.base_path, share_url_path(path, self.url_prefix))
+
+    def list_directory(self, path, st=None):
         try:
-            list = os.listdir(path)
+            if st is None:
+                st = os.stat(path)
+            view = parse_listing_query(urllib.parse.urlsplit(self.path).query,
+                                       self.headers.get('Accept'))
+            encoding = listing_encoding(self.headers.get('Accept-Encoding'))
+            etag = encoded_etag(make_listing_etag(st, view.format), encoding)
+            if is_not_modified(self.headers, etag, st.st_mtime):
+                return self.send_not_modified(etag, st, LISTING_CACHE_CONTROL, LISTING_VARY)
+            body = render_listing(path, self.base_path, self.port, st, view, encoding)
         except OSError:
             self.send_error(404, "No permission to list directory")
             return None
-        
-        list.sort(key=lambda x: x.lower())
-        
-        r = []
-        r.append('<!DOCTYPE HTML>')
-        r.append('<html>\n<head>')
-        r.append('<meta charset="utf-8">')
-        r.append('<title>USB File Sharing</title>')
-        r.append('''
-        <style>
-            body { 
-                font-family: Ubuntu, Arial, sans-serif; 
-                margin: 20px; 
-                background-color: #f5f5f5; 
-            }
-            
-            h2 { 
-                color: #333; 
-                margin-bottom: 20px;
-            }
-            
-            .container { 
-                max-width: 1000px; 
-                margin: 0 auto; 
-                padding: 20px;
-                background-color: white;
-                border-radius: 8px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }
-            
-            .file-list { 
-                list-style-type: none; 
-                padding: 0; 
-            }
-            
-            .file-item { 
-                display: flex;
-                align-items: center;
-                padding: 12px 15px;
-                margin: 8px 0;
-                background-color: #f8f9fa;
-                border-radius: 6px;
-                transition: background-color 0.2s;
-            }
-            
-            .file-item:hover {
-                background-color: #e9ecef;
-            }
-            
-            .file-link { 
-                color: #0066cc; 
-                text-decoration: none; 
-                flex-grow: 1;
-                font-size: 15px;
-            }
-            
-            .file-info { 
-                color: #666; 
-                font-size: 14px; 
-                margin-left: 15px;
-                white-space: nowrap;
-            }
-            
-            .folder-icon::before {
-                content: "📁";
-                margin-right: 8px;
-                font-size: 16px;
-            }
-            
-            .file-icon::before {
-                content: "📄";
-                margin-right: 8px;
-                font-size: 16px;
-            }
-
-            .zip-icon::before {
-                content: "🗜️";
-                margin-right: 8px;
-                font-size: 16px;
-            }
-            
-            .path-info {
-                color: #666;
-                font-size: 14px;
-                margin-bottom: 15px;
-                padding: 8px;
-                background-color: #f8f9fa;
-                border-radius: 4px;
-            }
-            
-            .server-info {
-                margin-top: 20px;
-                padding: 10px;
-                background-color: #e9ecef;
-                border-radius: 4px;
-                font-size: 13px;
-                color: #666;
-            }
-        </style>
-        ''')
-        r.append('</head>')
-        r.append('<body>')
-        r.append('<div class="container">')
-        
-        rel_path = os.path.relpath(path, self.base_path)
-        if rel_path == '.':
-            display_path = 'USB Drive Root'
+
+        self.send_response(200)
+        self.send_header("Content-type", LISTING_CONTENT_TYPES[view.format])
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_validators(etag, st, LISTING_CACHE_CONTROL, LISTING_VARY)
+        if isinstance(body, bytes):
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.write_body(body)
         else:
-            display_path = rel_path
-        r.append(f'<h2>Files in {display_path}</h2>')
-        
-        r.append('<div class="path-info">')
-        r.append(f'Current location: {display_path}')
-        r.append('</div>')
-        
-        r.append('<ul class="file-list">')
-        
-        if path != self.base_path:
-            r.append('<li class="file-item">')
-            r.append(f'<a href=".." class="file-link folder-icon">Parent Directory</a>')
-            r.append('</li>')
-        
-        for name in list:
-            fullname = os.path.join(path, name)
-            displayname = linkname = name
-            
-            try:
-                stats = os.stat(fullname)
-                size = format_size(stats.st_size)
-                mtime = format_date(stats.st_mtime)
-            except:
-                size = "Unknown size"
-                mtime = "Unknown date"
-            
-            is_dir = os.path.isdir(fullname)
-            is_zip = name.lower().endswith('.zip')
-            
-            if is_dir:
-                displayname = name + "/"
-                linkname = name + "/"
-                size = "Directory"
-                icon_class = "folder-icon"
-            elif is_zip:
-                icon_class = "zip-icon"
-            else:
-                icon_class = "file-icon"
-            
-            r.append('<li class="file-item">')
-            r.append(f'<a href="{urllib.parse.quote(linkname)}" class="file-link {icon_class}">{displayname}</a>')
-            r.append(f'<span class="file-info">{size} • {mtime}</span>')
-            r.append('</li>')
-        
-        r.append('</ul>')
-        
-        r.append('<div class="server-info">')
-        r.append(f'Server Port: {self.port} • ')
-        r.append(f'Files served from: {self.base_path}')
-        r.append('</div>')
-        
-        r.append('</div>')
-        r.append('</body>\n</html>\n')
-        
-        encoded = '\n'.join(r).encode('utf-8', 'replace')
+            self.send_chunks(body)
+        return None
+
+    def send_search(self, path, query, offset):
+        fmt = parse_listing_query(urllib.parse.urlsplit(self.path).query, self.headers.get('Accept')).format
+        try:
+            results, more, complete = search_share(self.base_path, path, query, offset)
+        except sqlite3.Error as e:
+            self.send_error(503, f"Search index unavailable: {e}")
+            return
+        body = render_search(results, more, complete, query, offset, self.base_path, path, self.port, fmt)
         self.send_response(200)
-        self.send_header("Content-type", "text/html; charset=utf-8")
-        self.send_header("Content-Length", str(len(encoded)))
+        self.send_header("Content-type", LISTING_CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Vary", "Accept")
         self.end_headers()
-        self.wfile.write(encoded)
-        return None
+        self.write_body(body)
+
+    def send_archive(self, path, kind):
+        """Stream a directory tree as a ZIP or tar built on the fly"""
+        self.send_response(200)
+        self.send_header('Content-Type', ARCHIVE_TYPES[kind])
+        self.send_header('Content-Disposition', content_disposition(path, self.base_path, kind))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_chunks(archive_chunks(kind, path, self.base_path))
+
+    def send_manifest(self, path, format):
+        """Stream the SHA-256 of every file below a directory"""
+        self.send_response(200)
+        self.send_header('Content-Type', MANIFEST_TYPES[format])
+        self.send_header('Cache-Control', 'no-store')
+        self.send_chunks(manifest_chunks(path, self.base_path, format))
+
+    def send_thumbnail(self, path, st, size):
+        """Send a JPEG preview of an image or video, made in the background if needed"""
+        etag = thumbnail_etag(st, size)
+        if is_not_modified(self.headers, etag, st.st_mtime):
+            return self.send_not_modified(etag, st, FILE_CACHE_CONTROL)
+        if not thumbnail_kind(path):
+            self.send_error(404, "No preview available for this file")
+            return
+        try:
+            data = thumbnailer.get(path, st, size, THUMBNAIL_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            self.send_response(503)
+            self.send_header('Retry-After', str(RETRY_AFTER))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if data is None:
+            self.send_error(404, "No preview available for this file")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', THUMBNAIL_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_validators(etag, st, FILE_CACHE_CONTROL)
+        self.end_headers()
+        self.write_body(data)
+
+    def send_chunks(self, chunks):
+        """End the headers and stream an iterator of byte chunks as the body.
+
+        Uses chunked transfer encoding on HTTP/1.1 connections; otherwise the
+        body is delimited by closing the connection.
+        """
+        chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command == 'HEAD':
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+            return
+        throttle = self.throttle
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                for piece in throttle.slices(chunk):
+                    throttle.wait(len(piece))
+                    metrics.inc('usb_share_bytes_sent_total', (self.base_path,), len(piece))
+                    if chunked:
+                        self.wfile.write(b'%x\r\n' % len(piece))
+                        self.wfile.write(piece)
+                        self.wfile.write(b'\r\n')
+                    else:
+                        self.wfile.write(piece)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (ConnectionResetError, BrokenPipeError, TimeoutError):
+            self.close_connection = True
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
 
 class FileServer:
-    def __init__(self, directory, port=PORT):
+    shares = None
+
+    def __init__(self, directory, port=PORT, engine=SERVER_ENGINE, open_browser=True,
+                 processes=WORKER_PROCESSES, reuse_port=False, tls=TLS_ENABLED):
         self.directory = directory
         self.port = port
+        self.engine = engine
+        self.open_browser = open_browser
+        self.tls = tls
+        self.scheme = 'https' if tls else 'http'
+        self.processes = process_count(processes)
+        self.reuse_port = reuse_port
         self.httpd = None
         self.server_thread = None
+        self.error = None
+
+    def directories(self):
+        return [self.directory]
 
     def start(self):
-        handler = lambda *args, **kwargs: USBFileHandler(*args, directory=self.directory, port=self.port, **kwargs)
+        for directory in self.directories():
+            if SEARCH_INDEX_ENABLED:
+                metadata_index.watch(directory)
+            if DIGESTS_ENABLED:
+                digest_index.watch(directory)
+        handler = lambda *args, **kwargs: USBFileHandler(*args, directory=self.directory, port=self.port,
+                                                         shares=self.shares, **kwargs)
         
         try:
-            self.httpd = ThreadedTCPServer(("", self.port), handler)
+            # Also generates the self-signed certificate before workers need it
+            ssl_context = server_context() if self.tls else None
+            if self.processes > 1:
+                self.httpd = PreforkSupervisor(self, self.processes)
+            elif self.engine == 'asyncio':
+                self.httpd = AsyncFileServer(("", self.port), self.directory, port=self.port,
+                                             shares=self.shares, reuse_port=self.reuse_port,
+                                             ssl_context=ssl_context)
+            else:
+                self.httpd = PooledTCPServer(("", self.port), handler, reuse_port=self.reuse_port,
+                                             ssl_context=ssl_context)
             
             local_ip = get_local_ip()
-            print(f"\nServer for {self.directory} started!")
-            print(f"Local access: http://localhost:{self.port}")
-            print(f"Network access: http://{local_ip}:{self.port}")
+            print(f"\nServer for {self.directory or 'all shares'} started!")
+            if self.processes > 1:
+                print(f"Worker processes: {self.processes}")
+            print(f"Local access: {self.scheme}://localhost:{self.port}")
+            print(f"Network access: {self.scheme}://{local_ip}:{self.port}")
             
             self.server_thread = threading.Thread(target=self.httpd.serve_forever)
             self.server_thread.daemon = True
             self.server_thread.start()
             
-            webbrowser.open(f"http://localhost:{self.port}")
+            if self.open_browser:
+                webbrowser.open(f"{self.scheme}://localhost:{self.port}")
             
         except Exception as e:
+            self.error = e
             print(f"Server error on port {self.port}: {e}")
             self.stop()
 
+    def broadcast(self, command, *args):
+        """Repeat a share or bandwidth change in the pre-fork worker processes"""
+        if isinstance(self.httpd, PreforkSupervisor):
+            self.httpd.broadcast(command, *args)
+
+    def set_bandwidth_limit(self, rate):
+        """Cap this share at rate bytes/s (0 for unlimited, None for the default)"""
+        shaper.set_share_rate(os.path.abspath(self.directory), rate)
+        self.broadcast('set_bandwidth_limit', rate)
+
     def stop(self):
+        for directory in self.directories():
+            metadata_index.unwatch(directory)
+            digest_index.unwatch(directory)
         if self.httpd:
             try:
                 self.httpd.shutdown()
                 self.httpd.server_close()
                 print(f"\nServer on port {self.port} stopped.")
             except Exception as e:
-                print(f"Error stopping server on port {self.port}: {e}")
\ No newline at end of file
+                print(f"Error stopping server on port {self.port}: {e}")
+
+
+class MultiShareServer(FileServer):
+    """One port, one worker pool and one set of caches for any number of drives.
+
+    Each directory is served under /share/<label>/ and '/' lists them.
+    Shares can be added and removed while the server is running.
+    """
+
+    def __init__(self, port=PORT, engine=SERVER_ENGINE, open_browser=True,
+                 processes=WORKER_PROCESSES, reuse_port=False, tls=TLS_ENABLED):
+        super().__init__(None, port, engine, open_browser, processes, reuse_port, tls)
+        self.shares = ShareTable()
+
+    def directories(self):
+        return self.shares.directories()
+
+    def add_share(self, directory, label=None):
+        """Start serving directory; returns the label it is reachable under"""
+        label = self.shares.add(directory, label)
+        if SEARCH_INDEX_ENABLED and self.httpd:
+            metadata_index.watch(directory)
+        if DIGESTS_ENABLED and self.httpd:
+            digest_index.watch(directory)
+        self.broadcast('add_share', directory, label)
+        print(f"Sharing {directory} at {self.scheme}://localhost:{self.port}{SHARE_PREFIX}{label}/")
+        return label
+
+    def remove_share(self, label):
+        directory = self.shares.remove(label)
+        if directory is not None:
+            metadata_index.unwatch(directory)
+            digest_index.unwatch(directory)
+        self.broadcast('remove_share', label)
+        return directory
+
+    def set_bandwidth_limit(self, rate, label=None):
+        """Cap one share (or, without a label, every share) at rate bytes/s"""
+        labels = [label] if label else [l for l, _ in self.shares.items()]
+        for label in labels:
+            directory = self.shares.get(label)
+            if directory is not None:
+                shaper.set_share_rate(directory, rate)
+        self.broadcast('set_bandwidth_limit', rate, label)
@@ -0,0 +1,108 @@
+# modules/shares.py
+
+import os
+import re
+import json
+import html
+import threading
+import urllib.parse
+from modules.listing import LISTING_CSS
+
+SHARE_PREFIX = '/share/'
+
+
+def share_label(name):
+    """URL-safe form of a drive label or directory name"""
+    return re.sub(r'[^A-Za-z0-9._-]', '_', name).strip('.') or 'share'
+
+
+class ShareTable:
+    """Directories served side by side on one port, each under /share/<label>/.
+
+    Shares can be added and removed while the server runs; requests look
+    their share up on every request, so a removed drive stops being served
+    immediately.
+    """
+
+    def __init__(self):
+        self._shares = {}  # label -> absolute directory
+        self._lock = threading.Lock()
+
+    def add(self, directory, label=None):
+        """Serve directory under a label; returns the label, made unique if taken"""
+        directory = os.path.abspath(directory)
+        base = share_label(label or os.path.basename(directory))
+        with self._lock:
+            label, n = base, 1
+            while label in self._shares and self._shares[label] != directory:
+                n += 1
+                label = f'{base}_{n}'
+            self._shares[label] = directory
+        return label
+
+    def remove(self, label):
+        """Stop serving a label; returns its directory (None if unknown)"""
+        with self._lock:
+            return self._shares.pop(label, None)
+
+    def get(self, label):
+        return self._shares.get(label)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._shares.items())
+
+    def directories(self):
+        return [directory for _, directory in self.items()]
+
+    def __len__(self):
+        return len(self._shares)
+
+    def resolve(self, url):
+        """Split a request URL into (label, directory, prefix), or None for the index.
+
+        '/' and '/share/' are the share index. directory is None when the
+        URL names no known share. prefix is the part of the URL that names
+        the share, without the trailing slash.
+        """
+        path = urllib.parse.urlsplit(url).path
+        if path in ('/', SHARE_PREFIX.rstrip('/'), SHARE_PREFIX):
+            return None
+        if not path.startswith(SHARE_PREFIX):
+            return '', None, ''
+        prefix = SHARE_PREFIX + path[len(SHARE_PREFIX):].split('/', 1)[0]
+        label = urllib.parse.unquote(prefix[len(SHARE_PREFIX):])
+        return label, self.get(label), prefix
+
+
+def share_url_path(url, prefix):
+    """The request URL as seen from inside its share"""
+    return url[len(prefix):] or '/'
+
+
+def render_share_index(shares, port, format='html'):
+    """Page linking to every share, as encoded HTML or JSON"""
+    items = shares.items()
+    if format == 'json':
+        return json.dumps({
+            'shares': [{'name': label, 'href': f'{SHARE_PREFIX}{urllib.parse.quote(label)}/'}
+                       for label, _ in items],
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8', 'replace')
+
+    r = ['<!DOCTYPE HTML>', '<html>\n<head>', '<meta charset="utf-8">',
+         '<title>USB File Sharing</title>', LISTING_CSS, '</head>', '<body>',
+         '<div class="container">', '<h2>Shared drives</h2>', '<ul class="file-list">']
+    for label, _ in items:
+        href = f'{SHARE_PREFIX}{urllib.parse.quote(label)}/'
+        r.append('<li class="file-item">')
+        r.append(f'<a href="{href}" class="file-link folder-icon">{html.escape(label)}</a>')
+        r.append('</li>')
+    if not items:
+        r.append('<li class="file-item">No drives are shared right now</li>')
+    r.append('</ul>')
+    r.append('<div class="server-info">')
+    r.append(f'Server Port: {port} • {len(items)} share(s)')
+    r.append('</div>')
+    r.append('</div>')
+    r.append('</body>\n</html>\n')
+    return '\n'.join(r).encode('utf-8', 'replace')
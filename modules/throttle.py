@@ -0,0 +1,247 @@
+# modules/throttle.py
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import threading
+from config import BANDWIDTH_LIMIT, SHARE_BANDWIDTH_LIMIT, CLIENT_BANDWIDTH_LIMIT
+
+QUANTUM = 256 * 1024  # Bytes a transfer may send per turn while shaped
+MIN_QUANTUM = 16 * 1024
+MAX_CLIENT_BUCKETS = 1024
+CLIENT_IDLE = 60.0  # Seconds before an unused per-client bucket is dropped
+SHARED_SLOTS = 4096  # Buckets a SharedBuckets table holds
+MAX_PROBES = 64
+
+
+class TokenBucket:
+    """Thread-safe token bucket measured in bytes per second.
+
+    reserve() always succeeds and returns how long the caller must wait.
+    Tokens may go negative, so concurrent callers queue up behind each
+    other in arrival order; with every transfer reserving one quantum at a
+    time, active transfers take turns and share the rate fairly.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        with self._lock:
+            self.rate = max(rate or 0, 0)
+            self.burst = burst or self.rate
+            self._tokens = self.burst
+            self.stamp = time.monotonic()
+
+    def reserve(self, nbytes):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self._tokens -= nbytes
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class SharedBuckets:
+    """Token-bucket state in a file that every pre-fork worker maps.
+
+    Each slot holds a bucket's name hash, tokens and last refill time;
+    a bucket lives in the first slot holding its hash along a short probe
+    from hash % slots, and slots idle for CLIENT_IDLE are reused. Rates
+    stay with each process (the workers all receive the same changes), so
+    only the tokens are shared. Updates hold an flock on the file, and
+    time.monotonic() is the same clock in every process.
+    """
+
+    SLOT = struct.Struct('=Qdd')
+
+    def __init__(self, path, slots=SHARED_SLOTS):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()  # flock does not exclude threads sharing the fd
+
+    def reserve(self, name, rate, burst, nbytes):
+        key = int.from_bytes(hashlib.blake2b(name.encode('utf-8', 'surrogateescape'),
+                                             digest_size=8).digest(), 'little') or 1
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.monotonic()
+                offset, found = self._slot(key, now)
+                if found:
+                    _, tokens, stamp = self.SLOT.unpack_from(self._map, offset)
+                    tokens = min(burst, tokens + (now - stamp) * rate)
+                else:
+                    tokens = burst
+                tokens -= nbytes
+                self.SLOT.pack_into(self._map, offset, key, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    def _slot(self, key, now):
+        """Offset of the key's slot and whether it already held the key"""
+        free = oldest = None
+        oldest_stamp = now
+        for probe in range(min(MAX_PROBES, self.slots)):
+            offset = (key + probe) % self.slots * self.SLOT.size
+            h, _, stamp = self.SLOT.unpack_from(self._map, offset)
+            if h == key:
+                return offset, True
+            if free is None and (h == 0 or stamp < now - CLIENT_IDLE):
+                free = offset
+            if h == 0:
+                break  # End of the probe chain: the key is not stored
+            if stamp <= oldest_stamp:
+                oldest, oldest_stamp = offset, stamp
+        return (free if free is not None else oldest), False
+
+
+class SharedTokenBucket:
+    """TokenBucket whose tokens live in a SharedBuckets table"""
+
+    def __init__(self, table, name, rate=0, burst=None):
+        self.table = table
+        self.name = name
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        self.rate = max(rate or 0, 0)
+        self.burst = burst or self.rate
+        self.stamp = time.monotonic()
+
+    def reserve(self, nbytes):
+        if self.rate <= 0:
+            return 0.0
+        self.stamp = time.monotonic()
+        return self.table.reserve(self.name, self.rate, self.burst, nbytes)
+
+
+class Throttle:
+    """The set of buckets one transfer draws from (global, share, client)"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    @property
+    def active(self):
+        return any(b.rate > 0 for b in self.buckets)
+
+    @property
+    def quantum(self):
+        # Keep turns short relative to the slowest cap so shaping stays smooth
+        rates = [b.rate for b in self.buckets if b.rate > 0]
+        if not rates:
+            return QUANTUM
+        return max(MIN_QUANTUM, min(QUANTUM, int(min(rates) / 8)))
+
+    def slices(self, data):
+        """Split a buffer into quantum-sized pieces, so big buffers are paced evenly too"""
+        if not self.active or len(data) <= self.quantum:
+            return [data]
+        view = memoryview(data)
+        quantum = self.quantum
+        return [view[i:i + quantum] for i in range(0, len(view), quantum)]
+
+    def reserve(self, nbytes):
+        """Charge nbytes to every bucket, returns the delay in seconds"""
+        return max((b.reserve(nbytes) for b in self.buckets), default=0.0)
+
+    def wait(self, nbytes):
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Shaper:
+    """Global, per-share and per-client bandwidth caps, adjustable at runtime.
+
+    A rate of 0 means unlimited. Share caps can be overridden one share at
+    a time; client buckets are created on demand and dropped when idle.
+    After share_buckets(), the caps hold for all processes using the same
+    table together.
+    """
+
+    def __init__(self, rate=0, share_rate=0, client_rate=0):
+        self._lock = threading.Lock()
+        self._table = None
+        self.global_bucket = TokenBucket(rate)
+        self.share_rate = share_rate
+        self.client_rate = client_rate
+        self._share_overrides = {}
+        self._shares = {}
+        self._clients = {}
+
+    def configure(self, rate=None, share_rate=None, client_rate=None):
+        """Change caps; None leaves a cap as it is"""
+        with self._lock:
+            if rate is not None:
+                self.global_bucket.configure(rate)
+            if share_rate is not None:
+                self.share_rate = share_rate
+                for share, bucket in self._shares.items():
+                    if share not in self._share_overrides:
+                        bucket.configure(share_rate)
+            if client_rate is not None:
+                self.client_rate = client_rate
+                for bucket in self._clients.values():
+                    bucket.configure(client_rate)
+
+    def share_buckets(self, path):
+        """Keep the tokens of every cap in a SharedBuckets file at path"""
+        with self._lock:
+            self._table = SharedBuckets(path)
+            self.global_bucket = self._bucket('global', self.global_bucket.rate)
+            self._shares.clear()
+            self._clients.clear()
+
+    def _bucket(self, name, rate):
+        if self._table is None:
+            return TokenBucket(rate)
+        return SharedTokenBucket(self._table, name, rate)
+
+    def set_share_rate(self, share, rate):
+        """Override the cap for one share; None reverts to the default"""
+        with self._lock:
+            if rate is None:
+                self._share_overrides.pop(share, None)
+                rate = self.share_rate
+            else:
+                self._share_overrides[share] = rate
+            bucket = self._shares.get(share)
+            if bucket is not None:
+                bucket.configure(rate)
+
+    def throttle(self, share, client):
+        with self._lock:
+            share_bucket = self._shares.get(share)
+            if share_bucket is None:
+                share_bucket = self._shares[share] = self._bucket(
+                    f'share\0{share}', self._share_overrides.get(share, self.share_rate))
+            client_bucket = self._clients.get(client)
+            if client_bucket is None:
+                if len(self._clients) >= MAX_CLIENT_BUCKETS:
+                    self._prune_clients()
+                client_bucket = self._clients[client] = self._bucket(f'client\0{client}', self.client_rate)
+        return Throttle([self.global_bucket, share_bucket, client_bucket])
+
+    def _prune_clients(self):
+        cutoff = time.monotonic() - CLIENT_IDLE
+        for client, bucket in list(self._clients.items()):
+            if bucket.stamp < cutoff:
+                del self._clients[client]
+
+
+shaper = Shaper(BANDWIDTH_LIMIT, SHARE_BANDWIDTH_LIMIT, CLIENT_BANDWIDTH_LIMIT)
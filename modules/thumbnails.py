@@ -0,0 +1,195 @@
+# modules/thumbnails.py
+
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+import concurrent.futures
+from modules.compression import CompressionCache
+from modules.validators import make_etag
+from config import (CACHE_DIR, THUMBNAIL_SIZE, THUMBNAIL_WORKERS, THUMBNAIL_CACHE_SIZE,
+                    THUMBNAIL_QUALITY)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+FFMPEG = shutil.which('ffmpeg')
+
+CONTENT_TYPE = 'image/jpeg'
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+VIDEO_SUFFIXES = {'.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi', '.wmv', '.mpg', '.mpeg', '.3gp'}
+MIN_SIZE, MAX_SIZE = 32, 1024
+FFMPEG_TIMEOUT = 30
+VIDEO_SEEK = 1  # Seconds into a video for its preview frame; skips black leaders
+MAX_FAILED = 1024  # Files remembered as unpreviewable
+
+
+def thumbnail_kind(path):
+    """'image' or 'video' if a preview can be made with the tools installed, else None"""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in IMAGE_SUFFIXES and (Image is not None or FFMPEG):
+        return 'image'
+    if suffix in VIDEO_SUFFIXES and FFMPEG:
+        return 'video'
+    return None
+
+
+def parse_thumbnail_query(query):
+    """Preview size requested with ?thumbnail or ?thumbnail=<pixels>, or None"""
+    values = urllib.parse.parse_qs(query, keep_blank_values=True).get('thumbnail')
+    if values is None:
+        return None
+    try:
+        size = int(values[0])
+    except ValueError:
+        return THUMBNAIL_SIZE
+    return min(max(size, MIN_SIZE), MAX_SIZE)
+
+
+def thumbnail_etag(st, size):
+    """Strong ETag for a file's preview: follows the file's own tag"""
+    return f'{make_etag(st)[:-1]}-t{size}"'
+
+
+def render_image(path, size):
+    if Image is None:
+        return render_frame(path, size, seek=None)
+    with Image.open(path) as img:
+        img.draft('RGB', (size, size))  # Lets JPEG decode at a fraction of full size
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def render_frame(path, size, seek=VIDEO_SEEK):
+    """One frame as JPEG through ffmpeg; falls back to the first frame for short clips"""
+    scale = f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease"
+    cmd = [FFMPEG, '-nostdin', '-v', 'error']
+    if seek:
+        cmd += ['-ss', str(seek)]
+    cmd += ['-i', path, '-frames:v', '1', '-vf', scale, '-f', 'image2pipe', '-c:v', 'mjpeg',
+            '-q:v', '5', '-']
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode == 0 and result.stdout:
+        return result.stdout
+    return render_frame(path, size, seek=None) if seek else None
+
+
+class ThumbnailCache(CompressionCache):
+    """CompressionCache holding JPEG previews, keyed by file and preview size"""
+
+    def entry_path(self, path, st, size):
+        key = f'{path}\0{st.st_ino}\0{st.st_size}\0{st.st_mtime_ns}'.encode('utf-8', 'surrogateescape')
+        return os.path.join(self.cache_dir, f'{hashlib.sha1(key).hexdigest()}-{size}.jpg')
+
+    def read(self, path, st, size):
+        entry = self.lookup(path, st, size)
+        if entry is None:
+            return None
+        try:
+            with open(entry, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None  # Evicted since the lookup
+
+    def store(self, path, st, size, data):
+        if self.max_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.entry_path(path, st, size))
+        except OSError:
+            return
+        self._added(len(data))
+
+
+class Thumbnailer:
+    """Makes previews in a small pool of background threads.
+
+    Decoding a photo or seeking a video is slow and CPU heavy, so it never
+    runs on the request path: requests for the same preview share one
+    job, and the result lands in the disk cache, where later requests (and
+    the other pre-fork workers) find it.
+    """
+
+    def __init__(self, cache, workers=THUMBNAIL_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self._pool = None
+        self._pending = {}  # cache entry path -> Future
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def cached(self, path, st, size=THUMBNAIL_SIZE):
+        """The preview's JPEG bytes if already made, else None"""
+        return self.cache.read(path, st, size)
+
+    def generate(self, path, st, size=THUMBNAIL_SIZE):
+        """Future for the preview's JPEG bytes (None if the file cannot be previewed)"""
+        key = self.cache.entry_path(path, st, size)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                if key in self._failed:
+                    future = concurrent.futures.Future()
+                    future.set_result(None)
+                    return future
+                if self._pool is None:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='thumbnail')
+                future = self._pending[key] = self._pool.submit(self._render, key, path, st, size)
+        return future
+
+    def get(self, path, st, size=THUMBNAIL_SIZE, timeout=None):
+        data = self.cached(path, st, size)
+        if data is None:
+            data = self.generate(path, st, size).result(timeout)
+        return data
+
+    def _render(self, key, path, st, size):
+        data = None
+        try:
+            # Another request may have finished it while this job queued
+            data = self.cached(path, st, size)
+            if data is None:
+                kind = thumbnail_kind(path)
+                if kind == 'image':
+                    data = render_image(path, size)
+                elif kind == 'video':
+                    data = render_frame(path, size)
+                if data:
+                    self.cache.store(path, st, size, data)
+        except Exception as e:
+            print(f"Could not make a preview of {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                if not data:
+                    if len(self._failed) >= MAX_FAILED:
+                        self._failed.clear()
+                    self._failed.add(key)
+        return data or None
+
+
+thumbnailer = Thumbnailer(ThumbnailCache(os.path.join(CACHE_DIR, 'thumbnails'), THUMBNAIL_CACHE_SIZE))
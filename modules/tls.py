@@ -0,0 +1,58 @@
+# modules/tls.py
+
+import os
+import ssl
+import socket
+import subprocess
+from modules.utils import get_local_ip
+from config import TLS_CERT_FILE, TLS_KEY_FILE, TLS_SESSION_TICKETS, CACHE_DIR
+
+SELF_SIGNED_DIR = os.path.join(CACHE_DIR, 'tls')
+SELF_SIGNED_DAYS = 825  # Longest validity browsers accept for a leaf certificate
+
+
+def self_signed_certificate(directory=SELF_SIGNED_DIR):
+    """Return (cert, key) paths, generating a self-signed pair on first use.
+
+    The certificate names localhost, this host and its LAN address, so
+    browsers only ask once per device to trust it. Needs the openssl tool.
+    """
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    if os.path.exists(cert) and os.path.exists(key):
+        return cert, key
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    hostname = socket.gethostname()
+    names = ['DNS:localhost', f'DNS:{hostname}', 'IP:127.0.0.1', f'IP:{get_local_ip()}']
+    cmd = ['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+           '-nodes', '-days', str(SELF_SIGNED_DAYS), '-subj', f'/CN={hostname}',
+           '-addext', 'subjectAltName=' + ','.join(dict.fromkeys(names)),
+           '-keyout', key + '.tmp', '-out', cert + '.tmp']
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise OSError(f"Could not generate a self-signed certificate ({e}); "
+                      f"set TLS_CERT_FILE and TLS_KEY_FILE in config.py") from e
+    os.chmod(key + '.tmp', 0o600)
+    os.replace(key + '.tmp', key)
+    os.replace(cert + '.tmp', cert)
+    print(f"Generated self-signed certificate {cert}")
+    return cert, key
+
+
+def server_context(cert_file=TLS_CERT_FILE, key_file=TLS_KEY_FILE):
+    """SSLContext for serving HTTPS.
+
+    TLS 1.3 session tickets let returning browsers skip the full
+    handshake, which dominates the cost of short listing requests.
+    """
+    if not cert_file:
+        cert_file, key_file = self_signed_certificate()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    context.set_alpn_protocols(['http/1.1'])
+    context.num_tickets = TLS_SESSION_TICKETS
+    if not TLS_SESSION_TICKETS:
+        context.options |= ssl.OP_NO_TICKET
+    return context
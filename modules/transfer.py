@@ -0,0 +1,229 @@
+# modules/transfer.py
+
+import os
+import ssl
+import mmap
+import errno
+import ctypes
+import ctypes.util
+import selectors
+from config import FADVISE_DROP_BEHIND_SIZE
+
+SENDFILE_CHUNK = 1024 * 1024 * 16  # 16MB per sendfile() call
+COPY_CHUNK = 1024 * 1024  # 1MB buffer for the read/write fallback
+SEQUENTIAL_MIN = 1024 * 1024  # Shorter ranges are treated as random access
+READAHEAD_START = 2 * 1024 * 1024
+READAHEAD_MAX = 32 * 1024 * 1024
+
+# errno values meaning "sendfile is not usable for this fd pair"
+_SENDFILE_UNSUPPORTED = {
+    errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+}
+
+_libc = None
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+except (OSError, AttributeError, TypeError):
+    _libc = None
+
+
+class SendfileUnavailable(Exception):
+    """Raised when the kernel refuses sendfile before any byte was sent"""
+
+
+def is_tls(sock):
+    """Check whether a socket is wrapped by the ssl module"""
+    return isinstance(sock, ssl.SSLSocket)
+
+
+def _wait_writable(sock, timeout):
+    with selectors.DefaultSelector() as sel:
+        sel.register(sock, selectors.EVENT_WRITE)
+        if not sel.select(timeout):
+            raise TimeoutError("timed out waiting for socket to become writable")
+
+
+def sendfile_range(sock, f, offset, count):
+    """Send count bytes of f starting at offset using os.sendfile (zero-copy)"""
+    if not hasattr(os, 'sendfile'):
+        raise SendfileUnavailable("os.sendfile is not available")
+
+    fd_out = sock.fileno()
+    fd_in = f.fileno()
+    timeout = sock.gettimeout()
+    sent = 0
+    while sent < count:
+        try:
+            n = os.sendfile(fd_out, fd_in, offset + sent, min(SENDFILE_CHUNK, count - sent))
+        except BlockingIOError:
+            # Socket has a timeout set, so it is non-blocking under the hood
+            _wait_writable(sock, timeout)
+            continue
+        except OSError as e:
+            if sent == 0 and e.errno in _SENDFILE_UNSUPPORTED:
+                raise SendfileUnavailable(str(e))
+            raise
+        if n == 0:
+            break  # File shrank underneath us
+        sent += n
+    return sent
+
+
+def copy_range(sock, f, offset, count, chunk_size=COPY_CHUNK):
+    """Send count bytes of f starting at offset through a reusable buffer"""
+    buf = bytearray(min(chunk_size, count) or 1)
+    view = memoryview(buf)
+    f.seek(offset)
+    sent = 0
+    while sent < count:
+        n = f.readinto(view[:min(len(buf), count - sent)])
+        if not n:
+            break
+        sock.sendall(view[:n])
+        sent += n
+    return sent
+
+
+def _send_range(sock, f, offset, count):
+    if not is_tls(sock):
+        try:
+            return sendfile_range(sock, f, offset, count)
+        except SendfileUnavailable:
+            pass
+    return copy_range(sock, f, offset, count)
+
+
+def advise(f, offset, length, advice):
+    """posix_fadvise() that quietly does nothing where it is unsupported"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), offset, length, advice)
+    except (OSError, ValueError):
+        pass
+
+
+def resident(f, offset, length):
+    """Whether any page of a file range is in the page cache (mincore), or None if unknown"""
+    if _libc is None or length <= 0:
+        return None
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    size = offset + length - start
+    try:
+        # A private mapping is writable, which ctypes needs for the address;
+        # nothing is written, so mincore still sees the file's own pages
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY, offset=start)
+    except (OSError, ValueError):
+        return None
+    vec = (ctypes.c_ubyte * ((size + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+    try:
+        buf = (ctypes.c_char * size).from_buffer(mm)
+        try:
+            ok = _libc.mincore(ctypes.addressof(buf), size, vec) == 0
+        finally:
+            del buf
+    except (OSError, ctypes.ArgumentError):
+        ok = False
+    finally:
+        mm.close()
+    return any(page & 1 for page in vec) if ok else None
+
+
+class Readahead:
+    """Tells the kernel how one transfer will read a file.
+
+    Long ranges are read sequentially: the kernel gets
+    POSIX_FADV_SEQUENTIAL and the next window is prefetched with
+    POSIX_FADV_WILLNEED while the current one is being sent, the window
+    doubling up to READAHEAD_MAX. Short ranges (seeking video players,
+    download managers) get POSIX_FADV_RANDOM so the kernel does not read
+    ahead data nobody asked for. With drop_behind, pages already sent are
+    released with POSIX_FADV_DONTNEED so one huge download does not
+    evict everything else from the page cache.
+    """
+
+    def __init__(self, f, offset, count, drop_behind=False):
+        self.f = f
+        self.sequential = count >= SEQUENTIAL_MIN
+        self.drop_behind = drop_behind and self.sequential
+        self.window = READAHEAD_START
+        self.prefetched = offset
+        self.dropped = offset
+        self.end = offset + count
+        if hasattr(os, 'posix_fadvise'):
+            advise(f, offset, count, os.POSIX_FADV_SEQUENTIAL if self.sequential
+                   else os.POSIX_FADV_RANDOM)
+
+    def before(self, pos, count):
+        """Clip the next send to the current window and prefetch the one after"""
+        if not self.sequential:
+            return count
+        count = min(count, self.window)
+        ahead = pos + count
+        if ahead < self.end and ahead >= self.prefetched:
+            length = min(self.window * 2, READAHEAD_MAX, self.end - ahead)
+            advise(self.f, ahead, length, os.POSIX_FADV_WILLNEED)
+            self.prefetched = ahead + length
+            self.window = min(self.window * 2, READAHEAD_MAX)
+        return count
+
+    def after(self, pos, sent):
+        if self.drop_behind and pos + sent - self.dropped >= READAHEAD_START:
+            advise(self.f, self.dropped, pos + sent - self.dropped, os.POSIX_FADV_DONTNEED)
+            self.dropped = pos + sent
+
+
+def readahead_for(f, offset, count, file_size):
+    """Readahead policy for sending count bytes of a file_size byte file"""
+    if not hasattr(os, 'posix_fadvise'):
+        return None
+    drop_behind = FADVISE_DROP_BEHIND_SIZE > 0 and file_size >= FADVISE_DROP_BEHIND_SIZE
+    return Readahead(f, offset, count, drop_behind)
+
+
+def send_file(sock, f, offset, count, throttle=None, readahead=None):
+    """Send a byte range of an open file to a socket.
+
+    Uses sendfile() when the socket is plain TCP and the filesystem
+    supports it, otherwise falls back to large-buffer copies (TLS, FUSE
+    mounts that refuse sendfile, platforms without os.sendfile).
+    With an active throttle the range goes out one quantum at a time; a
+    Readahead splits it into prefetch windows. Returns the number of bytes
+    sent.
+    """
+    if count <= 0:
+        return 0
+    shaped = throttle is not None and throttle.active
+    if not shaped and (readahead is None or not readahead.sequential):
+        return _send_range(sock, f, offset, count)
+    sent = 0
+    while sent < count:
+        n = count - sent
+        if readahead is not None:
+            n = readahead.before(offset + sent, n)
+        if shaped:
+            n = min(throttle.quantum, n)
+            throttle.wait(n)
+        done = _send_range(sock, f, offset + sent, n)
+        if readahead is not None:
+            readahead.after(offset + sent, done)
+        sent += done
+        if done < n:
+            break
+    return sent
+
+
+def send_views(sock, views, throttle=None):
+    """Send an iterator of buffers (e.g. cached blocks), returns bytes sent"""
+    sent = 0
+    for view in views:
+        if throttle is None:
+            sock.sendall(view)
+        else:
+            for piece in throttle.slices(view):
+                throttle.wait(len(piece))
+                sock.sendall(piece)
+        sent += len(view)
+    return sent
@@ -0,0 +1,199 @@
+# modules/upload.py
+
+import os
+import re
+import ctypes
+import ctypes.util
+import time
+import threading
+from config import UPLOAD_PARTIAL_MAX_AGE
+
+UPLOAD_CHUNK = 1024 * 1024  # 1MB reads from the request body
+PARTIAL_PREFIX = '.'
+PARTIAL_SUFFIX = '.part'
+FALLOC_FL_KEEP_SIZE = 0x01
+
+_CONTENT_RANGE_RE = re.compile(r'^bytes\s+(?:(\d+)-(\d+)|\*)/(\d+)$')
+
+_active = set()
+_active_lock = threading.Lock()
+
+_libc = None
+if hasattr(os, 'posix_fallocate'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    except (OSError, AttributeError, TypeError):
+        _libc = None
+
+
+class UploadError(Exception):
+    """Upload rejected with an HTTP status; offset is reported to the client"""
+
+    def __init__(self, code, message, offset=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.offset = offset
+
+
+def is_partial_upload(name):
+    return name.startswith(PARTIAL_PREFIX) and name.endswith(PARTIAL_SUFFIX)
+
+
+def partial_path(target, total):
+    """Hidden sibling that collects an upload of total bytes until it completes.
+
+    The expected size is part of the name, so restarting with a different
+    file under the same name never resumes into stale data.
+    """
+    directory, name = os.path.split(target)
+    return os.path.join(directory, f'{PARTIAL_PREFIX}{name}.{total}{PARTIAL_SUFFIX}')
+
+
+def expire_partials(directory, max_age=UPLOAD_PARTIAL_MAX_AGE):
+    """Delete abandoned partial uploads in a directory.
+
+    A partial's mtime moves with every chunk written, so this only removes
+    uploads nobody has resumed for max_age seconds; listings hide partials,
+    so without this they would hold drive space forever.
+    """
+    if max_age <= 0:
+        return
+    cutoff = time.time() - max_age
+    try:
+        with os.scandir(directory) as it:
+            stale = [entry.path for entry in it
+                     if is_partial_upload(entry.name) and entry.stat().st_mtime < cutoff]
+    except OSError:
+        return
+    for path in stale:
+        with _active_lock:
+            if path in _active:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def parse_content_range(header, length):
+    """Read a request Content-Range into (start, total).
+
+    'bytes */total' is a status query and yields start None. Without the
+    header the body is the whole file.
+    """
+    if not header:
+        return 0, length
+    m = _CONTENT_RANGE_RE.match(header.strip())
+    if not m:
+        raise UploadError(400, "Malformed Content-Range")
+    total = int(m.group(3))
+    if m.group(1) is None:
+        return None, total
+    start, end = int(m.group(1)), int(m.group(2))
+    if end < start or end >= total or end - start + 1 != length:
+        raise UploadError(400, "Content-Range does not match the body")
+    return start, total
+
+
+def preallocate(fd, length):
+    """Reserve disk blocks for length bytes without changing the file size.
+
+    Keeps fragmentation low on USB media; silently skipped where the
+    filesystem (or platform) does not support fallocate.
+    """
+    if _libc is None or length <= 0:
+        return
+    try:
+        _libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, length)
+    except (OSError, ctypes.ArgumentError):
+        pass
+
+
+class Upload:
+    """One PUT request writing into a partial file, renamed into place on completion"""
+
+    def __init__(self, target, start, total):
+        self.target = target
+        self.start = start
+        self.total = total
+        self.part_path = partial_path(target, total)
+        self.f = None
+        self.offset = 0
+        self.created = not os.path.exists(target)
+
+    def open(self):
+        directory = os.path.dirname(self.target)
+        if not os.path.isdir(directory):
+            raise UploadError(409, "Parent directory does not exist")
+        if os.path.isdir(self.target):
+            raise UploadError(409, "Target is a directory")
+
+        expire_partials(directory)
+        with _active_lock:
+            if self.part_path in _active:
+                raise UploadError(409, "Upload already in progress")
+            _active.add(self.part_path)
+
+        created = False
+        try:
+            try:
+                self.f = open(self.part_path, 'r+b')
+            except FileNotFoundError:
+                if self.start is None:
+                    return self  # Status query for an upload that never started
+                if self.start > 0:
+                    raise UploadError(409, "Upload chunk leaves a gap", 0)
+                stats = os.statvfs(directory)
+                if stats.f_bavail * stats.f_frsize < self.total:
+                    raise UploadError(507, "Not enough space on the drive")
+                self.f = open(self.part_path, 'x+b')
+                created = True
+                preallocate(self.f.fileno(), self.total)
+            self.offset = os.fstat(self.f.fileno()).st_size
+            if self.start is not None:
+                if self.start > self.offset:
+                    raise UploadError(409, "Upload chunk leaves a gap", self.offset)
+                self.f.seek(self.start)
+        except BaseException:
+            self.close()
+            if created:
+                # Nothing was written yet; do not leave a preallocated file behind
+                try:
+                    os.unlink(self.part_path)
+                except OSError:
+                    pass
+            raise
+        return self
+
+    def write(self, data):
+        self.f.write(data)
+
+    def finish(self):
+        """Record progress; returns True once the file is complete and in place"""
+        if self.f is None:
+            return False
+        if self.start is not None:
+            self.f.flush()
+            self.offset = max(self.offset, self.f.tell())
+        if self.offset < self.total:
+            return False
+        os.fsync(self.f.fileno())
+        self.f.close()
+        self.f = None
+        os.replace(self.part_path, self.target)
+        return True
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        with _active_lock:
+            _active.discard(self.part_path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -2,9 +2,298 @@
 
 import subprocess
 import os
+import re
+import json
+import time
+import socket
 import tempfile
+import threading
+import collections
+from modules.utils import format_size
 from config import DEFAULT_MOUNT_PREFIX
 
+LSBLK_COLUMNS = 'NAME,PKNAME,FSTYPE,SIZE,MOUNTPOINT,LABEL,UUID,TYPE,TRAN,RM,HOTPLUG'
+NETLINK_KOBJECT_UEVENT = 15
+DRIVE_CACHE_TTL = 30  # Seconds; only used when uevents can't be watched
+
+class BlockDevice(collections.namedtuple(
+        'BlockDevice', 'name parent fstype size mountpoint label uuid type tran removable')):
+    __slots__ = ()
+
+    def describe(self):
+        """One-line summary for the drive menu"""
+        return '  '.join([
+            self.name,
+            self.fstype or 'unknown',
+            format_size(self.size) if self.size is not None else '?',
+            self.mountpoint or 'not mounted',
+            self.label or '',
+            self.type,
+            self.tran or '',
+        ]).rstrip()
+
+
+def _unescape(text, pattern, base):
+    """Undo \\xNN (udev) or \\NNN (/proc/mounts) escapes, keeping UTF-8 intact"""
+    raw = re.sub(pattern, lambda m: bytes([int(m.group(1), base)]), text.encode('utf-8', 'surrogateescape'))
+    return raw.decode('utf-8', 'replace')
+
+
+def _flag(value):
+    # lsblk prints booleans in newer releases, "0"/"1" strings in older ones
+    return value in (True, 1, '1')
+
+
+def lsblk_devices():
+    """All block devices from one `lsblk --json` call, partitions inheriting TRAN/RM"""
+    out = subprocess.check_output(['lsblk', '--json', '--bytes', '-o', LSBLK_COLUMNS],
+                                  stderr=subprocess.DEVNULL, timeout=10)
+    devices = []
+
+    def visit(node, parent=None):
+        tran = node.get('tran') or (parent.tran if parent else None)
+        removable = (_flag(node.get('rm')) or _flag(node.get('hotplug'))
+                     or (parent.removable if parent else False))
+        size = node.get('size')
+        dev = BlockDevice(
+            name=node['name'],
+            parent=node.get('pkname') or (parent.name if parent else None),
+            fstype=node.get('fstype'),
+            size=int(size) if size not in (None, '') else None,
+            mountpoint=node.get('mountpoint'),
+            label=node.get('label'),
+            uuid=node.get('uuid'),
+            type=node.get('type') or '',
+            tran=tran,
+            removable=removable,
+        )
+        devices.append(dev)
+        for child in node.get('children', ()):
+            visit(child, dev)
+
+    for node in json.loads(out).get('blockdevices', []):
+        visit(node)
+    return devices
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _links_by_device(directory):
+    """Map device names to the names of their /dev/disk/by-* symlinks"""
+    links = {}
+    try:
+        for name in os.listdir(directory):
+            target = os.path.basename(os.path.realpath(os.path.join(directory, name)))
+            # udev escapes spaces and slashes in labels
+            links[target] = _unescape(name, rb'\\x([0-9a-fA-F]{2})', 16)
+    except OSError:
+        pass
+    return links
+
+
+def _udev_fstype(sys_path):
+    """Filesystem type udev probed for a device (its ID_FS_TYPE), or None"""
+    number = _read(os.path.join(sys_path, 'dev'))
+    if not number:
+        return None
+    try:
+        with open(f'/run/udev/data/b{number}') as f:
+            for line in f:
+                if line.startswith('E:ID_FS_TYPE='):
+                    return line.strip().split('=', 1)[1] or None
+    except OSError:
+        pass
+    return None
+
+
+def sysfs_devices():
+    """Block devices read straight from /sys/block, for systems without lsblk --json.
+
+    Filesystem types come from the udev database, or from /proc/self/mounts
+    for mounted devices; without either they are None.
+    """
+    labels = _links_by_device('/dev/disk/by-label')
+    uuids = _links_by_device('/dev/disk/by-uuid')
+    mounts = read_mounts()
+    mounted_types = read_mount_types()
+    devices = []
+    for disk in sorted(os.listdir('/sys/block')):
+        sys_path = os.path.join('/sys/block', disk)
+        usb = '/usb' in os.path.realpath(os.path.join(sys_path, 'device'))
+        removable = _read(os.path.join(sys_path, 'removable')) == '1'
+        parts = sorted(name for name in os.listdir(sys_path)
+                       if os.path.exists(os.path.join(sys_path, name, 'partition')))
+        for name, parent, kind in [(disk, None, 'disk')] + [(p, disk, 'part') for p in parts]:
+            base = sys_path if parent is None else os.path.join(sys_path, name)
+            sectors = _read(os.path.join(base, 'size'))
+            devices.append(BlockDevice(
+                name=name, parent=parent, fstype=_udev_fstype(base) or mounted_types.get(name),
+                size=int(sectors) * 512 if sectors and sectors.isdigit() else None,
+                mountpoint=mounts.get(name), label=labels.get(name), uuid=uuids.get(name),
+                type=kind, tran='usb' if usb else None, removable=removable))
+    return devices
+
+
+def read_mounts():
+    """Map device names to their first mount point"""
+    mounts = {}
+    try:
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2 or not fields[0].startswith('/dev/'):
+                    continue
+                name = os.path.basename(os.path.realpath(fields[0]))
+                # Mount points escape whitespace as octal (\040)
+                mounts.setdefault(name, _unescape(fields[1], rb'\\([0-7]{3})', 8))
+    except OSError:
+        pass
+    return mounts
+
+
+def read_mount_types():
+    """Map mounted device names to the filesystem type they are mounted as"""
+    types = {}
+    try:
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[0].startswith('/dev/'):
+                    types.setdefault(os.path.basename(os.path.realpath(fields[0])), fields[2])
+    except OSError:
+        pass
+    return types
+
+
+def find_usb_partitions(devices):
+    """Filesystems on USB or removable disks: partitions, or whole unpartitioned sticks"""
+    parents = {dev.parent for dev in devices if dev.parent}
+    found = []
+    for dev in devices:
+        if not (dev.tran == 'usb' or dev.removable):
+            continue
+        if dev.type == 'part' or (dev.type == 'disk' and dev.name not in parents and dev.fstype):
+            found.append(dev)
+    return found
+
+
+class BlockEvents:
+    """Block-device add/remove/change uevents, read from the kernel over netlink.
+
+    Listeners receive each event as a dict of its KEY=value fields.
+    emit() dispatches an event by hand, which is how tests and other
+    event sources feed the same listeners.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self.running = False
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._listeners.append(callback)
+        self.start()
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def start(self):
+        """Start watching uevents; returns False where netlink is unavailable"""
+        with self._lock:
+            if self.running:
+                return True
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+                sock.bind((0, 1))  # Group 1: kernel uevents
+            except (AttributeError, OSError):
+                return False
+            self._sock = sock
+            self.running = True
+        threading.Thread(target=self._run, name='block-uevents', daemon=True).start()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except OSError:
+                self.running = False
+                return
+            event = parse_uevent(data)
+            if event.get('SUBSYSTEM') == 'block':
+                self.emit(event)
+
+    def emit(self, event):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error handling block event: {e}")
+
+
+def parse_uevent(data):
+    """'add@/devpath\\0ACTION=add\\0SUBSYSTEM=block...' into a dict"""
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode('ascii', 'replace')] = value.decode('utf-8', 'replace')
+    return event
+
+
+class DriveCache:
+    """Last discovery result, dropped whenever a block device changes"""
+
+    def __init__(self, events):
+        self.events = events
+        self._lock = threading.Lock()
+        self._devices = None
+        self._stamp = 0.0
+        self._subscribed = False
+
+    def invalidate(self, event=None):
+        with self._lock:
+            self._devices = None
+
+    def get(self, refresh=False):
+        with self._lock:
+            if not self._subscribed:
+                self.events.subscribe(self.invalidate)
+                self._subscribed = True
+            fresh = self._devices is not None and (
+                self.events.running or time.monotonic() - self._stamp < DRIVE_CACHE_TTL)
+            if fresh and not refresh:
+                return list(self._devices)
+        try:
+            devices = lsblk_devices()
+        except (OSError, subprocess.SubprocessError, ValueError):
+            try:
+                devices = sysfs_devices()
+            except OSError as e:
+                print(f"Error detecting drives: {e}")
+                devices = []
+        found = find_usb_partitions(devices)
+        with self._lock:
+            self._devices = found
+            self._stamp = time.monotonic()
+        return list(found)
+
+
+block_events = BlockEvents()
+drive_cache = DriveCache(block_events)
+
 class USBManager:
     @staticmethod
     def check_ntfs_support():
@@ -24,105 +313,27 @@ class USBManager:
             return False
 
     @staticmethod
-    def get_usb_drives():
-        """Get list of USB and external drives"""
-        drives = []
-        try:
-            # Get all block devices with detailed info
-            cmd = "lsblk -o NAME,FSTYPE,SIZE,MOUNTPOINT,LABEL,TYPE,TRAN -n"
-            result = subprocess.check_output(cmd, shell=True).decode('utf-8')
-            
-            # Get additional USB information
-            usb_devices = set()
-            try:
-                usb_cmd = "find /sys/devices -name removable | grep usb"
-                usb_result = subprocess.check_output(usb_cmd, shell=True).decode('utf-8')
-                for path in usb_result.splitlines():
-                    try:
-                        with open(path) as f:
-                            if f.read().strip() == '1':
-                                device_path = os.path.dirname(path)
-                                for block in os.listdir(device_path):
-                                    if block.startswith('sd'):
-                                        usb_devices.add(block[:3])
-                    except:
-                        continue
-            except:
-                pass
+    def get_usb_partitions(refresh=False):
+        """USB / removable filesystems as BlockDevice tuples.
 
-            # Process each line from lsblk output
-            for line in result.splitlines():
-                if not line.strip():
-                    continue
-                    
-                parts = line.split()
-                if len(parts) >= 3:
-                    device_name = parts[0].replace('├─', '').replace('└─', '')
-                    device_type = parts[5] if len(parts) > 5 else ""
-                    transport = parts[6] if len(parts) > 6 else ""
-                    
-                    # Check if it's a partition
-                    if device_type == "part":
-                        is_usb = False
-                        base_device = device_name.rstrip('0123456789')
-                        
-                        # Check multiple conditions for USB/external drives
-                        if (
-                            # Check if it's in our USB devices list
-                            base_device in usb_devices or
-                            # Check transport type
-                            transport in ['usb', 'sata'] or
-                            # Check removable flag
-                            os.path.exists(f"/sys/block/{base_device}/removable")
-                        ):
-                            try:
-                                # Check removable flag
-                                with open(f"/sys/block/{base_device}/removable") as f:
-                                    if f.read().strip() == '1':
-                                        is_usb = True
-                            except:
-                                # If we can't read removable flag but other conditions met
-                                if transport in ['usb', 'sata']:
-                                    is_usb = True
-                        
-                        if is_usb:
-                            drives.append((device_name, line))
-
-            # If no drives found, try alternative method
-            if not drives:
-                cmd = "find /dev/disk/by-id -type l -ls | grep usb"
-                try:
-                    result = subprocess.check_output(cmd, shell=True).decode('utf-8')
-                    for line in result.splitlines():
-                        if 'part' in line:
-                            device_path = os.path.realpath(line.split()[-1])
-                            device_name = device_path.split('/')[-1]
-                            # Get device info using lsblk
-                            cmd = f"lsblk -o NAME,FSTYPE,SIZE,MOUNTPOINT,LABEL,TYPE -n /dev/{device_name}"
-                            dev_info = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
-                            if dev_info:
-                                drives.append((device_name, dev_info))
-                except:
-                    pass
-
-        except Exception as e:
-            print(f"Error detecting drives: {e}")
-        
-        return drives
+        Results are cached and only re-read after a block-device uevent
+        (or every DRIVE_CACHE_TTL seconds when uevents can't be watched).
+        """
+        return drive_cache.get(refresh)
+
+    @staticmethod
+    def get_usb_drives(refresh=False):
+        """Get list of USB and external drives as (device name, description)"""
+        return [(dev.name, dev.describe()) for dev in USBManager.get_usb_partitions(refresh)]
 
     @staticmethod
     def get_mount_point(device_name):
-        try:
-            cmd = f"lsblk -n -o MOUNTPOINT /dev/{device_name}"
-            mount_point = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
-            if mount_point:
-                return mount_point
-        except:
-            pass
-        return None
+        """Current mount point of /dev/<device_name>, read from /proc/self/mounts"""
+        return read_mounts().get(device_name)
 
     @staticmethod
-    def mount_drive(device_name):
+    def mount_drive(device_name, mount_point=None):
+        """Mount /dev/<device_name>, at mount_point if given (else a fresh temp dir)"""
         # Check if already mounted
         existing_mount = USBManager.get_mount_point(device_name)
         if existing_mount:
@@ -131,7 +342,10 @@ class USBManager:
 
         try:
             # Create mount point
-            mount_point = tempfile.mkdtemp(prefix=DEFAULT_MOUNT_PREFIX)
+            if mount_point:
+                os.makedirs(mount_point, exist_ok=True)
+            else:
+                mount_point = tempfile.mkdtemp(prefix=DEFAULT_MOUNT_PREFIX)
 
             # Get filesystem type
             cmd = f"lsblk -n -o FSTYPE /dev/{device_name}"
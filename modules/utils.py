@@ -1,5 +1,6 @@
 import socket
 import os
+import urllib.parse
 from datetime import datetime
 
 def get_local_ip():
@@ -29,4 +30,17 @@ def load_css():
     """Load CSS content from static file"""
     css_path = os.path.join(os.path.dirname(__file__), '../static/styles.css')
     with open(css_path, 'r') as f:
-        return f.read()
\ No newline at end of file
+        return f.read()
+
+def translate_url_path(base_path, url_path):
+    """Map a URL path onto the filesystem below base_path, dropping traversal"""
+    path = urllib.parse.unquote(url_path.split('?', 1)[0].split('#', 1)[0])
+    path = path.strip('/')
+    words = path.split('/')
+    words = filter(None, words)
+    path = base_path
+    for word in words:
+        if os.path.dirname(word) or word in (os.curdir, os.pardir):
+            continue
+        path = os.path.join(path, word)
+    return path
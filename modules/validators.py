@@ -0,0 +1,81 @@
+# modules/validators.py
+
+import email.utils
+from config import FILE_CACHE_MAX_AGE
+
+# Files are revalidated cheaply with their ETag once max-age runs out;
+# listings change whenever a file is added, so always revalidate them.
+FILE_CACHE_CONTROL = f'public, max-age={FILE_CACHE_MAX_AGE}'
+LISTING_CACHE_CONTROL = 'no-cache'
+
+
+def format_etag(ino, size, mtime_ns):
+    return f'"{ino:x}-{size:x}-{mtime_ns:x}"'
+
+
+def format_listing_etag(ino, mtime_ns):
+    return f'W/"d-{ino:x}-{mtime_ns:x}"'
+
+
+def make_etag(st):
+    """Strong ETag for a file, derived from inode, size and mtime"""
+    return format_etag(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def make_listing_etag(st, format='html'):
+    """Weak ETag for a directory listing, derived from the directory's stat.
+
+    The directory mtime changes when entries are added, removed or renamed,
+    which is what the listing is built from. Non-HTML representations get
+    their own tag since they share the URL.
+    """
+    etag = format_listing_etag(st.st_ino, st.st_mtime_ns)
+    if format != 'html':
+        etag = f'{etag[:-1]}-{format}"'
+    return etag
+
+
+def encoded_etag(etag, encoding):
+    """ETag for a content-coded variant of a representation"""
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def last_modified(st):
+    return email.utils.formatdate(st.st_mtime, usegmt=True)
+
+
+def _etag_opaque(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    header = header.strip()
+    if header == '*':
+        return True
+    opaque = _etag_opaque(etag)
+    return any(_etag_opaque(tag.strip()) == opaque for tag in header.split(','))
+
+
+def is_not_modified(headers, etag, mtime):
+    """Evaluate If-None-Match / If-Modified-Since for a GET or HEAD request.
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted
+    when the client sent no entity tags (RFC 7232 section 6).
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            date = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if date is None:
+            return False
+        return int(mtime) <= int(date.timestamp())
+    return False
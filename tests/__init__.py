@@ -0,0 +1,89 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import http.client
+from unittest import mock
+
+from modules.search import metadata_index
+from modules.digests import digest_index
+from modules.compression import compression_cache
+from modules.thumbnails import thumbnailer
+from modules.server import FileServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class CacheDirTestCase(unittest.TestCase):
+    """Keeps the module-wide indexes and disk caches in a temporary directory.
+
+    The search and digest databases and the compression and thumbnail
+    caches normally live in CACHE_DIR; for the duration of a test class
+    they point into a fresh directory, and the originals are restored
+    afterwards so test files do not leak state into each other.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cache.cleanup)
+        cls.cache_dir = cache.name
+        patches = [
+            mock.patch.object(metadata_index, 'db_path', os.path.join(cache.name, 'index.sqlite3')),
+            mock.patch.object(metadata_index, '_local', threading.local()),
+            mock.patch.object(digest_index, 'db_path', os.path.join(cache.name, 'digests.sqlite3')),
+            mock.patch.object(digest_index, '_local', threading.local()),
+            mock.patch.object(compression_cache, 'cache_dir', os.path.join(cache.name, 'compressed')),
+            mock.patch.object(compression_cache, '_size', None),
+            mock.patch.object(thumbnailer.cache, 'cache_dir', os.path.join(cache.name, 'thumbnails')),
+            mock.patch.object(thumbnailer.cache, '_size', None),
+        ]
+        for patch in patches:
+            patch.start()
+            cls.addClassCleanup(patch.stop)
+
+
+class ServerTestCase(CacheDirTestCase):
+    """Serves a temporary directory on every engine for the test class.
+
+    Subclasses fill the directory in populate(); request() talks to the
+    server of one engine and returns (status, headers, body).
+    """
+
+    engines = ('threaded', 'asyncio')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(root.cleanup)
+        cls.root = root.name
+        cls.populate(cls.root)
+        cls.ports = {}
+        cls.servers = {}
+        for engine in cls.engines:
+            port = free_port()
+            server = FileServer(cls.root, port, engine, open_browser=False, processes=1, tls=False)
+            server.start()
+            cls.addClassCleanup(server.stop)
+            cls.ports[engine] = port
+            cls.servers[engine] = server
+
+    @classmethod
+    def populate(cls, root):
+        pass
+
+    def request(self, engine, path, method='GET', headers=None, body=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.ports[engine], timeout=10)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
@@ -0,0 +1,107 @@
+import io
+import os
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+from modules.archive import walk_tree, iter_zip, iter_tar, parse_archive_query, content_disposition
+from tests import ServerTestCase
+
+FILES = {
+    'a.txt': b'alpha',
+    'empty.txt': b'',
+    'sub/b.bin': os.urandom(3 * 1024 * 1024 + 5),
+    'sub/deeper/c.txt': b'gamma',
+}
+
+
+def make_tree(root):
+    for name, data in FILES.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    with open(os.path.join(root, '.upload.bin.10.part'), 'wb') as f:
+        f.write(b'unfinished')
+
+
+def zip_contents(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {info.filename: zf.read(info) for info in zf.infolist() if not info.is_dir()}
+
+
+def tar_contents(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        return {info.name: tf.extractfile(info).read() for info in tf if info.isfile()}
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.outside = os.path.join(tmp.name, 'secret.txt')
+        with open(self.outside, 'wb') as f:
+            f.write(b'secret')
+        self.root = os.path.join(tmp.name, 'share')
+        os.mkdir(self.root)
+        make_tree(self.root)
+        os.symlink(self.outside, os.path.join(self.root, 'escape.txt'))
+        os.symlink(os.path.join(self.root, 'a.txt'), os.path.join(self.root, 'inside.txt'))
+        os.symlink(self.root, os.path.join(self.root, 'loop'))
+
+    def test_walk_tree_stays_inside_the_share(self):
+        names = [rel for rel, _, _ in walk_tree(self.root, self.root)]
+        self.assertEqual(sorted(names), sorted(list(FILES) + ['inside.txt', 'sub', 'sub/deeper']))
+
+    def test_zip(self):
+        data = b''.join(iter_zip(self.root, self.root))
+        self.assertEqual(zip_contents(data), dict(FILES, **{'inside.txt': b'alpha'}))
+
+    def test_tar(self):
+        data = b''.join(iter_tar(self.root, self.root))
+        self.assertEqual(len(data) % tarfile.BLOCKSIZE, 0)
+        self.assertEqual(tar_contents(data), dict(FILES, **{'inside.txt': b'alpha'}))
+
+    def test_subdirectory(self):
+        sub = os.path.join(self.root, 'sub')
+        self.assertEqual(tar_contents(b''.join(iter_tar(sub, self.root))),
+                         {'b.bin': FILES['sub/b.bin'], 'deeper/c.txt': b'gamma'})
+
+    def test_parse_archive_query(self):
+        self.assertEqual(parse_archive_query('download=zip'), 'zip')
+        self.assertEqual(parse_archive_query('view=grid&download=tar'), 'tar')
+        self.assertIsNone(parse_archive_query('download=rar'))
+        self.assertIsNone(parse_archive_query(''))
+
+    def test_content_disposition(self):
+        self.assertEqual(content_disposition(self.root, self.root, 'zip'),
+                         "attachment; filename=\"share.zip\"; filename*=UTF-8''share.zip")
+        self.assertEqual(content_disposition(os.path.join(self.root, 'Föto "x"'), self.root, 'tar'),
+                         "attachment; filename=\"F?to _x_.tar\"; filename*=UTF-8''F%C3%B6to%20%22x%22.tar")
+
+
+class ServeArchiveTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        make_tree(root)
+
+    def test_zip(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/?download=zip')
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['Content-Type'], 'application/zip')
+            self.assertEqual(zip_contents(body), FILES)
+
+    def test_tar_of_subdirectory(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/sub/?download=tar')
+            self.assertEqual(status, 200, engine)
+            self.assertIn('filename="sub.tar"', headers['Content-Disposition'])
+            self.assertEqual(tar_contents(body), {'b.bin': FILES['sub/b.bin'], 'deeper/c.txt': b'gamma'})
+
+
+if __name__ == '__main__':
+    unittest.main()
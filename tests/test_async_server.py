@@ -0,0 +1,56 @@
+import os
+import time
+import socket
+import unittest
+
+from modules.async_server import AsyncFileServer
+from tests import ServerTestCase
+
+
+class AsyncEngineTest(ServerTestCase):
+    """The asyncio engine keeps serving while many clients are idle or slow"""
+
+    engines = ('asyncio',)
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'small.txt'), 'wb') as f:
+            f.write(b'small')
+        with open(os.path.join(root, 'big.bin'), 'wb') as f:
+            f.truncate(64 * 1024 * 1024)
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.ports['asyncio']), timeout=5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def timed_get(self):
+        started = time.monotonic()
+        status, _, body = self.request('asyncio', '/small.txt')
+        self.assertEqual((status, body), (200, b'small'))
+        return time.monotonic() - started
+
+    def test_engine(self):
+        self.assertIsInstance(self.servers['asyncio'].httpd, AsyncFileServer)
+
+    def test_idle_connections(self):
+        for _ in range(200):
+            self.connect()
+        self.assertLess(self.timed_get(), 1)
+
+    def test_slow_reader(self):
+        sock = self.connect()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.sendall(b'GET /big.bin HTTP/1.1\r\nHost: x\r\n\r\n')
+        sock.recv(100)  # The download has started and is stuck on a full socket buffer
+        self.assertLess(self.timed_get(), 1)
+
+    def test_malformed_request(self):
+        sock = self.connect()
+        sock.sendall(b'NONSENSE\r\n\r\n')
+        self.assertTrue(sock.recv(65536).startswith(b'HTTP/1.1 400'))
+        self.assertLess(self.timed_get(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'benchmark.py')
+
+
+class BenchmarkTest(unittest.TestCase):
+    """A short run of the harness on both engines"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # The server process keeps its caches under $HOME
+        self.env = dict(os.environ, HOME=self.tmp)
+
+    def bench(self, *args):
+        return subprocess.run([sys.executable, BENCHMARK, *args], env=self.env, capture_output=True,
+                              text=True, timeout=120, check=True).stdout
+
+    def test_run_and_compare(self):
+        output = os.path.join(self.tmp, 'run.json')
+        self.bench('run', '--engine', 'threaded', 'asyncio', '--scenario', 'small', 'range', 'listing',
+                   '-c', '1', '4', '-d', '0.3', '--fixtures', os.path.join(self.tmp, 'fixtures'),
+                   '--large-mb', '2', '--small-count', '20', '--small-size', '512', '-o', output)
+        with open(output) as f:
+            data = json.load(f)
+        self.assertEqual(data['meta']['fixtures']['small_count'], 20)
+        self.assertEqual(len(data['results']), 12)
+        for r in data['results']:
+            self.assertEqual(r['errors'], 0, r)
+            self.assertGreater(r['requests'], 0, r)
+            if r['scenario'] == 'small' and r['concurrency'] == 1:
+                # Headers and body as separate writes stall ~40ms on Nagle without TCP_NODELAY
+                self.assertLess(r['latency_ms']['p50'], 20, r)
+
+        lines = self.bench('compare', output, output).splitlines()
+        self.assertEqual(len(lines), 13)
+        self.assertIn('+0.0%', lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from types import SimpleNamespace
+
+from modules.blockcache import BlockCache, SEGMENT_BLOCKS
+
+BLOCK = 4096
+DATA = os.urandom(BLOCK * 10 + 100)
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(DATA)
+        self.f = open(path, 'rb')
+        self.addCleanup(self.f.close)
+        self.st = os.fstat(self.f.fileno())
+        self.cache = BlockCache(BLOCK * 4, BLOCK)
+        self.key = self.cache.file_key(self.st)
+
+    def test_blocks(self):
+        self.assertEqual(list(self.cache.blocks(100, BLOCK * 2)),
+                         [(0, 100, BLOCK - 100), (1, 0, BLOCK), (2, 0, 100)])
+        self.assertEqual(list(self.cache.blocks(BLOCK, BLOCK)), [(1, 0, BLOCK)])
+        self.assertEqual(list(self.cache.blocks(0, 0)), [])
+
+    def test_segments(self):
+        size = BLOCK * SEGMENT_BLOCKS
+        self.assertEqual(list(self.cache.segments(100, size * 2)),
+                         [(100, size - 100), (size, size), (size * 2, 100)])
+        self.assertEqual(list(self.cache.segments(0, 10)), [(0, 10)])
+
+    def test_iter_range(self):
+        for offset, count in [(0, len(DATA)), (100, BLOCK * 3), (BLOCK * 9 + 5, BLOCK * 5), (len(DATA), 10)]:
+            data = b''.join(self.cache.iter_range(self.f, self.st, offset, count))
+            self.assertEqual(data, DATA[offset:offset + count], (offset, count))
+
+    def test_blocks_are_read_once(self):
+        with mock.patch('os.pread', wraps=os.pread) as pread:
+            first = self.cache.get(self.f, self.key, 1)
+            again = self.cache.get(self.f, self.key, 1)
+        self.assertIs(first, again)
+        self.assertEqual(pread.call_count, 1)
+        self.assertEqual(first, DATA[BLOCK:BLOCK * 2])
+
+    def test_concurrent_misses_share_one_read(self):
+        gate = threading.Event()
+        real_pread = os.pread
+
+        def slow_pread(*args):
+            gate.wait(5)
+            return real_pread(*args)
+
+        results = []
+        with mock.patch('os.pread', side_effect=slow_pread) as pread:
+            threads = [threading.Thread(target=lambda: results.append(self.cache.get(self.f, self.key, 0)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            gate.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(pread.call_count, 1)
+        self.assertEqual(results, [DATA[:BLOCK]] * 4)
+
+    def test_eviction(self):
+        for index in range(6):
+            self.cache.get(self.f, self.key, index)
+        self.assertEqual(self.cache.size, BLOCK * 4)
+        self.assertEqual([index for _, index in self.cache._blocks], [2, 3, 4, 5])
+
+    def test_modified_file_is_a_new_key(self):
+        st = self.st
+        same = SimpleNamespace(st_dev=st.st_dev, st_ino=st.st_ino, st_size=st.st_size, st_mtime_ns=st.st_mtime_ns)
+        self.assertEqual(self.cache.file_key(same), self.key)
+        same.st_mtime_ns += 1
+        self.assertNotEqual(self.cache.file_key(same), self.key)
+
+    def test_readers(self):
+        self.assertFalse(self.cache.in_use(self.st))
+        with self.cache.reading(self.st) as first:
+            self.assertTrue(self.cache.in_use(self.st))
+            self.assertFalse(first.shared)
+            self.assertFalse(first.use_cache(0))
+            with self.cache.reading(self.st) as second:
+                self.assertTrue(first.shared)
+                self.assertTrue(second.use_cache(BLOCK * 3))
+            self.assertFalse(first.shared)
+            self.cache.get(self.f, self.key, 2)
+            self.assertTrue(first.use_cache(BLOCK * 2 + 10))
+            self.assertFalse(first.use_cache(BLOCK * 3))
+        self.assertFalse(self.cache.in_use(self.st))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import gzip
+import unittest
+from unittest import mock
+
+from modules import compression
+from modules.compression import (parse_accept_encoding, choose_encoding, is_compressible,
+                                 compress_bytes, compress_chunks, compression_cache)
+from tests import ServerTestCase
+
+TEXT = b''.join(b'line %d of some very compressible text\n' % i for i in range(2000))
+
+
+class NegotiationTest(unittest.TestCase):
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('gzip, br;q=0.5, zstd;q=x, *;q=0'),
+                         {'gzip': 1.0, 'br': 0.5, 'zstd': 0.0, '*': 0.0})
+        self.assertEqual(parse_accept_encoding('x-gzip'), {'x-gzip': 1.0, 'gzip': 1.0})
+        self.assertEqual(parse_accept_encoding(None), {})
+
+    def test_choose_encoding(self):
+        everything = ['br', 'zstd', 'gzip']
+        self.assertEqual(choose_encoding('gzip, br', everything), 'br')
+        self.assertEqual(choose_encoding('gzip, br;q=0.5', everything), 'gzip')
+        self.assertEqual(choose_encoding('*', ['gzip']), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0', everything))
+        self.assertIsNone(choose_encoding('identity', everything))
+        self.assertIsNone(choose_encoding('br', ['gzip']))
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible('a.txt', 'text/plain; charset=utf-8', 4096))
+        self.assertTrue(is_compressible('a.json', 'application/json', 4096))
+        self.assertFalse(is_compressible('a.txt', 'text/plain', 10))
+        self.assertFalse(is_compressible('a.png', 'image/png', 4096))
+        self.assertFalse(is_compressible('a.txt.gz', 'text/plain', 4096))
+        self.assertFalse(is_compressible('a.bin', 'application/octet-stream', 4096))
+
+    def test_gzip_round_trip(self):
+        self.assertEqual(gzip.decompress(compress_bytes(TEXT, 'gzip')), TEXT)
+        chunks = [TEXT[i:i + 1000] for i in range(0, len(TEXT), 1000)]
+        self.assertEqual(gzip.decompress(b''.join(compress_chunks(iter(chunks), 'gzip'))), TEXT)
+
+
+class ServeCompressedTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'plain.txt'), 'wb') as f:
+            f.write(TEXT)
+        with open(os.path.join(root, 'style.css'), 'wb') as f:
+            f.write(TEXT)
+        with open(os.path.join(root, 'style.css.gz'), 'wb') as f:
+            f.write(gzip.compress(b'from the sidecar'))
+
+    def test_compressed_on_the_fly(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/plain.txt', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', headers['Vary'])
+            self.assertEqual(gzip.decompress(body), TEXT)
+
+    def test_variant_is_cached(self):
+        self.request('threaded', '/plain.txt', headers={'Accept-Encoding': 'gzip'})
+        path = os.path.join(self.root, 'plain.txt')
+        entry = compression_cache.lookup(path, os.stat(path), 'gzip')
+        self.assertTrue(os.path.exists(entry))
+        for engine in self.engines:
+            _, _, body = self.request(engine, '/plain.txt', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(gzip.decompress(body), TEXT)
+
+    def test_sidecar(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/style.css', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(headers['Content-Encoding'], 'gzip', engine)
+            self.assertEqual(gzip.decompress(body), b'from the sidecar')
+
+    def test_identity(self):
+        for engine in self.engines:
+            for accept in ({}, {'Accept-Encoding': 'gzip;q=0'}):
+                status, headers, body = self.request(engine, '/plain.txt', headers=accept)
+                self.assertIsNone(headers['Content-Encoding'], engine)
+                self.assertEqual(body, TEXT)
+
+    def test_ranges_address_identity(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/plain.txt',
+                                                 headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-99'})
+            self.assertEqual(status, 206, engine)
+            self.assertIsNone(headers['Content-Encoding'])
+            self.assertEqual(body, TEXT[:100])
+
+    def test_disabled(self):
+        with mock.patch.object(compression, 'COMPRESSION_ENABLED', False):
+            for engine in self.engines:
+                _, headers, body = self.request(engine, '/plain.txt', headers={'Accept-Encoding': 'gzip'})
+                self.assertIsNone(headers['Content-Encoding'], engine)
+                self.assertEqual(body, TEXT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import time
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+from modules.server import MultiShareServer
+from modules.usb_manager import BlockEvents, BlockDevice
+from modules.daemon import HotplugDaemon, Assignments
+from tests import CacheDirTestCase, free_port
+
+
+class FakeEvents(BlockEvents):
+    """BlockEvents that never touches netlink; events only come from emit()"""
+
+    def start(self):
+        self.running = True
+        return True
+
+
+class FakeDrives:
+    """Simulated USB drives backed by ordinary directories.
+
+    plug() and unplug() update the device list and emit the matching
+    uevent, so HotplugDaemon(**fake.daemon_kwargs()) can be driven
+    without hardware or root.
+    """
+
+    def __init__(self):
+        self.events = FakeEvents()
+        self.devices = {}  # name -> (BlockDevice, directory)
+        self.mounted = {}
+
+    def plug(self, name, directory, label=None, uuid=None, fstype='vfat'):
+        dev = BlockDevice(name=name, parent=None, fstype=fstype, size=None, mountpoint=None,
+                          label=label, uuid=uuid, type='part', tran='usb', removable=True)
+        self.devices[name] = (dev, directory)
+        self.events.emit({'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': name, 'DEVTYPE': 'partition'})
+        return dev
+
+    def unplug(self, name):
+        self.devices.pop(name, None)
+        self.events.emit({'ACTION': 'remove', 'SUBSYSTEM': 'block', 'DEVNAME': name, 'DEVTYPE': 'partition'})
+
+    def discover(self):
+        return [dev for dev, _ in self.devices.values()]
+
+    def mount(self, device_name, mount_point=None):
+        entry = self.devices.get(device_name)
+        if entry is None:
+            return None
+        self.mounted[entry[1]] = device_name
+        return entry[1]
+
+    def unmount(self, mount_point):
+        return self.mounted.pop(mount_point, None) is not None
+
+    def daemon_kwargs(self):
+        return {'events': self.events, 'discover': self.discover,
+                'mount': self.mount, 'unmount': self.unmount}
+
+
+class HotplugDaemonTest(CacheDirTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.assignments_path = os.path.join(self.tmp.name, 'drives.json')
+        self.fake = FakeDrives()
+        self.port = free_port()
+        server = MultiShareServer(self.port, 'threaded', open_browser=False, processes=1, tls=False)
+        self.daemon = HotplugDaemon(assignments=Assignments(self.assignments_path), server=server,
+                                    settle_delay=0, **self.fake.daemon_kwargs())
+
+    def drive(self, name):
+        directory = os.path.join(self.tmp.name, name)
+        os.mkdir(directory)
+        with open(os.path.join(directory, 'a.txt'), 'wb') as f:
+            f.write(name.encode('ascii'))
+        return directory
+
+    def fetch(self, path):
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{self.port}{path}', timeout=5) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('timed out waiting for the daemon')
+            time.sleep(0.05)
+
+    def test_reconcile_adds_and_removes_shares(self):
+        self.fake.plug('sdx1', self.drive('one'), label='ONE', uuid='AAAA')
+        self.daemon.reconcile()
+        self.assertEqual(self.daemon.shares['sdx1'].label, 'ONE')
+        self.assertIn('sdx1', self.fake.mounted.values())
+
+        self.fake.unplug('sdx1')
+        self.daemon.reconcile()
+        self.assertEqual(self.daemon.shares, {})
+        self.assertEqual(self.fake.mounted, {})
+
+    def test_events_share_and_unshare_over_http(self):
+        self.assertTrue(self.daemon.start())
+        self.addCleanup(self.daemon.stop)
+        self.fake.plug('sdx1', self.drive('one'), label='ONE', uuid='AAAA')
+        self.wait_for(lambda: 'sdx1' in self.daemon.shares)
+        self.assertEqual(self.fetch('/share/ONE/a.txt'), (200, b'one'))
+
+        self.fake.unplug('sdx1')
+        self.wait_for(lambda: not self.daemon.shares)
+        self.assertEqual(self.fetch('/share/ONE/a.txt')[0], 404)
+
+    def test_replugged_drive_keeps_its_label(self):
+        directory = self.drive('one')
+        self.fake.plug('sdx1', directory, uuid='AAAA')
+        self.daemon.reconcile()
+        label = self.daemon.shares['sdx1'].label
+        self.fake.unplug('sdx1')
+        self.fake.plug('sdy1', self.drive('two'), uuid='BBBB')
+        self.daemon.reconcile()
+        self.fake.plug('sdz1', directory, uuid='AAAA')
+        self.daemon.reconcile()
+        self.assertEqual(self.daemon.shares['sdz1'].label, label)
+        self.assertNotEqual(self.daemon.shares['sdy1'].label, label)
+        self.assertEqual(Assignments(self.assignments_path).get(self.fake.devices['sdz1'][0])['label'], label)
+
+    def test_other_drive_under_same_name_is_replaced(self):
+        self.fake.plug('sdx1', self.drive('one'), uuid='AAAA')
+        self.daemon.reconcile()
+        first = self.daemon.shares['sdx1']
+        self.fake.plug('sdx1', self.drive('two'), uuid='BBBB')
+        self.daemon.reconcile()
+        self.assertNotEqual(self.daemon.shares['sdx1'].key, first.key)
+        self.assertEqual(list(self.fake.mounted), [self.fake.devices['sdx1'][1]])
+
+    def test_unknown_filesystem_is_skipped(self):
+        self.fake.plug('sdx1', self.drive('one'), label='ONE', fstype=None)
+        self.daemon.reconcile()
+        self.assertEqual(self.daemon.shares, {})
+        self.assertEqual(self.daemon.unknown, {'sdx1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
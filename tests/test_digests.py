@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import base64
+import types
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from modules import digests
+from modules.digests import (DigestIndex, READ_CHUNK, SCHEMA_VERSION, digest_index, manifest_chunks,
+                             sha256sum_line, parse_manifest_query)
+from modules.transfer import resident
+from tests import CacheDirTestCase, ServerTestCase
+
+FILES = {'a.txt': b'alpha', 'sub/b.bin': os.urandom(100000), 'sub/back\\slash.txt': b'c'}
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class DigestIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, 'digests.sqlite3')
+        self.index = DigestIndex(self.db_path, rate=0)
+        self.path = os.path.join(tmp.name, 'a.bin')
+        self.data = os.urandom(3 * READ_CHUNK)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+            os.fsync(f.fileno())  # Dirty pages could not be dropped at all
+
+    def test_digest_is_keyed_by_device(self):
+        st = os.stat(self.path)
+        self.assertEqual(self.index.hash_file(self.path, st), hashlib.sha256(self.data).digest())
+        self.assertEqual(self.index.lookup(st), hashlib.sha256(self.data).digest())
+        # Another stick whose filesystem reuses the inode number
+        other = types.SimpleNamespace(st_dev=st.st_dev + 1, st_ino=st.st_ino, st_size=st.st_size,
+                                      st_mtime_ns=st.st_mtime_ns)
+        self.assertIsNone(self.index.lookup(other))
+
+    def test_resident_pages_stay_cached(self):
+        with open(self.path, 'rb') as f:
+            f.read()
+            if resident(f, 0, len(self.data)) is None:
+                self.skipTest('mincore is not available')
+        self.index.hash_file(self.path, os.stat(self.path))
+        with open(self.path, 'rb') as f:
+            self.assertTrue(resident(f, 0, READ_CHUNK))
+            self.assertTrue(resident(f, 2 * READ_CHUNK, READ_CHUNK))
+
+
+    def test_digests_persist_across_connections(self):
+        st = os.stat(self.path)
+        digest = self.index.hash_file(self.path, st)
+        # Another thread, and another process, open their own connections
+        found = []
+        thread = threading.Thread(target=lambda: found.append(self.index.lookup(st)))
+        thread.start()
+        thread.join()
+        self.assertEqual(found, [digest])
+        self.assertEqual(DigestIndex(self.db_path).lookup(st), digest)
+
+    def test_old_table_is_dropped_once(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE digests (ino INTEGER, size INTEGER, mtime_ns INTEGER, sha256 BLOB)')
+        conn.commit()
+        conn.close()
+        st = os.stat(self.path)
+        self.index.hash_file(self.path, st)
+        conn = sqlite3.connect(self.db_path)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertEqual(tables, {'file_digests'})
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+        conn.close()
+        self.assertIsNotNone(DigestIndex(self.db_path).lookup(st))
+
+    def test_residency_is_checked_per_window(self):
+        with mock.patch.object(digests, 'resident', wraps=resident) as probe:
+            self.index.hash_file(self.path, os.stat(self.path))
+        self.assertEqual(probe.call_count, 1)
+
+
+class ManifestTest(CacheDirTestCase):
+
+    def test_pending_names_cannot_add_lines(self):
+        with tempfile.TemporaryDirectory() as root:
+            name = 'a\n' + '0' * 64 + '  fake'
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(b'x')
+            with mock.patch.object(digest_index, 'hashing', False):
+                body = b''.join(manifest_chunks(root, root)).decode('utf-8')
+        self.assertEqual(body, '# not hashed yet: a\\n' + '0' * 64 + '  fake\n')
+
+
+class ManifestFormatTest(unittest.TestCase):
+
+    def test_sha256sum_line(self):
+        digest = '0' * 64
+        self.assertEqual(sha256sum_line(digest, 'a b.txt'), f'{digest}  a b.txt\n')
+        self.assertEqual(sha256sum_line(digest, 'a\nb\\c'), f'\\{digest}  a\\nb\\\\c\n')
+
+    def test_parse_manifest_query(self):
+        self.assertEqual(parse_manifest_query('manifest'), 'sha256')
+        self.assertEqual(parse_manifest_query('manifest=json'), 'json')
+        self.assertIsNone(parse_manifest_query('download=zip'))
+
+
+class ServeDigestTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        for name, data in FILES.items():
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def wait_for(self, condition):
+        # Files are hashed by a background thread once the share is served
+        deadline = time.monotonic() + 10
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('timed out waiting for the hasher')
+            time.sleep(0.05)
+
+    def test_digest_headers(self):
+        expected = base64.b64encode(hashlib.sha256(FILES['sub/b.bin']).digest()).decode()
+        for engine in self.engines:
+            self.wait_for(lambda: 'Repr-Digest' in self.request(engine, '/sub/b.bin')[1])
+            status, headers, body = self.request(engine, '/sub/b.bin')
+            self.assertEqual(headers['Repr-Digest'], f'sha-256=:{expected}:', engine)
+            self.assertEqual(headers['Digest'], f'SHA-256={expected}')
+            status, headers, _ = self.request(engine, '/sub/b.bin', headers={'Range': 'bytes=0-9'})
+            self.assertEqual((status, headers['Repr-Digest']), (206, f'sha-256=:{expected}:'))
+
+    def test_manifest(self):
+        expected = ''.join(sorted(sha256sum_line(sha256(data), name) for name, data in FILES.items()))
+        for engine in self.engines:
+            self.wait_for(lambda: b'not hashed' not in self.request(engine, '/?manifest')[2])
+            body = self.request(engine, '/?manifest')[2].decode()
+            self.assertEqual(''.join(sorted(body.splitlines(keepends=True))), expected, engine)
+            self.assertEqual(self.request(engine, '/sub/?manifest')[2].decode().count('\n'), 2)
+
+            doc = json.loads(self.request(engine, '/?manifest=json')[2])
+            self.assertEqual((doc['pending'], doc['complete']), (0, True))
+            self.assertEqual({f['path']: f['sha256'] for f in doc['files']},
+                             {name: sha256(data) for name, data in FILES.items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
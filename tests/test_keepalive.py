@@ -0,0 +1,139 @@
+import os
+import time
+import socket
+import tempfile
+import unittest
+import http.client
+from unittest import mock
+
+from modules import server as threaded_server
+from modules import async_server
+from modules.server import FileServer
+from tests import CacheDirTestCase, ServerTestCase, free_port
+
+
+def exchange(port, data):
+    """Send raw bytes and read everything the server answers until it closes"""
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+        sock.sendall(data)
+        chunks = []
+        while True:
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+class RequestBodyTest(CacheDirTestCase):
+    """A body sent with GET/HEAD is never read, so it must not be parsed as the next request"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.TemporaryDirectory()
+        with open(os.path.join(cls.root.name, 'a.txt'), 'wb') as f:
+            f.write(b'a\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.root.cleanup()
+        super().tearDownClass()
+
+    def serve(self, engine):
+        port = free_port()
+        server = FileServer(self.root.name, port, engine, open_browser=False, processes=1, tls=False)
+        server.start()
+        self.addCleanup(server.stop)
+        self.assertIsNotNone(server.httpd)
+        return port
+
+    def check_pipelined(self, engine, method):
+        port = self.serve(engine)
+        response = exchange(port, (f'{method} /a.txt HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nABCDE'
+                                   'GET /a.txt HTTP/1.1\r\nHost: x\r\n\r\n').encode('ascii'))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200'), response)
+        self.assertIn(b'\r\nConnection: close\r\n', response)
+        self.assertNotIn(b'501', response)
+        self.assertNotIn(b'ABCDE', response)
+        self.assertEqual(response.count(b'HTTP/1.1 '), 1, response)
+
+    def test_get_with_body_threaded(self):
+        self.check_pipelined('threaded', 'GET')
+
+    def test_get_with_body_asyncio(self):
+        self.check_pipelined('asyncio', 'GET')
+
+    def test_head_with_body_threaded(self):
+        self.check_pipelined('threaded', 'HEAD')
+
+    def test_head_with_body_asyncio(self):
+        self.check_pipelined('asyncio', 'HEAD')
+
+    def test_keep_alive_without_body(self):
+        for engine in ('threaded', 'asyncio'):
+            port = self.serve(engine)
+            response = exchange(port, b'GET /a.txt HTTP/1.1\r\nHost: x\r\n\r\n'
+                                      b'GET /a.txt HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+            self.assertEqual(response.count(b'HTTP/1.1 200'), 2, response)
+
+
+class KeepAliveTest(ServerTestCase):
+    """Several requests share one connection and are answered in order"""
+
+    @classmethod
+    def populate(cls, root):
+        for name in ('a', 'b', 'c'):
+            with open(os.path.join(root, f'{name}.txt'), 'wb') as f:
+                f.write(name.encode('ascii') * 3)
+
+    def test_connection_is_reused(self):
+        for engine in self.engines:
+            conn = http.client.HTTPConnection('127.0.0.1', self.ports[engine], timeout=5)
+            self.addCleanup(conn.close)
+            socks = set()
+            for name in ('a', 'b', 'c', 'a'):
+                conn.request('GET', f'/{name}.txt')
+                response = conn.getresponse()
+                self.assertEqual(response.read(), name.encode('ascii') * 3)
+                self.assertIn('timeout=', response.headers['Keep-Alive'])
+                socks.add(conn.sock)
+            self.assertEqual(len(socks), 1, engine)
+
+    def test_pipelined_responses_keep_their_order(self):
+        for engine in self.engines:
+            response = exchange(self.ports[engine], b'GET /c.txt HTTP/1.1\r\nHost: x\r\n\r\n'
+                                                    b'HEAD /a.txt HTTP/1.1\r\nHost: x\r\n\r\n'
+                                                    b'GET /b.txt HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+            self.assertEqual(response.count(b'HTTP/1.1 200'), 3, engine)
+            self.assertLess(response.index(b'ccc'), response.index(b'bbb'))
+            self.assertNotIn(b'aaa', response)
+
+    def test_http10_closes_unless_asked(self):
+        for engine in self.engines:
+            started = time.monotonic()
+            response = exchange(self.ports[engine], b'GET /a.txt HTTP/1.0\r\n\r\n')
+            self.assertLess(time.monotonic() - started, 2, engine)
+            self.assertTrue(response.endswith(b'aaa'))
+            response = exchange(self.ports[engine], b'GET /a.txt HTTP/1.0\r\nConnection: keep-alive\r\n\r\n'
+                                                    b'GET /b.txt HTTP/1.0\r\n\r\n')
+            self.assertIn(b'Connection: keep-alive', response)
+            self.assertTrue(response.endswith(b'bbb'), engine)
+
+    def test_max_requests(self):
+        for module in (threaded_server, async_server):
+            patch = mock.patch.object(module, 'KEEPALIVE_MAX_REQUESTS', 2)
+            patch.start()
+            self.addCleanup(patch.stop)
+        for engine in self.engines:
+            response = exchange(self.ports[engine], b'GET /a.txt HTTP/1.1\r\nHost: x\r\n\r\n' * 3)
+            self.assertEqual(response.count(b'HTTP/1.1 200'), 2, engine)
+            self.assertTrue(response.endswith(b'aaa'))
+            self.assertEqual(response.count(b'Connection: close'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import urllib.parse
+import urllib.request
+
+from modules.server import FileServer
+from tests import CacheDirTestCase, free_port
+
+NAME = '<b>x&y.txt'
+SUBDIR = '<img src=x onerror=alert(1)>'
+
+
+class ListingEscapeTest(CacheDirTestCase):
+    """Names and paths are markup-escaped in both listing layouts and engines"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.TemporaryDirectory(prefix='<s>')
+        with open(os.path.join(cls.root.name, NAME), 'wb') as f:
+            f.write(b'x\n')
+        os.mkdir(os.path.join(cls.root.name, '<i>dir'))
+        os.mkdir(os.path.join(cls.root.name, SUBDIR))
+        cls.ports = {}
+        cls.servers = []
+        for engine in ('threaded', 'asyncio'):
+            cls.ports[engine] = free_port()
+            server = FileServer(cls.root.name, cls.ports[engine], engine, open_browser=False,
+                                processes=1, tls=False)
+            server.start()
+            cls.servers.append(server)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.stop()
+        cls.root.cleanup()
+        super().tearDownClass()
+
+    def listing(self, path='/', engine='threaded'):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.ports[engine]}{path}', timeout=5) as r:
+            return r.read().decode('utf-8')
+
+    def check(self, body):
+        self.assertNotIn('<b>x', body)
+        self.assertNotIn('<i>dir', body)
+        self.assertNotIn('<img src=x', body)
+        self.assertNotIn('<s>', body)
+        self.assertIn('&lt;b&gt;x&amp;y.txt', body)
+        self.assertIn('&lt;i&gt;dir/', body)
+        self.assertIn('&lt;s&gt;', body)  # The served directory
+
+    def test_list_view(self):
+        self.check(self.listing())
+
+    def test_grid_view(self):
+        self.check(self.listing('/?view=grid'))
+
+    def test_subdirectory_with_markup_name(self):
+        path = '/' + urllib.parse.quote(SUBDIR) + '/'
+        escaped = '&lt;img src=x onerror=alert(1)&gt;'
+        for engine in ('threaded', 'asyncio'):
+            for query in ('', '?view=grid'):
+                body = self.listing(path + query, engine)
+                self.assertNotIn('<img src=x', body)
+                self.assertNotIn('<s>', body)
+                self.assertIn(f'<h2>Files in {escaped}</h2>', body)
+                self.assertIn(f'Current location: {escaped}', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
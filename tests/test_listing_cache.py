@@ -0,0 +1,87 @@
+import os
+import time
+import tempfile
+import unittest
+
+from modules.listing import ListingCache, scan_directory, render_listing, listing_cache
+from tests import ServerTestCase
+
+OLD = time.time() - 3600
+
+
+def age(path):
+    os.utime(path, (OLD, OLD))
+
+
+class ListingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        for name in ('b.txt', 'A.txt', '.c.txt.5.part'):
+            open(os.path.join(self.root, name), 'wb').close()
+        os.mkdir(os.path.join(self.root, 'dir'))
+        age(self.root)
+        self.cache = ListingCache(max_entries=2)
+
+    def test_scan_directory(self):
+        entries = scan_directory(self.root)
+        self.assertEqual([e.name for e in entries], ['A.txt', 'b.txt', 'dir'])
+        self.assertEqual([e.is_dir for e in entries], [False, False, True])
+
+    def test_unchanged_directory_is_not_rescanned(self):
+        self.assertIs(self.cache.get(self.root), self.cache.get(self.root))
+
+    def test_change_is_seen(self):
+        first = self.cache.get(self.root)
+        open(os.path.join(self.root, 'new.txt'), 'wb').close()
+        second = self.cache.get(self.root)
+        self.assertIsNot(second, first)
+        self.assertIn('new.txt', [e.name for e in second.entries])
+        # Modified just now: a second change within the timestamp resolution must not be missed
+        self.assertIsNot(self.cache.get(self.root), second)
+
+    def test_invalidate(self):
+        first = self.cache.get(self.root)
+        self.cache.invalidate(self.root)
+        self.assertIsNot(self.cache.get(self.root), first)
+
+    def test_bounded(self):
+        dirs = []
+        for name in ('x', 'y', 'z'):
+            path = os.path.join(self.root, name)
+            os.mkdir(path)
+            age(path)
+            dirs.append(path)
+        first = self.cache.get(dirs[0])
+        self.cache.get(dirs[1])
+        self.cache.get(dirs[2])
+        self.assertIsNot(self.cache.get(dirs[0]), first)
+
+    def test_rendered_page_is_reused(self):
+        listing_cache.invalidate()
+        self.addCleanup(listing_cache.invalidate)
+        body = render_listing(self.root, self.root, 8000)
+        self.assertIs(render_listing(self.root, self.root, 8000), body)
+        self.assertIn(b'A.txt', body)
+        self.assertNotIn(b'.part', body)
+
+
+class ServeListingTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        open(os.path.join(root, 'first.txt'), 'wb').close()
+        age(root)
+
+    def test_new_file_appears(self):
+        for engine in self.engines:
+            self.assertIn(b'first.txt', self.request(engine, '/')[2])
+        open(os.path.join(self.root, 'second.txt'), 'wb').close()
+        for engine in self.engines:
+            self.assertIn(b'second.txt', self.request(engine, '/')[2], engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import json
+import unittest
+
+from modules.listing import Entry, entry_json, parse_listing_query
+from modules.validators import make_etag
+from tests import ServerTestCase
+
+
+class EntryJsonTest(unittest.TestCase):
+
+    def test_entries(self):
+        self.assertEqual(entry_json(Entry('a.txt', False, 16, 2_000_000_000, 1)),
+                         {'name': 'a.txt', 'type': 'file', 'size': 16, 'mtime': 2.0, 'etag': '"1-10-77359400"'})
+        self.assertEqual(entry_json(Entry('d', True, 4096, 2_000_000_000, 1)),
+                         {'name': 'd', 'type': 'dir', 'size': None, 'mtime': 2.0, 'etag': 'W/"d-1-77359400"'})
+        self.assertEqual(entry_json(Entry('gone', False, None, None, None))['size'], None)
+
+    def test_format_negotiation(self):
+        self.assertEqual(parse_listing_query('format=json').format, 'json')
+        self.assertEqual(parse_listing_query('', 'application/json').format, 'json')
+        self.assertEqual(parse_listing_query('', 'text/html, application/json').format, 'html')
+        self.assertEqual(parse_listing_query('format=html', 'application/json').format, 'html')
+
+
+class ServeJsonTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        for name in ('b.txt', 'a "quoted" ünïcode.txt'):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(b'12345')
+        os.mkdir(os.path.join(root, 'sub'))
+
+    def test_document(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/?format=json&limit=2')
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['Content-Type'], 'application/json')
+            doc = json.loads(body)
+            self.assertEqual((doc['path'], doc['total'], doc['offset'], doc['limit']), ('/', 3, 0, 2))
+            self.assertEqual(doc['next'], '?sort=name&order=asc&offset=2&limit=2&format=json')
+            self.assertIsNone(doc['prev'])
+            first = doc['entries'][0]
+            self.assertEqual((first['name'], first['type'], first['size']), ('a "quoted" ünïcode.txt', 'file', 5))
+            self.assertEqual(first['etag'], make_etag(os.stat(os.path.join(self.root, first['name']))))
+
+    def test_accept_header(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/sub/', headers={'Accept': 'application/json'})
+            self.assertEqual(headers['Content-Type'], 'application/json', engine)
+            self.assertIn('Accept', headers['Vary'])
+            self.assertEqual(json.loads(body)['path'], '/sub/')
+
+    def test_separate_etag(self):
+        for engine in self.engines:
+            html_etag = self.request(engine, '/')[1]['ETag']
+            json_etag = self.request(engine, '/?format=json')[1]['ETag']
+            self.assertNotEqual(html_etag, json_etag, engine)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import re
+import types
+import unittest
+
+from modules.listing import (ListingView, DirectoryListing, Entry, parse_listing_query,
+                             render_listing, STREAM_THRESHOLD)
+from tests import ServerTestCase
+from config import LISTING_PAGE_SIZE
+
+COUNT = 1200
+
+
+def make_listing():
+    entries = [Entry('b.txt', False, 30, 1, 1), Entry('a.txt', False, 10, 3, 2),
+               Entry('d', True, 4096, 2, 3), Entry('c.txt', False, 20, 4, 4)]
+    return DirectoryListing('/x', 0, sorted(entries, key=lambda e: e.name))
+
+
+def names(rows):
+    return [e.name for e in rows]
+
+
+def view(**kwargs):
+    return parse_listing_query('')._replace(**kwargs)
+
+
+class ListingViewTest(unittest.TestCase):
+
+    def test_parse_listing_query(self):
+        self.assertEqual(parse_listing_query(''), ListingView('name', False, 0, LISTING_PAGE_SIZE, 'html', 'list'))
+        self.assertEqual(parse_listing_query('sort=size&order=desc&offset=5&limit=10&view=grid'),
+                         ListingView('size', True, 5, 10, 'html', 'grid'))
+        self.assertEqual(parse_listing_query('sort=evil&offset=-3&limit=0'),
+                         ListingView('name', False, 0, 1, 'html', 'list'))
+        self.assertEqual(parse_listing_query('offset=x&limit=y'), parse_listing_query(''))
+
+    def test_sorting(self):
+        listing = make_listing()
+        self.assertEqual(names(listing.page(view())), ['a.txt', 'b.txt', 'c.txt', 'd'])
+        self.assertEqual(names(listing.page(view(sort='size'))), ['d', 'a.txt', 'c.txt', 'b.txt'])
+        self.assertEqual(names(listing.page(view(sort='mtime', reverse=True))), ['c.txt', 'a.txt', 'd', 'b.txt'])
+
+    def test_pages(self):
+        listing = make_listing()
+        self.assertEqual(names(listing.page(view(offset=1, limit=2))), ['b.txt', 'c.txt'])
+        self.assertEqual(names(listing.page(view(offset=3, limit=2))), ['d'])
+        self.assertEqual(names(listing.page(view(offset=1, limit=2, reverse=True))), ['c.txt', 'b.txt'])
+        self.assertEqual(listing.page(view(offset=10)), [])
+
+
+class ServePagesTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        for i in range(COUNT):
+            open(os.path.join(root, f'f{i:04d}.txt'), 'wb').close()
+
+    def test_large_page_is_streamed(self):
+        self.assertGreater(COUNT, STREAM_THRESHOLD)
+        self.assertIsInstance(render_listing(self.root, self.root, 0), types.GeneratorType)
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/')
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+            self.assertEqual(len(re.findall(rb'class="file-link', body)), COUNT)
+            self.assertTrue(body.endswith(b'</html>\n'))
+
+    def test_pagination(self):
+        for engine in self.engines:
+            body = self.request(engine, '/?offset=100&limit=50')[2].decode()
+            self.assertEqual(re.findall(r'>(f\d+\.txt)</a>', body), [f'f{i:04d}.txt' for i in range(100, 150)])
+            self.assertIn(f'Showing 101-150 of {COUNT}', body)
+            self.assertIn('offset=150', body)
+            self.assertIn('offset=50', body)
+
+    def test_descending(self):
+        for engine in self.engines:
+            body = self.request(engine, '/?order=desc&limit=3')[2].decode()
+            self.assertEqual(re.findall(r'>(f\d+\.txt)</a>', body), ['f1199.txt', 'f1198.txt', 'f1197.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
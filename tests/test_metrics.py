@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import unittest
+
+from modules.metrics import Registry, METRICS, CONTENT_TYPE
+from tests import ServerTestCase
+
+DEAD_PID = 2 ** 22 + 1  # Above the kernel's pid_max
+
+
+def value(text, series):
+    match = re.search(rf'^{re.escape(series)} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counters_from_many_threads_add_up(self):
+        def work():
+            for _ in range(1000):
+                self.registry.inc('usb_share_requests_total', ('file', '200'))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = self.registry.render().decode()
+        self.assertEqual(value(text, 'usb_share_requests_total{route="file",code="200"}'), 4000)
+
+    def test_render(self):
+        self.registry.inc('usb_share_active_connections')
+        self.registry.inc('usb_share_bytes_sent_total', ('/a "b"\\c',), 10)
+        text = self.registry.render().decode()
+        for name, (kind, _, _) in METRICS.items():
+            self.assertIn(f'# TYPE {name} {kind}\n', text)
+        self.assertEqual(value(text, 'usb_share_active_connections'), 1)
+        self.assertEqual(value(text, 'usb_share_worker_processes'), 0)
+        self.assertEqual(value(text, 'usb_share_bytes_sent_total{share="/a \\"b\\"\\\\c"}'), 10)
+
+    def test_histogram(self):
+        for seconds in (0.0003, 0.002, 0.002, 30):
+            self.registry.observe('usb_share_time_to_first_byte_seconds', seconds)
+        text = self.registry.render().decode()
+        name = 'usb_share_time_to_first_byte_seconds'
+        self.assertEqual(value(text, f'{name}_bucket{{le="0.0005"}}'), 1)
+        self.assertEqual(value(text, f'{name}_bucket{{le="0.0025"}}'), 3)
+        self.assertEqual(value(text, f'{name}_bucket{{le="5"}}'), 3)
+        self.assertEqual(value(text, f'{name}_bucket{{le="+Inf"}}'), 4)
+        self.assertEqual(value(text, f'{name}_count'), 4)
+        self.assertAlmostEqual(value(text, f'{name}_sum'), 30.0043)
+
+    def test_exports_of_other_processes_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for pid in (os.getppid(), DEAD_PID):
+                with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+                    json.dump({'counters': [['usb_share_requests_total', ['file', '200'], 5],
+                                            ['usb_share_active_connections', [], 2]],
+                               'histograms': []}, f)
+            self.registry._export_dir = directory
+            self.registry.inc('usb_share_requests_total', ('file', '200'))
+            text = self.registry.render().decode()
+        self.assertEqual(value(text, 'usb_share_requests_total{route="file",code="200"}'), 11)
+        # Gauges of workers that died are dropped, their counters are kept
+        self.assertEqual(value(text, 'usb_share_active_connections'), 2)
+
+
+class MetricsEndpointTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'a.txt'), 'wb') as f:
+            f.write(b'x' * 1000)
+
+    def scrape(self, engine):
+        status, headers, body = self.request(engine, '/metrics')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], CONTENT_TYPE)
+        return body.decode()
+
+    def test_downloads_are_counted(self):
+        sent = f'usb_share_bytes_sent_total{{share="{self.root}"}}'
+        requests = 'usb_share_requests_total{route="file",code="200"}'
+        for engine in self.engines:
+            before = self.scrape(engine)
+            self.request(engine, '/a.txt')
+            # Handlers account a response after sending it, so a scrape may run just ahead of that
+            deadline = time.monotonic() + 5
+            while True:
+                after = self.scrape(engine)
+                counted = (value(after, requests) - (value(before, requests) or 0),
+                           value(after, sent) - (value(before, sent) or 0))
+                if counted[1] >= 1000 + len(before) or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(counted[0], 1, engine)
+            # Scrape bodies are counted too
+            self.assertGreaterEqual(counted[1], 1000 + len(before))
+            self.assertIn('usb_share_time_to_first_byte_seconds_count', after)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import time
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from modules import server as server_module
+from modules.server import PooledTCPServer, USBFileHandler
+from tests import CacheDirTestCase
+
+
+def request(sock, path='/a.txt'):
+    sock.sendall(f'GET {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode('ascii'))
+
+
+def read_response(sock):
+    """Headers plus the Content-Length body of one response"""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+    head, _, body = data.partition(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    while len(body) < length:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        body += chunk
+    return head + b'\r\n\r\n' + body
+
+
+class WorkerPoolTest(CacheDirTestCase):
+    """Idle connections must not hold the workers or the per-IP slots"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.TemporaryDirectory()
+        with open(os.path.join(cls.root.name, 'a.txt'), 'wb') as f:
+            f.write(b'a\n')
+        with open(os.path.join(cls.root.name, 'big.bin'), 'wb') as f:
+            f.truncate(64 * 1024 * 1024)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.root.cleanup()
+        super().tearDownClass()
+
+    def serve(self, **kwargs):
+        root = self.root.name
+        httpd = PooledTCPServer(('127.0.0.1', 0),
+                                lambda *a, **k: USBFileHandler(*a, directory=root, port=0, **k), **kwargs)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return httpd.server_address[1]
+
+    def connect(self, port):
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def idle_connections(self, port, count):
+        socks = []
+        for _ in range(count):
+            sock = self.connect(port)
+            request(sock)
+            self.assertTrue(read_response(sock).startswith(b'HTTP/1.1 200'))
+            socks.append(sock)
+        return socks
+
+    def test_idle_keep_alive_connections_do_not_hold_workers(self):
+        port = self.serve(workers=4, per_ip_limit=100)
+        idle = self.idle_connections(port, 8)
+        self.connect(port)  # Connected, but never sends a request
+        started = time.monotonic()
+        sock = self.connect(port)
+        request(sock)
+        self.assertTrue(read_response(sock).startswith(b'HTTP/1.1 200'))
+        self.assertLess(time.monotonic() - started, 1)
+        # The parked connections are still usable
+        for sock in idle:
+            request(sock)
+            self.assertTrue(read_response(sock).startswith(b'HTTP/1.1 200'))
+
+    def test_idle_connections_do_not_count_against_the_ip_limit(self):
+        port = self.serve(workers=4, per_ip_limit=2)
+        self.idle_connections(port, 4)
+        sock = self.connect(port)
+        request(sock)
+        self.assertTrue(read_response(sock).startswith(b'HTTP/1.1 200'))
+
+    def test_busy_ip_gets_503(self):
+        port = self.serve(workers=4, per_ip_limit=1)
+        # A download the client does not read keeps its worker busy
+        busy = self.connect(port)
+        request(busy, '/big.bin')
+        time.sleep(0.3)
+        sock = self.connect(port)
+        request(sock)
+        response = read_response(sock)
+        self.assertTrue(response.startswith(b'HTTP/1.1 503'), response)
+        self.assertIn(b'Retry-After:', response)
+
+    def test_idle_connections_time_out(self):
+        with mock.patch.object(server_module, 'KEEPALIVE_TIMEOUT', 0.5):
+            port = self.serve(workers=2)
+            sock, = self.idle_connections(port, 1)
+            silent = self.connect(port)
+            started = time.monotonic()
+            self.assertEqual(sock.recv(1), b'')
+            self.assertEqual(silent.recv(1), b'')
+            self.assertLess(time.monotonic() - started, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
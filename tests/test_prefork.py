@@ -0,0 +1,82 @@
+import os
+import time
+import tempfile
+import unittest
+import http.client
+from unittest import mock
+
+from modules.prefork import process_count
+from modules.server import FileServer, MultiShareServer
+from tests import CacheDirTestCase, free_port
+
+
+def fetch(port, path):
+    """GET on a fresh connection, so the kernel may pick any worker"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+class PreforkTest(CacheDirTestCase):
+    """Two worker processes serving one port"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'share')
+        os.mkdir(self.root)
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write(b'alpha')
+        # Workers are fresh interpreters: keep their caches out of the real home
+        patch = mock.patch.dict(os.environ, HOME=tmp.name)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.port = free_port()
+
+    def start(self, server):
+        server.start()
+        self.addCleanup(server.stop)
+        self.assertIsNotNone(server.httpd, server.error)
+        return server
+
+    def wait_for(self, condition):
+        # Workers restart and apply commands asynchronously
+        deadline = time.monotonic() + 10
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('timed out waiting for the workers')
+            time.sleep(0.1)
+
+    def test_process_count(self):
+        self.assertEqual(process_count(3), 3)
+        self.assertEqual(process_count(0), os.cpu_count() or 1)
+
+    def test_dead_worker_is_restarted(self):
+        server = self.start(FileServer(self.root, self.port, 'threaded', open_browser=False, processes=2,
+                                       tls=False))
+        workers = server.httpd.workers
+        self.assertEqual(len(workers), 2)
+        for _ in range(10):
+            self.assertEqual(fetch(self.port, '/a.txt'), (200, b'alpha'))
+
+        old = workers[0].proc.pid
+        workers[0].proc.kill()
+        self.wait_for(lambda: workers[0].proc.pid != old and workers[0].alive())
+        for _ in range(10):
+            self.assertEqual(fetch(self.port, '/a.txt'), (200, b'alpha'))
+
+    def test_share_changes_reach_every_worker(self):
+        server = self.start(MultiShareServer(self.port, 'asyncio', open_browser=False, processes=2, tls=False))
+        self.assertEqual(fetch(self.port, '/share/late/a.txt')[0], 404)
+        server.add_share(self.root, 'late')
+        self.wait_for(lambda: all(fetch(self.port, '/share/late/a.txt') == (200, b'alpha') for _ in range(10)))
+        server.remove_share('late')
+        self.wait_for(lambda: all(fetch(self.port, '/share/late/a.txt')[0] == 404 for _ in range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
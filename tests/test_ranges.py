@@ -0,0 +1,118 @@
+import os
+import email
+import unittest
+import email.utils
+
+from modules.ranges import (MAX_RANGES, parse_ranges, coalesce_ranges, if_range_matches,
+                            multipart_byteranges)
+from tests import ServerTestCase
+
+DATA = bytes(range(256)) * 40
+
+
+class ParseRangesTest(unittest.TestCase):
+
+    def test_forms(self):
+        self.assertEqual(parse_ranges('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_ranges('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_ranges('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_ranges('bytes=-5000', 1000), [(0, 999)])
+        self.assertEqual(parse_ranges('bytes=990-2000', 1000), [(990, 999)])
+
+    def test_coalesces_overlapping_and_adjacent(self):
+        self.assertEqual(parse_ranges('bytes=500-599, 0-99,100-199,150-250', 1000),
+                         [(0, 250), (500, 599)])
+        self.assertEqual(coalesce_ranges([(10, 20), (0, 5), (6, 8)]), [(0, 8), (10, 20)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_ranges('bytes=1000-', 1000), [])
+        self.assertEqual(parse_ranges('bytes=-0', 1000), [])
+        self.assertEqual(parse_ranges('bytes=0-', 0), [])
+        self.assertEqual(parse_ranges('bytes=2000-,5-9', 1000), [(5, 9)])
+
+    def test_malformed_is_ignored(self):
+        for header in [None, '', 'items=0-1', 'bytes=', 'bytes=5', 'bytes=-',
+                       'bytes=9-5', 'bytes=a-b', 'bytes=0-1;2-3', 'bytes=,']:
+            self.assertIsNone(parse_ranges(header, 1000), header)
+
+    def test_too_many_ranges(self):
+        spec = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_ranges(f'bytes={spec}', 100000))
+
+
+class IfRangeTest(unittest.TestCase):
+
+    def test_entity_tags(self):
+        self.assertTrue(if_range_matches(None, 0, '"abc"'))
+        self.assertTrue(if_range_matches('"abc"', 0, '"abc"'))
+        self.assertFalse(if_range_matches('"abd"', 0, '"abc"'))
+        self.assertFalse(if_range_matches('W/"abc"', 0, 'W/"abc"'))
+        self.assertFalse(if_range_matches('"abc"', 0, None))
+
+    def test_dates(self):
+        mtime = 1700000000.7
+        self.assertTrue(if_range_matches(email.utils.formatdate(mtime, usegmt=True), mtime))
+        self.assertFalse(if_range_matches(email.utils.formatdate(mtime - 1, usegmt=True), mtime))
+        self.assertFalse(if_range_matches('yesterday', mtime))
+
+
+class MultipartTest(unittest.TestCase):
+
+    def test_layout(self):
+        boundary, parts, trailer, total = multipart_byteranges([(0, 9), (20, 29)], 'text/plain', 100)
+        self.assertEqual([(start, length) for _, start, length in parts], [(0, 10), (20, 10)])
+        self.assertIn(b'Content-Range: bytes 20-29/100', parts[1][0])
+        self.assertEqual(trailer, f'\r\n--{boundary}--\r\n'.encode())
+        self.assertEqual(total, sum(len(h) + n for h, _, n in parts) + len(trailer))
+
+
+class ServeRangeTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'data.bin'), 'wb') as f:
+            f.write(DATA)
+
+    def test_single_range(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/data.bin', headers={'Range': 'bytes=100-199'})
+            self.assertEqual(status, 206, engine)
+            self.assertEqual(headers['Content-Range'], f'bytes 100-199/{len(DATA)}')
+            self.assertEqual(body, DATA[100:200])
+
+    def test_suffix_range(self):
+        for engine in self.engines:
+            status, _, body = self.request(engine, '/data.bin', headers={'Range': 'bytes=-10'})
+            self.assertEqual((status, body), (206, DATA[-10:]), engine)
+
+    def test_unsatisfiable(self):
+        for engine in self.engines:
+            status, headers, _ = self.request(engine, '/data.bin', headers={'Range': f'bytes={len(DATA)}-'})
+            self.assertEqual(status, 416, engine)
+            self.assertEqual(headers['Content-Range'], f'bytes */{len(DATA)}')
+
+    def test_malformed_sends_everything(self):
+        for engine in self.engines:
+            status, _, body = self.request(engine, '/data.bin', headers={'Range': 'bytes=9-5'})
+            self.assertEqual((status, body), (200, DATA), engine)
+
+    def test_stale_if_range_sends_everything(self):
+        for engine in self.engines:
+            status, _, body = self.request(engine, '/data.bin',
+                                           headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+            self.assertEqual((status, body), (200, DATA), engine)
+
+    def test_multipart(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/data.bin', headers={'Range': 'bytes=0-9,5000-5009'})
+            self.assertEqual(status, 206, engine)
+            self.assertEqual(int(headers['Content-Length']), len(body))
+            message = email.message_from_bytes(
+                b'Content-Type: ' + headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+            parts = [(part['Content-Range'], part.get_payload(decode=True)) for part in message.get_payload()]
+            self.assertEqual(parts, [(f'bytes 0-9/{len(DATA)}', DATA[0:10]),
+                                     (f'bytes 5000-5009/{len(DATA)}', DATA[5000:5010])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+import urllib.parse
+
+from modules.search import MetadataIndex, parse_search_query
+from tests import ServerTestCase
+
+FILES = ['report.pdf', 'old-report.txt', 'sub/Report-2024.doc', 'sub/notes.txt',
+         'sub0/report.bak', 'sub/deep/report.md', 'sub/.report.pdf.10.part']
+
+
+def make_tree(root):
+    for name in FILES:
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * len(name))
+
+
+class MetadataIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.share = os.path.join(tmp.name, 'share')
+        make_tree(self.share)
+        self.index = MetadataIndex(os.path.join(tmp.name, 'index.sqlite3'))
+        self.index.rescan(self.share)
+
+    def paths(self, query, within=''):
+        return [path for path, _, _, _ in self.index.search(self.share, query, within)[0]]
+
+    def test_prefix_matches_come_first(self):
+        self.assertEqual(self.paths('report'), ['sub/Report-2024.doc', 'sub0/report.bak', 'sub/deep/report.md',
+                                                'report.pdf', 'old-report.txt'])
+
+    def test_entries(self):
+        results, more = self.index.search(self.share, 'notes')
+        self.assertEqual(results[0][:3], ('sub/notes.txt', False, len('sub/notes.txt')))
+        self.assertFalse(more)
+        self.assertEqual(self.index.search(self.share, 'deep')[0][0][:3], ('sub/deep', True, None))
+
+    def test_within_a_subdirectory(self):
+        self.assertEqual(self.paths('report', 'sub'), ['sub/Report-2024.doc', 'sub/deep/report.md'])
+
+    def test_pages(self):
+        first, more = self.index.search(self.share, 'report', limit=2)
+        self.assertTrue(more)
+        rest, more = self.index.search(self.share, 'report', limit=10, offset=2)
+        self.assertFalse(more)
+        self.assertEqual([r[0] for r in first + rest], self.paths('report'))
+
+    def test_rescan_follows_changes(self):
+        os.unlink(os.path.join(self.share, 'report.pdf'))
+        os.rename(os.path.join(self.share, 'sub', 'deep'), os.path.join(self.share, 'moved'))
+        self.index.rescan(self.share)
+        self.assertEqual(self.paths('report'), ['sub/Report-2024.doc', 'sub0/report.bak',
+                                                'moved/report.md', 'old-report.txt'])
+
+    def test_parse_search_query(self):
+        self.assertEqual(parse_search_query('q=+report+&offset=5'), ('report', 5))
+        self.assertEqual(parse_search_query('q=a&offset=x'), ('a', 0))
+        self.assertIsNone(parse_search_query('q=+'))
+        self.assertIsNone(parse_search_query('sort=name'))
+
+
+class ServeSearchTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        make_tree(root)
+
+    def search(self, engine, path, query):
+        url = f'{path}?{urllib.parse.urlencode({"q": query})}&format=json'
+        deadline = time.monotonic() + 5
+        while True:
+            status, _, body = self.request(engine, url)
+            self.assertEqual(status, 200, engine)
+            doc = json.loads(body)
+            if doc['complete'] or time.monotonic() > deadline:
+                return doc
+            time.sleep(0.05)
+
+    def test_search(self):
+        for engine in self.engines:
+            doc = self.search(engine, '/sub/', 'REPORT')
+            self.assertTrue(doc['complete'], engine)
+            self.assertEqual([r['path'] for r in doc['results']], ['/sub/Report-2024.doc', '/sub/deep/report.md'])
+
+    def test_html_results(self):
+        self.search('threaded', '/', 'report')
+        for engine in self.engines:
+            body = self.request(engine, '/sub/?q=%3Cb%3Ereport')[2].decode()
+            self.assertIn('Search results for “&lt;b&gt;report”', body)
+            self.assertIn('No matches', body)
+            body = self.request(engine, '/sub/?q=notes')[2].decode()
+            self.assertIn('<a href="notes.txt"', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
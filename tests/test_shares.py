@@ -0,0 +1,98 @@
+import os
+import json
+import tempfile
+import unittest
+import http.client
+
+from modules.server import MultiShareServer
+from modules.shares import ShareTable, share_label
+from tests import CacheDirTestCase, free_port
+
+
+class ShareTableTest(unittest.TestCase):
+
+    def test_share_label(self):
+        self.assertEqual(share_label('My Stick'), 'My_Stick')
+        self.assertEqual(share_label('../x'), '_x')
+        self.assertEqual(share_label('..'), 'share')
+
+    def test_labels_are_unique(self):
+        table = ShareTable()
+        self.assertEqual(table.add('/media/a/STICK'), 'STICK')
+        self.assertEqual(table.add('/media/a/STICK'), 'STICK')
+        self.assertEqual(table.add('/media/b/STICK'), 'STICK_2')
+        self.assertEqual(table.add('/media/c', 'STICK'), 'STICK_3')
+        self.assertEqual(table.remove('STICK_2'), '/media/b/STICK')
+        self.assertIsNone(table.remove('STICK_2'))
+        self.assertEqual(table.directories(), ['/media/a/STICK', '/media/c'])
+
+    def test_resolve(self):
+        table = ShareTable()
+        table.add('/media/a', 'A B')
+        self.assertIsNone(table.resolve('/'))
+        self.assertIsNone(table.resolve('/share/?format=json'))
+        self.assertEqual(table.resolve('/share/A_B/x/y.txt?download=zip'), ('A_B', '/media/a', '/share/A_B'))
+        self.assertEqual(table.resolve('/share/nope/x'), ('nope', None, '/share/nope'))
+        self.assertEqual(table.resolve('/other'), ('', None, ''))
+
+
+class MultiShareTest(CacheDirTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dirs = {}
+        for label in ('one', 'two'):
+            directory = self.dirs[label] = os.path.join(tmp.name, label)
+            os.makedirs(os.path.join(directory, 'sub'))
+            with open(os.path.join(directory, 'sub', f'{label}.txt'), 'wb') as f:
+                f.write(label.encode('ascii') * 10)
+
+    def serve(self, engine):
+        self.port = free_port()
+        server = MultiShareServer(self.port, engine, open_browser=False, processes=1, tls=False)
+        for label, directory in self.dirs.items():
+            server.add_share(directory, label)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def request(self, path, headers=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            conn.request('GET', path, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
+
+    def check_shares(self, engine):
+        server = self.serve(engine)
+        status, _, body = self.request('/?format=json')
+        self.assertEqual(json.loads(body), {'shares': [{'name': 'one', 'href': '/share/one/'},
+                                                       {'name': 'two', 'href': '/share/two/'}]})
+        self.assertEqual(self.request('/share/one/sub/one.txt')[2], b'one' * 10)
+        status, headers, body = self.request('/share/two/sub/two.txt', {'Range': 'bytes=0-2'})
+        self.assertEqual((status, body), (206, b'two'))
+        listing = json.loads(self.request('/share/one/sub/?format=json')[2])
+        self.assertEqual((listing['path'], [e['name'] for e in listing['entries']]), ('/sub/', ['one.txt']))
+
+        self.assertEqual(self.request('/share/two/sub/one.txt')[0], 404)
+        self.assertEqual(self.request('/share/three/')[0], 404)
+        self.assertNotEqual(self.request('/share/one/../two/sub/two.txt')[2], b'two' * 10)
+
+        server.remove_share('two')
+        self.assertEqual(self.request('/share/two/sub/two.txt')[0], 404)
+        self.assertEqual([s['name'] for s in json.loads(self.request('/?format=json')[2])['shares']], ['one'])
+        server.add_share(self.dirs['two'], 'again')
+        self.assertEqual(self.request('/share/again/sub/two.txt')[2], b'two' * 10)
+
+    def test_threaded(self):
+        self.check_shares('threaded')
+
+    def test_asyncio(self):
+        self.check_shares('asyncio')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from modules.throttle import Shaper, SharedBuckets, TokenBucket, Throttle, MIN_QUANTUM, QUANTUM, shaper
+from tests import ServerTestCase
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patch = mock.patch('time.monotonic', lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(bucket.reserve(10 ** 12), 0)
+
+    def test_callers_queue_behind_each_other(self):
+        bucket = TokenBucket(1000)
+        self.assertEqual(bucket.reserve(1000), 0)
+        self.assertAlmostEqual(bucket.reserve(500), 0.5)
+        self.assertAlmostEqual(bucket.reserve(500), 1.0)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(1000, burst=2000)
+        bucket.reserve(2000)
+        self.now += 60
+        self.assertEqual(bucket.reserve(2000), 0)
+        self.assertAlmostEqual(bucket.reserve(1000), 1.0)
+
+
+class ShaperTest(unittest.TestCase):
+
+    def test_quantum_follows_the_slowest_cap(self):
+        self.assertEqual(Throttle([TokenBucket(0)]).quantum, QUANTUM)
+        self.assertEqual(Throttle([TokenBucket(10 ** 9), TokenBucket(800 * 1024)]).quantum, 100 * 1024)
+        self.assertEqual(Throttle([TokenBucket(1000)]).quantum, MIN_QUANTUM)
+
+    def test_slices(self):
+        data = bytes(MIN_QUANTUM * 2 + 1)
+        self.assertEqual(Throttle([TokenBucket(0)]).slices(data), [data])
+        pieces = Throttle([TokenBucket(1000)]).slices(data)
+        self.assertEqual([len(p) for p in pieces], [MIN_QUANTUM, MIN_QUANTUM, 1])
+
+    def test_clients_have_their_own_buckets(self):
+        shaper = Shaper(client_rate=1000)
+        shaper.throttle('/s', '10.0.0.1').reserve(1000)
+        self.assertGreater(shaper.throttle('/s', '10.0.0.1').reserve(1000), 0.9)
+        self.assertEqual(shaper.throttle('/s', '10.0.0.2').reserve(1000), 0)
+
+    def test_share_override(self):
+        shaper = Shaper(share_rate=1000)
+        shaper.set_share_rate('/fast', 0)
+        self.assertFalse(shaper.throttle('/fast', 'a').active)
+        self.assertTrue(shaper.throttle('/slow', 'a').active)
+        shaper.set_share_rate('/fast', None)
+        self.assertTrue(shaper.throttle('/fast', 'a').active)
+
+    def test_configure_applies_to_existing_buckets(self):
+        shaper = Shaper()
+        throttle = shaper.throttle('/s', 'a')
+        self.assertFalse(throttle.active)
+        shaper.configure(client_rate=1000)
+        self.assertTrue(throttle.active)
+        shaper.configure(client_rate=0)
+        self.assertFalse(throttle.active)
+
+
+class ShapedDownloadTest(ServerTestCase):
+
+    RATE = 400 * 1024
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(cls.RATE * 3 // 2))
+
+    def setUp(self):
+        rates = (shaper.global_bucket.rate, shaper.share_rate, shaper.client_rate)
+        self.addCleanup(shaper.configure, *rates)
+        shaper.configure(client_rate=self.RATE)
+
+    def test_download_is_paced(self):
+        for engine in self.engines:
+            started = time.monotonic()
+            status, _, body = self.request(engine, '/data.bin')
+            elapsed = time.monotonic() - started
+            self.assertEqual((status, len(body)), (200, self.RATE * 3 // 2), engine)
+            # The first RATE bytes are the burst, the rest takes half a second
+            self.assertGreater(elapsed, 0.4, engine)
+            self.assertLess(elapsed, 3, engine)
+
+
+class SharedBucketsTest(unittest.TestCase):
+    """Shapers sharing a bucket file (one per worker process) enforce one cap between them"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'buckets')
+
+    def shaper(self, **rates):
+        shaper = Shaper(**rates)
+        shaper.share_buckets(self.path)
+        return shaper
+
+    def test_global_cap_is_shared(self):
+        a, b = self.shaper(rate=1000), self.shaper(rate=1000)
+        self.assertEqual(a.throttle('/s', '10.0.0.1').reserve(1000), 0)
+        # The burst is spent, so the other worker has to wait for it to refill
+        self.assertGreater(b.throttle('/s', '10.0.0.2').reserve(1000), 0.9)
+
+    def test_client_and_share_caps_are_shared(self):
+        a, b = self.shaper(client_rate=1000), self.shaper(client_rate=1000)
+        a.throttle('/s', '10.0.0.1').reserve(1000)
+        self.assertGreater(b.throttle('/s', '10.0.0.1').reserve(1000), 0.9)
+        self.assertEqual(b.throttle('/s', '10.0.0.2').reserve(1000), 0)
+
+        a, b = self.shaper(share_rate=1000), self.shaper(share_rate=1000)
+        a.throttle('/one', '10.0.0.1').reserve(1000)
+        self.assertGreater(b.throttle('/one', '10.0.0.2').reserve(1000), 0.9)
+        self.assertEqual(b.throttle('/two', '10.0.0.2').reserve(1000), 0)
+
+    def test_full_table_reuses_slots(self):
+        table = SharedBuckets(self.path, slots=4)
+        for i in range(16):
+            self.assertEqual(table.reserve(f'client\0{i}', 1000, 1000, 500), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from modules import thumbnails
+from modules.thumbnails import (Thumbnailer, ThumbnailCache, parse_thumbnail_query, thumbnail_kind,
+                                thumbnail_etag, render_image, Image)
+from config import THUMBNAIL_SIZE
+from tests import ServerTestCase
+
+
+def fake_render(path, size):
+    if os.path.basename(path).startswith('broken'):
+        return None
+    return b'\xff\xd8 preview of %s at %d' % (os.path.basename(path).encode(), size)
+
+
+class PreviewToolsMixin:
+    """Pretends an image decoder is installed; previews come from fake_render"""
+
+    def patch_tools(self):
+        for patch in (mock.patch.object(thumbnails, 'FFMPEG', '/usr/bin/ffmpeg'),
+                      mock.patch.object(thumbnails, 'render_image', side_effect=fake_render)):
+            self.render = patch.start()
+            self.addCleanup(patch.stop)
+
+
+class ThumbnailQueryTest(unittest.TestCase):
+
+    def test_parse_thumbnail_query(self):
+        self.assertIsNone(parse_thumbnail_query('view=grid'))
+        self.assertEqual(parse_thumbnail_query('thumbnail'), THUMBNAIL_SIZE)
+        self.assertEqual(parse_thumbnail_query('thumbnail=x'), THUMBNAIL_SIZE)
+        self.assertEqual(parse_thumbnail_query('thumbnail=100'), 100)
+        self.assertEqual(parse_thumbnail_query('thumbnail=1'), thumbnails.MIN_SIZE)
+        self.assertEqual(parse_thumbnail_query('thumbnail=99999'), thumbnails.MAX_SIZE)
+
+    def test_kind_depends_on_installed_tools(self):
+        with mock.patch.object(thumbnails, 'Image', None), mock.patch.object(thumbnails, 'FFMPEG', None):
+            self.assertIsNone(thumbnail_kind('a.jpg'))
+        with mock.patch.object(thumbnails, 'FFMPEG', '/usr/bin/ffmpeg'):
+            self.assertEqual(thumbnail_kind('a.JPG'), 'image')
+            self.assertEqual(thumbnail_kind('a.mkv'), 'video')
+            self.assertIsNone(thumbnail_kind('a.txt'))
+
+
+class ThumbnailerTest(PreviewToolsMixin, unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.patch_tools()
+        self.thumbnailer = Thumbnailer(ThumbnailCache(os.path.join(self.tmp, 'cache'), 1024 * 1024))
+
+    def picture(self, name):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(b'not really a picture')
+        return path, os.stat(path)
+
+    def test_rendered_once_then_cached(self):
+        path, st = self.picture('a.png')
+        self.assertEqual(self.thumbnailer.get(path, st, 64, timeout=5), fake_render(path, 64))
+        self.assertEqual(self.thumbnailer.cached(path, st, 64), fake_render(path, 64))
+        self.assertIsNone(self.thumbnailer.cached(path, st, 128))
+        # A new thumbnailer (another worker process) finds it on disk
+        again = Thumbnailer(ThumbnailCache(os.path.join(self.tmp, 'cache'), 1024 * 1024))
+        self.assertEqual(again.get(path, st, 64, timeout=5), fake_render(path, 64))
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_concurrent_requests_share_a_job(self):
+        path, st = self.picture('a.png')
+        gate = threading.Event()
+        self.render.side_effect = lambda *args: gate.wait(5) and fake_render(*args)
+        futures = [self.thumbnailer.generate(path, st, 64) for _ in range(4)]
+        gate.set()
+        self.assertEqual({f.result(5) for f in futures}, {fake_render(path, 64)})
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_failures_are_remembered(self):
+        path, st = self.picture('broken.png')
+        self.assertIsNone(self.thumbnailer.get(path, st, 64, timeout=5))
+        self.assertIsNone(self.thumbnailer.get(path, st, 64, timeout=5))
+        self.assertEqual(self.render.call_count, 1)
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_render_image(self):
+        path = os.path.join(self.tmp, 'big.png')
+        Image.new('RGBA', (800, 400), (255, 0, 0, 128)).save(path)
+        with Image.open(io.BytesIO(render_image(path, 100))) as preview:
+            self.assertEqual((preview.format, preview.size), ('JPEG', (100, 50)))
+
+
+class ServeThumbnailTest(PreviewToolsMixin, ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        for name in ('pic.png', 'broken.png', 'notes.txt'):
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(b'content')
+
+    def setUp(self):
+        self.patch_tools()
+
+    def test_preview(self):
+        path = os.path.join(self.root, 'pic.png')
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/pic.png?thumbnail=64')
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['Content-Type'], 'image/jpeg')
+            self.assertEqual(body, fake_render(path, 64))
+            self.assertEqual(headers['ETag'], thumbnail_etag(os.stat(path), 64))
+            status, _, _ = self.request(engine, '/pic.png?thumbnail=64', headers={'If-None-Match': headers['ETag']})
+            self.assertEqual(status, 304)
+
+    def test_grid_links_previews(self):
+        for engine in self.engines:
+            body = self.request(engine, '/?view=grid')[2].decode()
+            self.assertIn('<img src="pic.png?thumbnail" loading="lazy"', body)
+            self.assertNotIn('notes.txt?thumbnail', body)
+
+    def test_no_preview(self):
+        for engine in self.engines:
+            self.assertEqual(self.request(engine, '/notes.txt?thumbnail')[0], 404, engine)
+            self.assertEqual(self.request(engine, '/broken.png?thumbnail')[0], 404, engine)
+            self.assertEqual(self.request(engine, '/pic.png')[2], b'content')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import ssl
+import socket
+import functools
+import tempfile
+import unittest
+from unittest import mock
+
+from modules import server as server_module
+from modules.tls import self_signed_certificate, server_context
+from modules.server import FileServer
+from tests import CacheDirTestCase, free_port
+
+DATA = os.urandom(3 * 1024 * 1024 + 7)
+
+
+class TLSTest(CacheDirTestCase):
+    """HTTPS on both engines with a generated self-signed certificate"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cert, key = self_signed_certificate(os.path.join(cls.cache_dir, 'tls'))
+        patch = mock.patch.object(server_module, 'server_context', functools.partial(server_context, cls.cert, key))
+        patch.start()
+        cls.addClassCleanup(patch.stop)
+        root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(root.cleanup)
+        with open(os.path.join(root.name, 'data.bin'), 'wb') as f:
+            f.write(DATA)
+        cls.ports = {}
+        for engine in ('threaded', 'asyncio'):
+            port = cls.ports[engine] = free_port()
+            server = FileServer(root.name, port, engine, open_browser=False, processes=1, tls=True)
+            server.start()
+            cls.addClassCleanup(server.stop)
+
+    def setUp(self):
+        self.context = ssl.create_default_context(cafile=self.cert)
+        self.context.set_alpn_protocols(['http/1.1'])
+
+    def exchange(self, engine, request, session=None):
+        """Send one request that closes the connection; returns the response and the TLS details"""
+        raw = socket.create_connection(('127.0.0.1', self.ports[engine]), timeout=5)
+        with self.context.wrap_socket(raw, server_hostname='localhost', session=session) as sock:
+            sock.sendall(request)
+            chunks = []
+            while True:
+                chunk = sock.recv(1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            tls = {'alpn': sock.selected_alpn_protocol(), 'session': sock.session, 'reused': sock.session_reused}
+            return b''.join(chunks), tls
+
+    def get(self, engine, path, headers=b'', session=None):
+        request = b'GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n%s\r\n' % (path, headers)
+        response, tls = self.exchange(engine, request, session)
+        head, _, body = response.partition(b'\r\n\r\n')
+        return head, body, tls
+
+    def test_certificate(self):
+        key = os.path.join(os.path.dirname(self.cert), 'key.pem')
+        self.assertEqual(os.stat(key).st_mode & 0o777, 0o600)
+        mtime = os.stat(self.cert).st_mtime_ns
+        self.assertEqual(self_signed_certificate(os.path.dirname(self.cert))[0], self.cert)
+        self.assertEqual(os.stat(self.cert).st_mtime_ns, mtime)
+        names = ssl._ssl._test_decode_cert(self.cert)['subjectAltName']
+        self.assertIn(('DNS', 'localhost'), names)
+        self.assertIn(('IP Address', '127.0.0.1'), names)
+
+    def test_download(self):
+        for engine in self.ports:
+            head, body, tls = self.get(engine, b'/data.bin')
+            self.assertTrue(head.startswith(b'HTTP/1.1 200'), engine)
+            self.assertEqual(body, DATA, engine)
+            self.assertEqual(tls['alpn'], 'http/1.1')
+
+    def test_range(self):
+        for engine in self.ports:
+            head, body, _ = self.get(engine, b'/data.bin', b'Range: bytes=1000000-1000099\r\n')
+            self.assertTrue(head.startswith(b'HTTP/1.1 206'), engine)
+            self.assertEqual(body, DATA[1000000:1000100])
+
+    def test_session_resumption(self):
+        for engine in self.ports:
+            _, _, first = self.get(engine, b'/')
+            self.assertFalse(first['reused'])
+            _, body, second = self.get(engine, b'/', session=first['session'])
+            self.assertTrue(second['reused'], engine)
+            self.assertIn(b'data.bin', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import errno
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from modules import transfer
+from modules.transfer import send_file, Readahead, readahead_for, READAHEAD_START, READAHEAD_MAX
+from tests import ServerTestCase
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+
+def received(send):
+    """Bytes that arrive on the far end of a socket pair while send(sock) runs"""
+    sock, peer = socket.socketpair()
+    chunks = []
+
+    def read():
+        while True:
+            chunk = peer.recv(1 << 20)
+            if not chunk:
+                return
+            chunks.append(chunk)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        result = send(sock)
+    finally:
+        sock.close()
+        reader.join()
+        peer.close()
+    return result, b''.join(chunks)
+
+
+class SendFileTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(DATA)
+        self.f = open(path, 'rb')
+        self.addCleanup(self.f.close)
+
+    def test_plain_socket_uses_sendfile(self):
+        with mock.patch('os.sendfile', wraps=os.sendfile) as sendfile:
+            sent, data = received(lambda sock: send_file(sock, self.f, 0, len(DATA)))
+        self.assertTrue(sendfile.called)
+        self.assertEqual(sent, len(DATA))
+        self.assertEqual(data, DATA)
+
+    def test_range(self):
+        sent, data = received(lambda sock: send_file(sock, self.f, 1000, 5000))
+        self.assertEqual((sent, data), (5000, DATA[1000:6000]))
+
+    def test_falls_back_to_copying(self):
+        refused = OSError(errno.EINVAL, 'sendfile not supported')
+        with mock.patch('os.sendfile', side_effect=refused):
+            sent, data = received(lambda sock: send_file(sock, self.f, 10, len(DATA) - 10))
+        self.assertEqual(sent, len(DATA) - 10)
+        self.assertEqual(data, DATA[10:])
+
+    def test_empty_range(self):
+        self.assertEqual(received(lambda sock: send_file(sock, self.f, 0, 0)), (0, b''))
+
+
+MB = 1024 * 1024
+
+
+class ReadaheadTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch('os.posix_fadvise')
+        self.fadvise = patch.start()
+        self.addCleanup(patch.stop)
+        self.f = mock.Mock()
+        self.f.fileno.return_value = 7
+
+    def advice(self, kind):
+        return [(offset, length) for _, offset, length, advice in
+                (c.args for c in self.fadvise.call_args_list) if advice == kind]
+
+    def test_short_range_is_random(self):
+        readahead = Readahead(self.f, 5000, 64 * 1024)
+        self.assertFalse(readahead.sequential)
+        self.assertEqual(self.advice(os.POSIX_FADV_RANDOM), [(5000, 64 * 1024)])
+        self.assertEqual(readahead.before(5000, 64 * 1024), 64 * 1024)
+        self.assertEqual(self.advice(os.POSIX_FADV_WILLNEED), [])
+
+    def test_windows_double_and_prefetch_ahead(self):
+        readahead = Readahead(self.f, 0, 20 * MB)
+        self.assertEqual(self.advice(os.POSIX_FADV_SEQUENTIAL), [(0, 20 * MB)])
+        sizes = []
+        pos = 0
+        while pos < 20 * MB:
+            n = readahead.before(pos, 20 * MB - pos)
+            sizes.append(n)
+            pos += n
+        self.assertEqual(sizes, [2 * MB, 4 * MB, 8 * MB, 6 * MB])
+        self.assertEqual(self.advice(os.POSIX_FADV_WILLNEED), [(2 * MB, 4 * MB), (6 * MB, 8 * MB), (14 * MB, 6 * MB)])
+        self.assertEqual(self.advice(os.POSIX_FADV_DONTNEED), [])
+
+    def test_window_is_capped(self):
+        readahead = Readahead(self.f, 0, 1024 * MB)
+        pos = 0
+        for _ in range(10):
+            pos += readahead.before(pos, 1024 * MB - pos)
+        self.assertEqual(readahead.window, READAHEAD_MAX)
+        self.assertLessEqual(max(length for _, length in self.advice(os.POSIX_FADV_WILLNEED)), READAHEAD_MAX)
+
+    def test_drop_behind(self):
+        readahead = Readahead(self.f, 0, 20 * MB, drop_behind=True)
+        readahead.after(0, MB)
+        self.assertEqual(self.advice(os.POSIX_FADV_DONTNEED), [])
+        readahead.after(MB, READAHEAD_START)
+        readahead.after(MB + READAHEAD_START, MB)
+        self.assertEqual(self.advice(os.POSIX_FADV_DONTNEED), [(0, MB + READAHEAD_START)])
+
+    def test_readahead_for(self):
+        with mock.patch.object(transfer, 'FADVISE_DROP_BEHIND_SIZE', 100 * MB):
+            self.assertFalse(readahead_for(self.f, 0, 50 * MB, 50 * MB).drop_behind)
+            self.assertTrue(readahead_for(self.f, 0, 50 * MB, 200 * MB).drop_behind)
+            self.assertFalse(readahead_for(self.f, 0, MB // 2, 200 * MB).drop_behind)
+
+
+class SendWithReadaheadTest(unittest.TestCase):
+
+    def test_windows_add_up(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.bin')
+            with open(path, 'wb') as f:
+                for i in range(9):
+                    f.write(bytes([i]) * MB)
+            with open(path, 'rb') as f:
+                readahead = Readahead(f, MB // 2, 8 * MB)
+                sent, data = received(lambda sock: send_file(sock, f, MB // 2, 8 * MB, readahead=readahead))
+        self.assertEqual(sent, 8 * MB)
+        self.assertEqual(data, b''.join(bytes([i]) * MB for i in range(9))[MB // 2:MB // 2 + 8 * MB])
+
+
+class ServeFileTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        with open(os.path.join(root, 'data.bin'), 'wb') as f:
+            f.write(DATA)
+
+    def test_get(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/data.bin')
+            self.assertEqual(status, 200)
+            self.assertEqual(int(headers['Content-Length']), len(DATA))
+            self.assertEqual(body, DATA, engine)
+
+    def test_head(self):
+        for engine in self.engines:
+            status, headers, body = self.request(engine, '/data.bin', 'HEAD')
+            self.assertEqual(status, 200)
+            self.assertEqual(int(headers['Content-Length']), len(DATA))
+            self.assertEqual(body, b'')
+
+    def test_missing_file(self):
+        for engine in self.engines:
+            self.assertEqual(self.request(engine, '/nope.bin')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
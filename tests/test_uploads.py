@@ -0,0 +1,153 @@
+import os
+import time
+import socket
+import tempfile
+import unittest
+import http.client
+from unittest import mock
+
+from modules import server as threaded_server
+from modules import async_server
+from modules.server import FileServer
+from modules.upload import UploadError, parse_content_range, partial_path, expire_partials
+from tests import CacheDirTestCase, free_port
+
+
+class ContentRangeTest(unittest.TestCase):
+
+    def test_parse_content_range(self):
+        self.assertEqual(parse_content_range(None, 10), (0, 10))
+        self.assertEqual(parse_content_range('bytes 0-9/30', 10), (0, 30))
+        self.assertEqual(parse_content_range('bytes 20-29/30', 10), (20, 30))
+        self.assertEqual(parse_content_range('bytes */30', 0), (None, 30))
+
+    def test_rejects_mismatches(self):
+        for header, length in [('bytes 0-9/30', 5), ('bytes 25-34/30', 10),
+                               ('bytes 9-0/30', 10), ('items 0-9/30', 10), ('bytes 0-9', 10)]:
+            with self.assertRaises(UploadError) as cm:
+                parse_content_range(header, length)
+            self.assertEqual(cm.exception.code, 400, header)
+
+    def test_expire_partials(self):
+        with tempfile.TemporaryDirectory() as root:
+            old = partial_path(os.path.join(root, 'old.bin'), 10)
+            fresh = partial_path(os.path.join(root, 'fresh.bin'), 10)
+            other = os.path.join(root, 'kept.bin')
+            for path in (old, fresh, other):
+                open(path, 'wb').close()
+            stale = time.time() - 3600
+            for path in (old, other):
+                os.utime(path, (stale, stale))
+            expire_partials(root, max_age=60)
+            self.assertEqual(sorted(os.listdir(root)), sorted(os.path.basename(p) for p in (fresh, other)))
+
+
+class UploadTest(CacheDirTestCase):
+    """PUT uploads on both engines"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for module in (threaded_server, async_server):
+            patch = mock.patch.object(module, 'UPLOADS_ENABLED', True)
+            patch.start()
+            cls.addClassCleanup(patch.stop)
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def serve(self, engine):
+        port = free_port()
+        server = FileServer(self.root, port, engine, open_browser=False, processes=1, tls=False)
+        server.start()
+        self.addCleanup(server.stop)
+        return port
+
+    def put(self, port, path, body, headers=None):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        try:
+            conn.request('PUT', path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            return response.status, response.headers
+        finally:
+            conn.close()
+
+    def check_resumable(self, engine):
+        port = self.serve(engine)
+        data = os.urandom(300000)
+        status, headers = self.put(port, '/big.bin', data[:100000],
+                                   {'Content-Range': f'bytes 0-99999/{len(data)}'})
+        self.assertEqual(status, 202)
+        self.assertEqual(headers['Upload-Offset'], '100000')
+        self.assertEqual(headers['Range'], 'bytes=0-99999')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'big.bin')))
+
+        status, headers = self.put(port, '/big.bin', b'', {'Content-Range': f'bytes */{len(data)}'})
+        self.assertEqual((status, headers['Upload-Offset']), (202, '100000'))
+
+        status, headers = self.put(port, '/big.bin', data[100000:],
+                                   {'Content-Range': f'bytes 100000-299999/{len(data)}'})
+        self.assertEqual(status, 201)
+        with open(os.path.join(self.root, 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(self.root), ['big.bin'])
+
+        status, _ = self.put(port, '/big.bin', b'replaced')
+        self.assertEqual(status, 200)
+
+    def check_rejected(self, engine):
+        port = self.serve(engine)
+        status, headers = self.put(port, '/gap.bin', b'x' * 10, {'Content-Range': 'bytes 10-19/20'})
+        self.assertEqual((status, headers['Upload-Offset']), (409, '0'))
+        self.assertEqual(self.put(port, '/missing/a.bin', b'x')[0], 409)
+        self.assertEqual(self.put(port, '/bad.bin', b'x' * 10, {'Content-Range': 'bytes 0-4/20'})[0], 400)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_resumable_threaded(self):
+        self.check_resumable('threaded')
+
+    def test_resumable_asyncio(self):
+        self.check_resumable('asyncio')
+
+    def test_rejected_threaded(self):
+        self.check_rejected('threaded')
+
+    def test_rejected_asyncio(self):
+        self.check_rejected('asyncio')
+
+    def test_disabled(self):
+        for module in (threaded_server, async_server):
+            patch = mock.patch.object(module, 'UPLOADS_ENABLED', False)
+            patch.start()
+            self.addCleanup(patch.stop)
+        for engine in ('threaded', 'asyncio'):
+            self.assertEqual(self.put(self.serve(engine), '/a.bin', b'x')[0], 405, engine)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def check_expect_continue(self, engine):
+        port = self.serve(engine)
+        body = b'x' * 100000
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+            sock.sendall(b'PUT /up.bin HTTP/1.1\r\nHost: x\r\nExpect: 100-continue\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body))
+            # curl waits about a second for this before sending the body anyway
+            sock.settimeout(0.5)
+            self.assertEqual(sock.recv(65536), b'HTTP/1.1 100 Continue\r\n\r\n')
+            sock.settimeout(5)
+            sock.sendall(body)
+            self.assertTrue(sock.recv(65536).startswith(b'HTTP/1.1 201'))
+        with open(os.path.join(self.root, 'up.bin'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    def test_expect_continue_threaded(self):
+        self.check_expect_continue('threaded')
+
+    def test_expect_continue_asyncio(self):
+        self.check_expect_continue('asyncio')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import json
+import unittest
+from unittest import mock
+
+from modules import usb_manager
+from modules.usb_manager import (BlockDevice, BlockEvents, DriveCache, lsblk_devices, find_usb_partitions,
+                                 parse_uevent, read_mounts, DRIVE_CACHE_TTL)
+
+LSBLK = {'blockdevices': [
+    {'name': 'sda', 'pkname': None, 'fstype': None, 'size': 500107862016, 'mountpoint': None,
+     'label': None, 'uuid': None, 'type': 'disk', 'tran': 'sata', 'rm': False, 'hotplug': False,
+     'children': [{'name': 'sda1', 'pkname': 'sda', 'fstype': 'ext4', 'size': 500106813440,
+                   'mountpoint': '/', 'label': None, 'uuid': 'root', 'type': 'part', 'tran': None,
+                   'rm': False, 'hotplug': False}]},
+    {'name': 'sdb', 'fstype': None, 'size': '16008609792', 'mountpoint': None, 'label': None,
+     'uuid': None, 'type': 'disk', 'tran': 'usb', 'rm': '1', 'hotplug': '1',
+     'children': [{'name': 'sdb1', 'fstype': 'vfat', 'size': '16007561216', 'mountpoint': '/media/My Stick',
+                   'label': 'My Stick', 'uuid': 'ABCD-1234', 'type': 'part', 'rm': '1', 'hotplug': '1'}]},
+    {'name': 'sdc', 'fstype': 'exfat', 'size': '', 'mountpoint': None, 'label': 'RAW', 'uuid': 'EF01',
+     'type': 'disk', 'tran': 'usb', 'rm': True, 'hotplug': True},
+]}
+
+
+def device(name, **fields):
+    values = dict(parent=None, fstype='vfat', size=None, mountpoint=None, label=None, uuid=None,
+                  type='part', tran=None, removable=False)
+    values.update(fields)
+    return BlockDevice(name=name, **values)
+
+
+class FakeEvents(BlockEvents):
+
+    def __init__(self, running=True):
+        super().__init__()
+        self.watchable = running
+
+    def start(self):
+        self.running = self.watchable
+        return self.running
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def test_lsblk_devices(self):
+        with mock.patch('subprocess.check_output', return_value=json.dumps(LSBLK).encode()):
+            devices = {dev.name: dev for dev in lsblk_devices()}
+        self.assertEqual(sorted(devices), ['sda', 'sda1', 'sdb', 'sdb1', 'sdc'])
+        stick = devices['sdb1']
+        self.assertEqual((stick.parent, stick.tran, stick.removable, stick.size, stick.label),
+                         ('sdb', 'usb', True, 16007561216, 'My Stick'))
+        self.assertEqual((devices['sda1'].parent, devices['sda1'].removable), ('sda', False))
+        self.assertIsNone(devices['sdc'].size)
+
+    def test_find_usb_partitions(self):
+        with mock.patch('subprocess.check_output', return_value=json.dumps(LSBLK).encode()):
+            found = find_usb_partitions(lsblk_devices())
+        # The partitioned stick shows its partition, the unpartitioned one itself
+        self.assertEqual([dev.name for dev in found], ['sdb1', 'sdc'])
+
+    def test_parse_uevent(self):
+        event = parse_uevent(b'add@/devices/x/block/sdb/sdb1\0ACTION=add\0SUBSYSTEM=block\0DEVNAME=sdb1\0junk')
+        self.assertEqual(event, {'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': 'sdb1'})
+
+    def test_read_mounts(self):
+        mounts = ('/dev/sdb1 /media/My\\040Stick vfat rw 0 0\n'
+                  'proc /proc proc rw 0 0\n'
+                  '/dev/sdb1 /mnt/again vfat rw 0 0\n')
+        with mock.patch('builtins.open', mock.mock_open(read_data=mounts)), \
+                mock.patch('os.path.realpath', side_effect=lambda p: p):
+            self.assertEqual(read_mounts(), {'sdb1': '/media/My Stick'})
+
+
+class DriveCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = [device('sdb1', parent='sdb', tran='usb')]
+        patch = mock.patch.object(usb_manager, 'lsblk_devices', side_effect=lambda: list(self.devices))
+        self.lsblk = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_cached_until_a_uevent(self):
+        events = FakeEvents()
+        cache = DriveCache(events)
+        self.assertEqual([d.name for d in cache.get()], ['sdb1'])
+        self.devices.append(device('sdc1', parent='sdc', tran='usb'))
+        self.assertEqual([d.name for d in cache.get()], ['sdb1'])
+        self.assertEqual(self.lsblk.call_count, 1)
+        events.emit({'ACTION': 'add', 'SUBSYSTEM': 'block', 'DEVNAME': 'sdc1'})
+        self.assertEqual([d.name for d in cache.get()], ['sdb1', 'sdc1'])
+        self.assertEqual(len(cache.get(refresh=True)), 2)
+        self.assertEqual(self.lsblk.call_count, 3)
+
+    def test_expires_without_uevents(self):
+        now = [1000.0]
+        cache = DriveCache(FakeEvents(running=False))
+        with mock.patch('time.monotonic', lambda: now[0]):
+            cache.get()
+            now[0] += DRIVE_CACHE_TTL - 1
+            cache.get()
+            self.assertEqual(self.lsblk.call_count, 1)
+            now[0] += 2
+            cache.get()
+            self.assertEqual(self.lsblk.call_count, 2)
+
+    def test_falls_back_to_sysfs(self):
+        self.lsblk.side_effect = FileNotFoundError('lsblk')
+        with mock.patch.object(usb_manager, 'sysfs_devices', return_value=self.devices) as sysfs:
+            self.assertEqual([d.name for d in DriveCache(FakeEvents()).get()], ['sdb1'])
+        self.assertTrue(sysfs.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
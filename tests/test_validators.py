@@ -0,0 +1,86 @@
+import os
+import unittest
+import email.utils
+from types import SimpleNamespace
+
+from modules.validators import (make_etag, make_listing_etag, encoded_etag, etag_matches,
+                                is_not_modified, last_modified)
+from tests import ServerTestCase
+
+MTIME = 1700000000
+
+
+class ValidatorTest(unittest.TestCase):
+
+    def test_etags(self):
+        st = SimpleNamespace(st_ino=0x10, st_size=0x20, st_mtime_ns=0x30)
+        self.assertEqual(make_etag(st), '"10-20-30"')
+        self.assertEqual(make_listing_etag(st), 'W/"d-10-30"')
+        self.assertEqual(make_listing_etag(st, 'json'), 'W/"d-10-30-json"')
+        self.assertEqual(encoded_etag('"10-20-30"', 'gzip'), '"10-20-30-gzip"')
+        self.assertEqual(encoded_etag('"10-20-30"', None), '"10-20-30"')
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('W/"a"', '"a"'))
+        self.assertTrue(etag_matches('"a"', 'W/"a"'))
+        self.assertTrue(etag_matches('"x", "a" ,"y"', '"a"'))
+        self.assertTrue(etag_matches(' * ', '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+
+    def test_is_not_modified(self):
+        date = email.utils.formatdate(MTIME, usegmt=True)
+        self.assertTrue(is_not_modified({'If-Modified-Since': date}, '"a"', MTIME + 0.5))
+        self.assertFalse(is_not_modified({'If-Modified-Since': date}, '"a"', MTIME + 1))
+        self.assertFalse(is_not_modified({'If-Modified-Since': 'garbage'}, '"a"', MTIME))
+        self.assertFalse(is_not_modified({}, '"a"', MTIME))
+
+    def test_if_none_match_takes_precedence(self):
+        date = email.utils.formatdate(MTIME, usegmt=True)
+        self.assertFalse(is_not_modified({'If-None-Match': '"b"', 'If-Modified-Since': date}, '"a"', MTIME))
+        self.assertTrue(is_not_modified({'If-None-Match': '"a"', 'If-Modified-Since': 'garbage'}, '"a"', MTIME))
+
+
+class ConditionalGetTest(ServerTestCase):
+
+    @classmethod
+    def populate(cls, root):
+        path = os.path.join(root, 'a.txt')
+        with open(path, 'wb') as f:
+            f.write(b'hello')
+        os.utime(path, (MTIME, MTIME))
+
+    def test_file_validators(self):
+        for engine in self.engines:
+            status, headers, _ = self.request(engine, '/a.txt')
+            self.assertEqual(status, 200, engine)
+            self.assertEqual(headers['ETag'], make_etag(os.stat(os.path.join(self.root, 'a.txt'))))
+            self.assertEqual(headers['Last-Modified'], last_modified(SimpleNamespace(st_mtime=MTIME)))
+
+    def test_if_none_match(self):
+        for engine in self.engines:
+            etag = self.request(engine, '/a.txt')[1]['ETag']
+            status, headers, body = self.request(engine, '/a.txt', headers={'If-None-Match': etag})
+            self.assertEqual((status, body), (304, b''), engine)
+            self.assertEqual(headers['ETag'], etag)
+            status, _, body = self.request(engine, '/a.txt', headers={'If-None-Match': '"other"'})
+            self.assertEqual((status, body), (200, b'hello'), engine)
+
+    def test_if_modified_since(self):
+        for engine in self.engines:
+            date = email.utils.formatdate(MTIME, usegmt=True)
+            self.assertEqual(self.request(engine, '/a.txt', headers={'If-Modified-Since': date})[0], 304)
+            earlier = email.utils.formatdate(MTIME - 60, usegmt=True)
+            self.assertEqual(self.request(engine, '/a.txt', headers={'If-Modified-Since': earlier})[0], 200)
+
+    def test_listing(self):
+        for engine in self.engines:
+            status, headers, _ = self.request(engine, '/')
+            self.assertEqual(status, 200, engine)
+            self.assertTrue(headers['ETag'].startswith('W/'))
+            status, _, body = self.request(engine, '/', headers={'If-None-Match': headers['ETag']})
+            self.assertEqual((status, body), (304, b''), engine)
+
+
+if __name__ == '__main__':
+    unittest.main()